@@ -0,0 +1,75 @@
+import re
+
+'''
+聚合查询：COUNT / SUM / AVG / MIN / MAX 和 GROUP BY
+扫描的同时做哈希聚合：记录逐条流过，每个分组只保存几个累加值，内存只与分组的个数有关，与表的大小无关
+'''
+
+
+class Aggregator:
+    functions = ('count', 'sum', 'avg', 'min', 'max')
+    pattern = re.compile(r'^(\w+)\s*\(\s*(\*|\w+)\s*\)$')
+
+    @staticmethod
+    def parseAttribute(attribute):  # 'count(*)' -> ('count', '*')，'sum( age )' -> ('sum', 'age')。不是聚合函数时返回None
+        match = Aggregator.pattern.match(attribute.strip())
+        if match is None or match.group(1).lower() not in Aggregator.functions:
+            return None
+        return match.group(1).lower(), match.group(2)
+
+    @staticmethod
+    def normalize(attribute):  # 输出的列名，例如 'COUNT( * )' -> 'count(*)'
+        parsed = Aggregator.parseAttribute(attribute)
+        if parsed is None:
+            return attribute.strip()
+        return f'{parsed[0]}({parsed[1]})'
+
+    def __init__(self, items, groupIndices):
+        # items：输出的每一列。('group', 在分组key中的下标)，或 (函数名, 字段在记录中的下标)，count(*)的下标为None
+        # groupIndices：group by 的字段在记录中的下标
+        self.items = items
+        self.groupIndices = groupIndices
+
+    def initialState(self):  # 一个分组的累加值。avg是 [和, 个数]，其余是一个值
+        return [[0, 0] if func == 'avg' else (0 if func == 'count' else None) for func, _ in self.items]
+
+    def aggregate(self, records):
+        # 生成器：消费完所有记录后，每个分组返回一行（按分组第一次出现的顺序）
+        # 没有 group by 时即使没有记录也返回一行：count是0，其余是None
+        items = self.items
+        groupIndices = self.groupIndices
+        groups = {}
+        for record in records:
+            key = tuple([record[i] for i in groupIndices])
+            state = groups.get(key)
+            if state is None:
+                state = groups[key] = self.initialState()
+            for j, (func, index) in enumerate(items):
+                if func == 'count':
+                    state[j] += 1
+                elif func == 'group':
+                    continue
+                else:
+                    value = record[index]
+                    if func == 'avg':
+                        state[j][0] += value
+                        state[j][1] += 1
+                    elif state[j] is None:
+                        state[j] = value
+                    elif func == 'sum':
+                        state[j] += value
+                    elif (func == 'min' and value < state[j]) or (func == 'max' and value > state[j]):
+                        state[j] = value
+
+        if not groups and not groupIndices:
+            groups[()] = self.initialState()
+        for key, state in groups.items():
+            row = []
+            for (func, index), value in zip(items, state):
+                if func == 'group':
+                    row.append(key[index])
+                elif func == 'avg':
+                    row.append(value[0] / value[1] if value[1] > 0 else None)
+                else:
+                    row.append(value)
+            yield row
@@ -1,9 +1,17 @@
+import os
+import csv
 import time
+from itertools import islice
 from catalogMgr import CatalogMgr
 from indexMgr import IndexMgr
-from bufferMgr import BufferMgr
+from bufferMgr import BufferMgr, roundFloat
+from logMgr import LogMgr
+from planner import Planner
+from sorter import Sorter
+from aggregator import Aggregator
+from joiner import Joiner
 
-from exception import QueryException
+from exception import QueryException, BufferException
 
 class ResultPrinter:
     def printSelect(attributes, attributeIndices, records):
@@ -18,7 +26,9 @@ class ResultPrinter:
         print('|')
 
         print('-' * (columnFrameWidth * len(attributeIndices) + 1))
-        for record in records:
+        recordNum = 0
+        for record in records:  # records可以是游标，查到一行就输出一行
+            recordNum += 1
             for index in attributeIndices:
                 outputStr = str(record[index])
                 if len(outputStr) > columnWidth:
@@ -27,19 +37,126 @@ class ResultPrinter:
             print('|')
         print('-' * (columnFrameWidth * len(attributeIndices) + 1))
 
-        print(f'查询到 {len(records)} 条记录。', end='')
-        
+        print(f'查询到 {recordNum} 条记录。', end='')
+
+
+class Cursor:
+    # 查询结果的游标。记录在fetch的时候才从表中读出、解码，不会一次把整个结果放进内存
+    # 扫描直接在表上进行，游标没有读完之前修改这张表，修改是否可见是不确定的
+    arraysize = 100  # fetchmany() 默认一次取几行
+
+    def __init__(self, description, rows):
+        self.description = description  # 每一列的字段名
+        self.rows = rows  # 每一行是一个list，按description的顺序
+        self.rowcount = 0  # 已经取出了几行
+
+    def fetchone(self):  # 没有更多的行时返回None
+        row = next(self.rows, None)
+        if row is not None:
+            self.rowcount += 1
+        return row
+
+    def fetchmany(self, size=None):  # 没有更多的行时返回[]
+        rows = list(islice(self.rows, self.arraysize if size is None else size))
+        self.rowcount += len(rows)
+        return rows
+
+    def fetchall(self):
+        rows = list(self.rows)
+        self.rowcount += len(rows)
+        return rows
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        row = next(self.rows)
+        self.rowcount += 1
+        return row
+
+    def close(self):  # 提前关闭，释放扫描中被钉住的页
+        close = getattr(self.rows, 'close', None)  # islice没有close()，它被释放时下层的生成器随之关闭
+        if close is not None:
+            close()
+        self.rows = iter(())
+
 
 class Api:
+    loadChunkSize = 10000  # 批量导入时每次解析、打包、写入多少行
+    rebuildRatio = 0.3  # 导入的行数超过表中原有行数的这个比例时，导入后自底向上重建索引，否则逐个插入索引
+
     def __init__(self, path):
         self.catalogMgr = CatalogMgr(path)
-        self.indexMgr = IndexMgr(path)
-        self.bufferMgr = BufferMgr(path, self.catalogMgr.tables)
+        self.logMgr = LogMgr(path)
+        self.indexMgr = IndexMgr(path, self.catalogMgr.tables)
+        self.bufferMgr = BufferMgr(path, self.catalogMgr.tables, logMgr=self.logMgr)
+        self.planner = Planner(self.catalogMgr, self.indexMgr, self.bufferMgr)
+        self.recover()
+
+    def recover(self):  # 重放还没有写入数据文件的日志
+        startTime = time.time()
+        replayNum = 0
+        for lsn, op, tableName, addr, insertPos, record in self.logMgr.readRecords():
+            if not self.catalogMgr.checkExistTable(tableName):
+                continue
+            values = self.bufferMgr.decodeRecord(tableName, record)
+            columnHash = self.catalogMgr.getColumnHash(tableName)
+            self.indexMgr.deleteRecord(tableName, values, addr, columnHash)  # 先删再插，索引中是否已有这条修改都没关系
+            if op == b'I':
+                self.bufferMgr.redoInsert(tableName, addr, record, insertPos, lsn)
+                self.indexMgr.insertRecord(tableName, values, addr, columnHash)
+            else:
+                self.bufferMgr.redoDelete(tableName, addr, insertPos, lsn)
+            replayNum += 1
+
+        if replayNum > 0 or self.logMgr.validSize != os.path.getsize(self.logMgr.logFile):
+            self.checkpoint()  # 恢复完立刻写入数据文件，清空日志（包括写了一半的日志）
+        endTime = time.time()
+        print(f'从日志中重放了 {replayNum} 条修改，用了 {(endTime - startTime) * 1000} 毫秒。')
+
+    def checkpointIfNeeded(self):  # 日志太大或距离上次检查点太久时做检查点
+        if self.logMgr.needCheckpoint():
+            logSize = self.logMgr.logSize
+            startTime = time.time()
+            self.checkpoint()
+            endTime = time.time()
+            print(f'日志有 {logSize} 字节，做检查点用了 {(endTime - startTime) * 1000} 毫秒。')
+
+    def checkpoint(self):  # 把所有修改写入数据文件，然后清空日志。返回各部分的 (用时, 写入量)
+        startTime = time.time()
+        self.logMgr.flush()
+        catalogNum = self.catalogMgr.save()
+        catalogTime = time.time()
+        indexNum = self.indexMgr.save()
+        indexTime = time.time()
+        pageNum = self.bufferMgr.save()
+        endTime = time.time()
+        self.logMgr.truncate()
+        return {
+            'catalog': ((catalogTime - startTime) * 1000, catalogNum),
+            'index': ((indexTime - catalogTime) * 1000, indexNum),
+            'record': ((endTime - indexTime) * 1000, pageNum)
+        }
+
+    def save(self):  # 只写回被修改过的部分，并报告各部分用时
+        startTime = time.time()
+        stats = self.checkpoint()
+        endTime = time.time()
+
+        print(f'保存用了 {(endTime - startTime) * 1000} 毫秒：'
+              f'目录 {stats["catalog"][0]} 毫秒（写了 {stats["catalog"][1]} 个文件），'
+              f'索引 {stats["index"][0]} 毫秒（写了 {stats["index"][1]} 个索引），'
+              f'记录 {stats["record"][0]} 毫秒（写了 {stats["record"][1]} 页）。')
 
-    def save(self):
-        self.catalogMgr.save()
-        self.indexMgr.save()
-        self.bufferMgr.save()
+    def commit(self):  # 提交只需要把日志写入文件
+        startTime = time.time()
+        writeNum = self.logMgr.flush()
+        endTime = time.time()
+        print(f'提交用了 {(endTime - startTime) * 1000} 毫秒（写了 {writeNum} 字节日志）。')
+
+    def close(self):
+        self.save()
+        self.logMgr.close()
 
     def createTable(self, tableName, attributes, primaryKey):
         startTime = time.time()
@@ -51,11 +168,12 @@ class Api:
         self.indexMgr.createTable(tableName, primaryKey)
         columns = self.catalogMgr.tables[tableName].columns
         self.bufferMgr.createTable(tableName, columns)
+        self.checkpoint()  # 日志中不记录表结构的修改，所以修改表结构后立即写入数据文件
 
         endTime = time.time()
         print(f'创建表 {tableName} 用了 {(endTime - startTime) * 1000} 毫秒。')
 
-    def createIndex(self, indexName, tableName, attributeName):
+    def createIndex(self, indexName, tableName, attributeName, order=None, using='btree'):
         startTime = time.time()
 
         if not self.catalogMgr.checkExistTable(tableName):
@@ -64,11 +182,17 @@ class Api:
         if self.catalogMgr.checkExistIndex(indexName):
             raise QueryException(f'索引 {indexName} 已存在！')
 
-        uniqueKeyWithIndex = self.indexMgr.getUniqueKeysWithIndex(tableName)
-        if attributeName in uniqueKeyWithIndex:
+        if self.catalogMgr.getKeyIndex(tableName, attributeName) == -1:
+            raise QueryException(f"表 {tableName} 中不存在名为 {attributeName} 的字段")
+
+        keysWithIndex = self.indexMgr.getKeysWithIndex(tableName, using)  # 一个字段上可以各有一个B+树索引和哈希索引
+        if attributeName in keysWithIndex:
             raise QueryException(f'在属性 {attributeName} 上的索引已存在！')
 
-        self.catalogMgr.createIndex(indexName, tableName, attributeName)
+        if order is not None and not 3 <= order <= IndexMgr.maxOrder:
+            raise QueryException(f'B+ 树的阶数必须在 3 到 {IndexMgr.maxOrder} 之间！')
+
+        self.catalogMgr.createIndex(indexName, tableName, attributeName, using)
 
         columnHash = self.catalogMgr.getColumnHash(tableName)  # 从columnName到index的映射
         #  全表扫描
@@ -84,9 +208,10 @@ class Api:
         for record in recordsFound:
             uniqueKeyValues.append(record[uniqueKeyIndex])
 
-        uniqueKeyValuesDict = dict(zip(uniqueKeyValues, correspondingAddrs))
+        uniqueKeyValuesAndAddrs = list(zip(uniqueKeyValues, correspondingAddrs))
 
-        self.indexMgr.createIndex(tableName, attributeName, uniqueKeyValuesDict)
+        self.indexMgr.createIndex(tableName, attributeName, uniqueKeyValuesAndAddrs, order, using)
+        self.checkpoint()
 
         endTime = time.time()
         print(f'创建索引 {indexName} 用了 {(endTime - startTime) * 1000} 毫秒。')        
@@ -100,6 +225,8 @@ class Api:
         self.catalogMgr.dropTable(tableName)
         self.indexMgr.dropTable(tableName)
         self.bufferMgr.dropTable(tableName)
+        self.planner.dropTable(tableName)
+        self.checkpoint()
 
         endTime = time.time()
         print(f'删除表 {tableName} 用了 {(endTime - startTime) * 1000} 毫秒。')
@@ -110,54 +237,256 @@ class Api:
         if not self.catalogMgr.checkExistIndex(indexName):
             raise QueryException(f'当前索引 {indexName} 不存在！')
 
-        tableName, keyName = self.catalogMgr.dropIndex(indexName)
-        self.indexMgr.dropIndex(tableName, keyName)
+        tableName, keyName, using = self.catalogMgr.dropIndex(indexName)
+        self.indexMgr.dropIndex(tableName, keyName, using)
+        self.checkpoint()
 
         endTime = time.time()
         print(f'删除在表 {tableName} 的属性 {keyName} 上的索引 {indexName} 用了 {(endTime - startTime) * 1000} 毫秒。')
 
-    def select(self, tableName, attributes, wheres):
-        startTime = time.time()
-
+    def openCursor(self, tableName, attributes, wheres, limit=None, offset=0, orderBy=None, groupBy=None, join=None):
+        # 返回游标，行在fetch的时候才查出来。limit不是None时最多返回limit行，跳过前offset行；够了就不再扫描
+        # orderBy是 (字段名, 'asc' 或 'desc')，None表示不排序。groupBy是字段名的list
+        # join是 (右表名, on左边的字段名, on右边的字段名)，即 from tableName join 右表 on 字段 = 字段，None表示单表查询
         if not self.catalogMgr.checkExistTable(tableName):
             raise QueryException(f'当前表 {tableName} 不存在！')
+        if limit is not None and (not isinstance(limit, int) or limit < 0):
+            raise QueryException('limit 必须是非负整数')
+        if not isinstance(offset, int) or offset < 0:
+            raise QueryException('offset 必须是非负整数')
+        if join is not None:
+            if groupBy is not None or any(Aggregator.parseAttribute(attribute) is not None for attribute in attributes):
+                raise QueryException('抱歉，暂不支持对连接的结果做聚合查询')
+            return self.openJoinCursor([tableName, join[0]], attributes, wheres, limit, offset, orderBy, join[1:])
+        if groupBy is not None or any(Aggregator.parseAttribute(attribute) is not None for attribute in attributes):
+            return self.openAggregateCursor(tableName, attributes, wheres, limit, offset, orderBy, groupBy or [])
 
         flag, columnName = self.catalogMgr.checkSelectStatement(tableName, attributes, wheres)
         if flag is False:
             raise QueryException(f"表 {tableName} 中不存在名为 {columnName} 的字段")
+        columnHash = self.catalogMgr.getColumnHash(tableName)  # 从columnName到index的映射
+        if orderBy is not None:
+            orderKey, order = orderBy
+            if orderKey not in columnHash:
+                raise QueryException(f"表 {tableName} 中不存在名为 {orderKey} 的字段")
+            if order not in ('asc', 'desc'):
+                raise QueryException('order by 只支持 asc 和 desc')
+        rowLimit = None if limit is None else offset + limit  # 最多需要前几行
+
+        if orderBy is None:
+            plan = self.planner.plan(tableName, wheres)  # 按统计信息选择全表扫描、索引查找或多个索引取交集
+        else:
+            plan = self.planner.planOrder(tableName, wheres, orderKey, rowLimit)  # 还要比较按索引的顺序读和读出来再排序
+        uniqueKeyWheres = plan.indexWheres  # 索引检索（B+树或哈希索引，唯一索引和非唯一索引）
+        notUniqueKeyWheres = plan.residualWheres  # 全表扫描，或者对索引查到的记录再筛选
+
+        if plan.method == 'indexOrder':  # 沿B+树叶子链表按顺序读，已经是排好序的
+            recordsFound = self.bufferMgr.iterOrderedRecords(
+                tableName,
+                columnHash,
+                notUniqueKeyWheres,
+                self.indexMgr.iterOrdered(tableName, orderKey, uniqueKeyWheres, order == 'desc')
+            )
+            records = (record for _, record in recordsFound)
+        else:
+            uniqueKeyResultAddrs = self.indexMgr.select4UniqueKey(
+                tableName,
+                uniqueKeyWheres
+            )
+            recordsFound = self.bufferMgr.iterRecords(
+                tableName, 
+                columnHash,
+                notUniqueKeyWheres,
+                uniqueKeyWheres,
+                uniqueKeyResultAddrs,
+                rowLimit if orderBy is None else None
+            )
+            records = (record for _, record in recordsFound)
+            if orderBy is not None:  # 有LIMIT时用堆，否则外部归并排序
+                records = Sorter(columnHash[orderKey], order == 'desc').sort(records, rowLimit)
 
-        uniqueKeyWithIndex = self.indexMgr.getUniqueKeysWithIndex(tableName)
-        uniqueKeyWheres = []  # B+树检索
-        notUniqueKeyWheres = []  # 全表扫描
-        for where in wheres:
-            if where['lVal'] in uniqueKeyWithIndex:
-                uniqueKeyWheres.append(where)
+        if attributes == ['*']:
+            attributes = list(columnHash.keys())
+            rows = records
+        else:
+            attributeIndices = [columnHash[attribute] for attribute in attributes]
+            rows = ([record[index] for index in attributeIndices] for record in records)
+        if limit is not None or offset > 0:  # 取够了islice就不再向下层要记录，扫描随之停止
+            rows = islice(rows, offset, rowLimit)
+        return Cursor(attributes, rows)
+
+    def openAggregateCursor(self, tableName, attributes, wheres, limit, offset, orderBy, groupBy):
+        # 聚合查询。没有where和group by时，count来自BufferMgr维护的行数，有B+树索引的字段的min/max来自索引，都不读记录文件；
+        # 否则按where选好的路径扫描，边扫描边做哈希聚合
+        flag, columnName = self.catalogMgr.checkSelectStatement(tableName, ['*'], wheres)
+        if flag is False:
+            raise QueryException(f"表 {tableName} 中不存在名为 {columnName} 的字段")
+        columnHash = self.catalogMgr.getColumnHash(tableName)  # 从columnName到index的映射
+        columns = self.catalogMgr.tables[tableName].columns
+        for columnName in groupBy:
+            if columnName not in columnHash:
+                raise QueryException(f"表 {tableName} 中不存在名为 {columnName} 的字段")
+
+        items = []  # 输出的每一列，见 Aggregator
+        description = []
+        for attribute in attributes:
+            parsed = Aggregator.parseAttribute(attribute)
+            if parsed is None:
+                columnName = attribute.strip()
+                if columnName not in groupBy:
+                    raise QueryException(f'字段 {columnName} 必须出现在 group by 中，或者用在聚合函数中')
+                items.append(('group', groupBy.index(columnName)))
             else:
-                notUniqueKeyWheres.append(where)
+                func, columnName = parsed
+                if columnName == '*':
+                    if func != 'count':
+                        raise QueryException(f'{func}() 中不能用 *')
+                    items.append((func, None))
+                else:
+                    if columnName not in columnHash:
+                        raise QueryException(f"表 {tableName} 中不存在名为 {columnName} 的字段")
+                    if func in ('sum', 'avg') and columns[columnHash[columnName]].type == 'char':
+                        raise QueryException(f'{func}() 不能用于 char 类型的字段 {columnName}')
+                    items.append((func, columnHash[columnName]))
+            description.append(Aggregator.normalize(attribute))
+
+        keysWithIndex = self.indexMgr.getKeysWithIndex(tableName, 'btree')
+        if not wheres and not groupBy and all(
+            func == 'count' or (func in ('min', 'max') and columns[index].columnName in keysWithIndex) for func, index in items
+        ):
+            print('您正在用表的行数和B+树索引回答聚合查询，不读取记录文件。')
+            row = []
+            for func, index in items:
+                if func == 'count':
+                    row.append(self.bufferMgr.getRowNum(tableName))
+                else:
+                    row.append(self.indexMgr.getExtremeKey(tableName, columns[index].columnName, func == 'max'))
+            rows = iter([row])
+        else:
+            aggregator = Aggregator(items, [columnHash[columnName] for columnName in groupBy])
+            rows = aggregator.aggregate(self.iterPlanRecords(tableName, self.planner.plan(tableName, wheres)))
+
+        rowLimit = None if limit is None else offset + limit
+        if orderBy is not None:  # 可以按输出的任意一列排序，例如 order by count(*) desc
+            orderKey, order = orderBy
+            orderKey = Aggregator.normalize(orderKey)
+            if orderKey not in description:
+                raise QueryException(f'聚合查询只能按 select 中的列排序，{orderKey} 不在其中')
+            if order not in ('asc', 'desc'):
+                raise QueryException('order by 只支持 asc 和 desc')
+            rows = Sorter(description.index(orderKey), order == 'desc').sort(rows, rowLimit)
+        if limit is not None or offset > 0:
+            rows = islice(rows, offset, rowLimit)
+        return Cursor(description, rows)
+
+    def openJoinCursor(self, tableNames, attributes, wheres, limit, offset, orderBy, on):
+        # 两个表的等值连接。字段名可以写成 表名.字段名，只在一个表中出现的字段也可以只写字段名
+        # where条件分给各自的表，在连接之前筛选；结果每一行是左表的记录接上右表的记录，再排序、取出select的字段
+        for tableName in tableNames:
+            if not self.catalogMgr.checkExistTable(tableName):
+                raise QueryException(f'当前表 {tableName} 不存在！')
+        if tableNames[0] == tableNames[1]:
+            raise QueryException('抱歉，暂不支持表和它自己连接')
+        columnHashes = [self.catalogMgr.getColumnHash(tableName) for tableName in tableNames]
+        offsets = [0, len(columnHashes[0])]  # 连接结果中，左表的字段在前，右表的字段在后
+
+        keys = sorted(self.resolveJoinColumn(tableNames, columnName) for columnName in on)
+        if keys[0][0] == keys[1][0]:
+            raise QueryException('连接条件两边的字段必须分别属于两个表')
+        keyNames = [keys[0][1], keys[1][1]]
+        keyTypes = [self.catalogMgr.tables[tableName].columns[columnHash[keyName]].type
+                    for tableName, columnHash, keyName in zip(tableNames, columnHashes, keyNames)]
+        if (keyTypes[0] == 'char') != (keyTypes[1] == 'char'):
+            raise QueryException(f'连接字段 {keyNames[0]} 和 {keyNames[1]} 的类型不同，不能比较')
+
+        tableWheres = [[], []]
+        for where in wheres:
+            side, columnName = self.resolveJoinColumn(tableNames, where['lVal'])
+            tableWheres[side].append(dict(where, lVal=columnName))
 
-        uniqueKeyResultAddrs = self.indexMgr.select4UniqueKey(
+        if attributes == ['*']:
+            attributes = [f'{tableName}.{columnName}' for tableName, columnHash in zip(tableNames, columnHashes) for columnName in columnHash]
+            attributeIndices = None
+        else:
+            attributeIndices = []
+            for attribute in attributes:
+                side, columnName = self.resolveJoinColumn(tableNames, attribute)
+                attributeIndices.append(offsets[side] + columnHashes[side][columnName])
+        if orderBy is not None:
+            side, columnName = self.resolveJoinColumn(tableNames, orderBy[0])
+            orderIndex = offsets[side] + columnHashes[side][columnName]
+            if orderBy[1] not in ('asc', 'desc'):
+                raise QueryException('order by 只支持 asc 和 desc')
+        rowLimit = None if limit is None else offset + limit
+
+        plan = self.planner.planJoin(tableNames, tableWheres, keyNames, rowLimit if orderBy is None else None)
+        joiner = Joiner(columnHashes[0][keyNames[0]], columnHashes[1][keyNames[1]])
+        inner = plan.inner
+        outer = 1 - inner
+        if plan.method == 'hashJoin':
+            print(f'您正在进行哈希连接，用表 {tableNames[inner]} 构建哈希表。')
+            records = joiner.hashJoin(
+                self.iterPlanRecords(tableNames[0], plan.plans[0]),
+                self.iterPlanRecords(tableNames[1], plan.plans[1]),
+                inner
+            )
+        else:
+            print(f'您正在进行索引嵌套循环连接，在表 {tableNames[inner]} 字段 {keyNames[inner]} 的索引中查找。')
+            innerTable, innerKey = tableNames[inner], keyNames[inner]
+            lookup = lambda keys: self.bufferMgr.lookupRecords(  # 一批key一起查，查到的记录按地址顺序读
+                innerTable,
+                columnHashes[inner],
+                tableWheres[inner],
+                [list(self.indexMgr.iterLeafs(innerTable, innerKey, '=', key)) for key in keys]
+            )
+            records = joiner.indexNestedLoopJoin(self.iterPlanRecords(tableNames[outer], plan.plans[outer]), lookup, inner)
+
+        if orderBy is not None:
+            records = Sorter(orderIndex, orderBy[1] == 'desc').sort(records, rowLimit)
+        if attributeIndices is None:
+            rows = records
+        else:
+            rows = ([record[index] for index in attributeIndices] for record in records)
+        if limit is not None or offset > 0:
+            rows = islice(rows, offset, rowLimit)
+        return Cursor(attributes, rows)
+
+    def resolveJoinColumn(self, tableNames, columnName):
+        # 连接查询中的字段名 -> (0 或 1，表示左表或右表, 不带表名的字段名)
+        if '.' in columnName:
+            tableName, columnName = columnName.split('.', 1)
+            if tableName not in tableNames:
+                raise QueryException(f'表 {tableName} 不在这个查询中')
+            side = tableNames.index(tableName)
+            if columnName not in self.catalogMgr.getColumnHash(tableName):
+                raise QueryException(f"表 {tableName} 中不存在名为 {columnName} 的字段")
+            return side, columnName
+        sides = [side for side, tableName in enumerate(tableNames) if columnName in self.catalogMgr.getColumnHash(tableName)]
+        if not sides:
+            raise QueryException(f"表 {tableNames[0]} 和 {tableNames[1]} 中都不存在名为 {columnName} 的字段")
+        if len(sides) > 1:
+            raise QueryException(f'字段 {columnName} 在两个表中都有，请写成 表名.{columnName}')
+        return sides[0], columnName
+
+    def iterPlanRecords(self, tableName, plan):  # 按plan()选好的路径查找，返回解码后的记录的迭代器
+        uniqueKeyResultAddrs = self.indexMgr.select4UniqueKey(tableName, plan.indexWheres)
+        recordsFound = self.bufferMgr.iterRecords(
             tableName,
-            uniqueKeyWheres
-        )
-
-        columnHash = self.catalogMgr.getColumnHash(tableName)  # 从columnName到index的映射
-        recordsFound, _ = self.bufferMgr.findRecords(
-            tableName, 
-            columnHash,
-            notUniqueKeyWheres,
-            uniqueKeyWheres,
+            self.catalogMgr.getColumnHash(tableName),
+            plan.residualWheres,
+            plan.indexWheres,
             uniqueKeyResultAddrs
         )
+        return (record for _, record in recordsFound)
 
-        attributeIndices = []
-        if attributes == ['*']:
-            attributes = list(columnHash.keys())
-            attributeIndices = list(columnHash.values())
-        else:
-            for attribute in attributes:
-                attributeIndices.append(columnHash[attribute])
+    def select(self, tableName, attributes, wheres, limit=None, offset=0, orderBy=None, groupBy=None, join=None):
+        startTime = time.time()
 
-        ResultPrinter.printSelect(attributes, attributeIndices, recordsFound)
+        cursor = self.openCursor(tableName, attributes, wheres, limit, offset, orderBy, groupBy, join)
+        try:
+            ResultPrinter.printSelect(cursor.description, list(range(len(cursor.description))), cursor)
+        finally:
+            cursor.close()
         endTime = time.time()
         print(f'查询操作用了 {(endTime - startTime) * 1000} 毫秒。')
     
@@ -166,6 +495,176 @@ class Api:
 
         if not self.catalogMgr.checkExistTable(tableName):
             raise QueryException(f'当前表 {tableName} 不存在！')
+        self.checkValues(tableName, values)
+        uniqueKeyWithIndexHash, uniqueKeyNotWithIndexColumns = self.getUniqueKeys(tableName)
+
+        # B+树检查唯一性
+        self.indexMgr.checkUnique(tableName, values, uniqueKeyWithIndexHash)
+        # 全表扫描检查唯一性放在bufferMgr.insertRecord里面
+        columns = self.catalogMgr.tables[tableName].columns
+        insertPos = self.bufferMgr.insertRecord(tableName, values, columns, uniqueKeyNotWithIndexColumns)
+        self.logMgr.logInsert(
+            tableName,
+            insertPos,
+            self.bufferMgr.getInsertPos(tableName),
+            self.bufferMgr.getRecord(tableName, insertPos)
+        )
+
+        self.indexMgr.insertRecord(tableName, values, insertPos, self.catalogMgr.getColumnHash(tableName))
+        self.planner.recordInsert(tableName, values)
+        self.checkpointIfNeeded()
+
+        endTime = time.time()
+        print(f'插入记录操作用了 {(endTime - startTime) * 1000} 毫秒。')
+
+    def insertMany(self, tableName, rows):
+        # 批量插入。整批记录先全部检查（类型、批内重复、索引、全表扫描各一遍），都通过了才写入，否则一条也不插入
+        startTime = time.time()
+
+        if not self.catalogMgr.checkExistTable(tableName):
+            raise QueryException(f'当前表 {tableName} 不存在！')
+        for values in rows:
+            self.checkValues(tableName, values)
+        uniqueKeyWithIndexHash, uniqueKeyNotWithIndexColumns = self.getUniqueKeys(tableName)
+
+        columns = self.catalogMgr.tables[tableName].columns
+        records = self.bufferMgr.packRecords(tableName, rows)
+        self.indexMgr.checkUniqueRecords(tableName, rows, uniqueKeyWithIndexHash)
+        for column in uniqueKeyNotWithIndexColumns:  # 没有索引的unique字段，批内的重复也要检查
+            columnIndex = columns.index(column)
+            if len({values[columnIndex] for values in rows}) < len(rows):
+                raise QueryException(f'记录插入失败，原因它违反了表中属性 {column.columnName} 定义的唯一性')
+        self.bufferMgr.checkUniqueRecords(tableName, records, columns, uniqueKeyNotWithIndexColumns)
+
+        slots = self.bufferMgr.allocateRecords(tableName, len(records))
+        self.logMgr.logInserts(  # 先写日志，再修改缓冲池中的页
+            tableName,
+            ((addr, insertPos, record) for (addr, insertPos), record in zip(slots, records))
+        )
+        self.bufferMgr.writeRecords(tableName, slots, records)
+
+        self.indexMgr.insertRecords(tableName, rows, [addr for addr, _ in slots], self.catalogMgr.getColumnHash(tableName))
+        for values in rows:
+            self.planner.recordInsert(tableName, values)
+        self.checkpointIfNeeded()
+
+        endTime = time.time()
+        print(f'插入 {len(rows)} 条记录用了 {(endTime - startTime) * 1000} 毫秒。')
+
+    def loadData(self, tableName, fileName):
+        # 从CSV文件批量导入（load data from 'file.csv' into t）。每次解析 loadChunkSize 行，直接打包成record按页写入
+        # 索引在导入结束后一次性维护。遇到不合法的行时停止，之前的各块已经导入
+        startTime = time.time()
+
+        if not self.catalogMgr.checkExistTable(tableName):
+            raise QueryException(f'当前表 {tableName} 不存在！')
+        columns = self.catalogMgr.tables[tableName].columns
+        columnHash = self.catalogMgr.getColumnHash(tableName)
+        # float字段存为4字节float，转换时就舍入，唯一性检查和索引中用的都是存下来的值
+        converters = [{'int': int, 'float': lambda field: roundFloat(float(field))}.get(column.type, str) for column in columns]
+        charLens = [(i, column.charLen) for i, column in enumerate(columns) if column.type == 'char']
+        uniqueKeyWithIndexHash, uniqueKeyNotWithIndexColumns = self.getUniqueKeys(tableName)
+
+        # 唯一性：有索引的unique字段查索引，没有索引的先扫描一遍表收集已有的值；再加上这次导入的值
+        existingValues = {columns.index(column): set() for column in uniqueKeyNotWithIndexColumns}
+        if existingValues:
+            for _, values in self.bufferMgr.scanColumns(tableName, list(existingValues)):
+                for existing, columnValues in zip(existingValues.values(), values):
+                    existing.update(columnValues)
+        loadedValues = {i: set() for i in list(uniqueKeyWithIndexHash.values()) + list(existingValues)}
+
+        indexKeys = [(keyName, 'btree') for keyName in self.indexMgr.getKeysWithIndex(tableName, 'btree')] \
+            + [(keyName, 'hash') for keyName in self.indexMgr.getKeysWithIndex(tableName, 'hash')]
+        existingNum = self.bufferMgr.getRecordNum(tableName) - 1  # 含空洞，只用来估计
+        if existingNum == 0:  # 空表，不用在索引中查找
+            uniqueKeyWithIndexHash = {}
+        indexItems = {indexKey: [] for indexKey in indexKeys}  # 导入的行不多时，导入后逐个插入索引
+        loadNum = 0
+        lineNum = 0
+        error = None
+        try:
+            with open(fileName, 'r', newline='', encoding='utf-8') as csvFile:
+                reader = csv.reader(csvFile)
+                while True:
+                    lines = list(islice(reader, Api.loadChunkSize))
+                    if not lines:
+                        break
+                    rows = []
+                    for line in lines:
+                        lineNum += 1
+                        if not line:  # 空行
+                            continue
+                        if len(line) != len(columns):
+                            raise QueryException(f'文件 {fileName} 第 {lineNum} 行有 {len(line)} 列，表 {tableName} 含有 {len(columns)} 列')
+                        try:
+                            values = [convert(field) for convert, field in zip(converters, line)]
+                        except ValueError:
+                            raise QueryException(f'文件 {fileName} 第 {lineNum} 行的数据类型与表 {tableName} 的定义不匹配')
+                        for i, charLen in charLens:
+                            if len(values[i]) > charLen:
+                                raise QueryException(f'文件 {fileName} 第 {lineNum} 行的 char 类型数据超出定义的最大长度 {charLen}')
+                        for i, loaded in loadedValues.items():
+                            if values[i] in loaded or values[i] in existingValues.get(i, ()):
+                                raise QueryException(f'文件 {fileName} 第 {lineNum} 行违反了表中属性 {columns[i].columnName} 定义的唯一性')
+                            loaded.add(values[i])
+                        for uniqueKey, i in uniqueKeyWithIndexHash.items():
+                            if self.indexMgr.checkExistKey(tableName, uniqueKey, values[i]):
+                                raise QueryException(f'文件 {fileName} 第 {lineNum} 行违反了表中属性 {uniqueKey} 定义的唯一性')
+                        rows.append(values)
+
+                    records = self.bufferMgr.packRecords(tableName, rows)
+                    slots = self.bufferMgr.allocateRecords(tableName, len(records))
+                    self.logMgr.logInserts(  # 先写日志，再修改缓冲池中的页
+                        tableName,
+                        ((addr, insertPos, record) for (addr, insertPos), record in zip(slots, records))
+                    )
+                    self.bufferMgr.writeRecords(tableName, slots, records)
+                    loadNum += len(rows)
+                    if indexItems is not None and loadNum > existingNum * Api.rebuildRatio:
+                        indexItems = None  # 导入的行很多，最后重建索引，不再记录
+                    if indexItems is not None:
+                        for (keyName, using), items in indexItems.items():
+                            i = columnHash[keyName]
+                            items.extend(zip((values[i] for values in rows), (addr for addr, _ in slots)))
+        except (QueryException, BufferException) as exception:
+            error = exception
+
+        if loadNum > 0:
+            if indexItems is None:  # 扫描一遍表，每个索引排序后自底向上重建
+                keyIndices = [columnHash[keyName] for keyName, _ in indexKeys]
+                indexItems = {indexKey: [] for indexKey in indexKeys}
+                for addrs, values in self.bufferMgr.scanColumns(tableName, keyIndices):
+                    for items, columnValues in zip(indexItems.values(), values):
+                        items.extend(zip(columnValues, addrs))
+                for (keyName, using), items in indexItems.items():
+                    self.indexMgr.rebuildIndex(tableName, keyName, items, using)
+            else:
+                self.indexMgr.insertItems(tableName, indexItems)
+            self.planner.resetStats(tableName)
+        self.checkpoint()  # 导入的记录和重建的索引都写入文件
+
+        endTime = time.time()
+        print(f'从 {fileName} 导入 {loadNum} 条记录用了 {(endTime - startTime) * 1000} 毫秒。')
+        if error is not None:
+            raise error
+
+    def copyTable(self, tableName, fileName):  # 把表中的记录导出到CSV文件（copy t to 'file.csv'），边扫描边写
+        startTime = time.time()
+
+        if not self.catalogMgr.checkExistTable(tableName):
+            raise QueryException(f'当前表 {tableName} 不存在！')
+        columnIndices = list(self.catalogMgr.getColumnHash(tableName).values())
+        copyNum = 0
+        with open(fileName, 'w', newline='', encoding='utf-8') as csvFile:
+            writer = csv.writer(csvFile)
+            for addrs, values in self.bufferMgr.scanColumns(tableName, columnIndices):
+                writer.writerows(zip(*values))
+                copyNum += len(addrs)
+
+        endTime = time.time()
+        print(f'导出 {copyNum} 条记录到 {fileName} 用了 {(endTime - startTime) * 1000} 毫秒。')
+
+    def checkValues(self, tableName, values):  # 检查一条记录与表的定义是否匹配
         flag, msg, data = self.catalogMgr.checkValidType(tableName, values)
         if flag is False:
             if msg == 'TooFewColumns':
@@ -175,6 +674,8 @@ class Api:
             else:
                 raise QueryException(f'插入表 {tableName} 的过程中出现未知错误')
 
+    def getUniqueKeys(self, tableName):
+        # 返回 (建立了唯一索引的unique字段: 下标, 没有唯一索引的unique字段列表)。前者用索引检查唯一性，后者要全表扫描
         uniqueKeyWithIndex = self.indexMgr.getUniqueKeysWithIndex(tableName)
         uniqueKeyHash = self.catalogMgr.getUniqueKeyHash(tableName)
         uniqueKeyWithIndexHash = {}
@@ -187,17 +688,7 @@ class Api:
         for uniqueKeyColumn in uniqueKeyColumns:
             if uniqueKeyColumn.columnName not in uniqueKeyWithIndex:
                 uniqueKeyNotWithIndexColumns.append(uniqueKeyColumn)
-
-        # B+树检查唯一性
-        self.indexMgr.checkUnique(tableName, values, uniqueKeyWithIndexHash)
-        # 全表扫描检查唯一性放在bufferMgr.insertRecord里面
-        columns = self.catalogMgr.tables[tableName].columns
-        insertPos = self.bufferMgr.insertRecord(tableName, values, columns, uniqueKeyNotWithIndexColumns)
-        
-        self.indexMgr.insertRecord(tableName, values, insertPos, uniqueKeyHash)
-
-        endTime = time.time()
-        print(f'插入记录操作用了 {(endTime - startTime) * 1000} 毫秒。')
+        return uniqueKeyWithIndexHash, uniqueKeyNotWithIndexColumns
 
     def delete(self, tableName, wheres):
         startTime = time.time()
@@ -209,14 +700,9 @@ class Api:
         if flag is False:
             raise QueryException(f"表 {tableName} 中不存在名为 {columnName} 的字段")
 
-        uniqueKeyWithIndex = self.indexMgr.getUniqueKeysWithIndex(tableName)
-        uniqueKeyWheres = []  # B+树检索
-        notUniqueKeyWheres = []  # 全表扫描
-        for where in wheres:
-            if where['lVal'] in uniqueKeyWithIndex:
-                uniqueKeyWheres.append(where)
-            else:
-                notUniqueKeyWheres.append(where)
+        plan = self.planner.plan(tableName, wheres)  # 按统计信息选择全表扫描、索引查找或多个索引取交集
+        uniqueKeyWheres = plan.indexWheres  # 索引检索（B+树或哈希索引，唯一索引和非唯一索引）
+        notUniqueKeyWheres = plan.residualWheres  # 全表扫描，或者对索引查到的记录再筛选
 
         uniqueKeyResultAddrs = self.indexMgr.select4UniqueKey(
             tableName,
@@ -232,11 +718,16 @@ class Api:
             uniqueKeyResultAddrs
         )
 
+        nextPos = self.bufferMgr.getInsertPos(tableName)
+        for addr in correspondingAddrs:  # 先写日志，再修改缓冲池中的页。每个删掉的位置依次成为空洞链表的表头
+            self.logMgr.logDelete(tableName, addr, nextPos, self.bufferMgr.getRecord(tableName, addr))
+            nextPos = addr
         self.bufferMgr.deleteRecords(tableName, correspondingAddrs)
 
-        uniqueKeyHash = self.catalogMgr.getUniqueKeyHash(tableName)
-        for record in recordsFound:
-            self.indexMgr.deleteRecord(tableName, record, uniqueKeyHash)
+        for record, addr in zip(recordsFound, correspondingAddrs):
+            self.indexMgr.deleteRecord(tableName, record, addr, columnHash)
+        self.planner.recordDelete(tableName, len(correspondingAddrs))
+        self.checkpointIfNeeded()
                     
         endTime = time.time()
         print(f'删除 {len(correspondingAddrs)} 条记录用了 {(endTime - startTime) * 1000} 毫秒。')
@@ -1,17 +1,42 @@
 import math
+from array import array
+from itertools import chain
+from exception import BPlusTreeException
+from bisect import bisect_left, bisect_right
 
 class Node:
-    def __init__(self, order=4, parent=None, keys=[], children=[]) -> None:
+    # 用 __slots__ 代替每个实例的 __dict__，索引很多时能省下不少内存
+    # pager 不为空时，结点对应索引文件中的一页（pageNo），孩子可能还是未读入内存的页号
+    __slots__ = ('order', 'parent', 'keys', 'children', 'pager', 'pageNo')
+
+    def __init__(self, order=4, parent=None, keys=None, children=None, pager=None) -> None:
         self.order = order
         self.parent: Node = parent
-        self.keys = keys
-        self.children = children
+        self.keys = keys if keys is not None else []
+        self.children = children if children is not None else []
+        self.pager = pager
+        self.pageNo = None
+        if pager is not None:
+            pager.allocate(self)  # 新结点分配一页，并记为dirty
 
     def __str__(self) -> str:
         return 'Node: keys =' + str(self.keys)
 
-    def __eq__(self, other):
-        return self.keys == other.keys
+    def markDirty(self):  # 结点被修改了，提交时需要写回它的页
+        if self.pager is not None:
+            self.pager.dirty[self.pageNo] = self
+
+    def free(self):  # 结点被合并掉了，归还它的页
+        if self.pager is not None:
+            self.pager.free(self)
+
+    def getChild(self, i):  # 取第i个孩子。孩子还是页号时，按需从索引文件读入
+        child = self.children[i]
+        if type(child) is int:
+            child = self.pager.loadNode(child)
+            self.children[i] = child
+        child.parent = self
+        return child
 
     def isEmpty(self):
         return len(self.keys) == 0
@@ -22,21 +47,21 @@ class Node:
     def isOverflow(self):
         return len(self.keys) >= self.order
 
-    def isNearlyUnderflow(self):
-        return len(self.keys) <= math.ceil(self.order / 2)
-    
-    def isUnderflow(self):
-        return len(self.keys) < math.ceil(self.order / 2) 
+    def isNearlyUnderflow(self):  # 再少一个key就下溢了，不能借给兄弟
+        return len(self.keys) <= math.ceil(self.order / 2) - 1
+
+    def isUnderflow(self):  # 非根结点至少要有 ceil(order / 2) - 1 个key，这样合并两个结点后不会溢出
+        return len(self.keys) < math.ceil(self.order / 2) - 1
 
     def isRoot(self):
         return self.parent is None
 
     def isLeaf(self):
         return isinstance(self, LeafNode)
-    
+
     def split(self):  # 将一个满的结点分裂
-        leftNode = Node(self.order)
-        rightNode = Node(self.order)
+        leftNode = Node(self.order, pager=self.pager)
+        rightNode = Node(self.order, pager=self.pager)
         leftNode.parent = self
         rightNode.parent = self
 
@@ -49,24 +74,22 @@ class Node:
         rightNode.children = self.children[splitConst + 1 : ]
 
         self.children = [leftNode, rightNode]
-        self.keys = [self.keys[splitConst]]
+        self.keys = self.keys[splitConst : splitConst + 1]  # 切片保留key的存储类型（list或array）
+        self.markDirty()
 
         for child in leftNode.children:
             if isinstance(child, Node):
                 child.parent = leftNode
-        
+
         for child in rightNode.children:
             if isinstance(child, Node):
                 child.parent = rightNode
-        
+
         return self  # 返回分裂后的父亲
 
-    def findNextLevel(self, key):
-        for i, existedKey in enumerate(self.keys):
-            if key < existedKey:
-                return self.children[i], i
-            elif i + 1 == len(self.keys):  # 最右边
-                return self.children[i + 1], i + 1
+    def findNextLevel(self, key):  # 二分查找下一层的孩子
+        i = bisect_right(self.keys, key)
+        return self.getChild(i), i
 
     def findLeaf(self, key):
         while not self.isLeaf():
@@ -82,60 +105,68 @@ class Node:
             if isinstance(grandChild, Node):
                 grandChild.parent = self
 
-        for i, existedKey in enumerate(self.keys):
-            if pivot < existedKey:
-                self.keys = self.keys[ : i] + [pivot] + self.keys[i : ]
-                self.children = self.children[ : i] + child.children + self.children[i : ]
-                return
-            elif i + 1 == len(self.keys):
-                self.keys += [pivot]
-                self.children += child.children
-                return
+        i = bisect_right(self.keys, pivot)
+        self.keys.insert(i, pivot)
+        self.children[i : i] = child.children
+        self.markDirty()
+        child.free()  # child的孩子已经挂到self上，child本身不再需要
+
+    def getIndexInParent(self):  # 自己是父亲的第几个孩子。按身份比较，结点的key可能为空
+        for i, child in enumerate(self.parent.children):
+            if child is self:
+                return i
 
     def getPrevSibling(self):  # 左边的兄弟
-        if self.isRoot() or not self.keys:
+        if self.isRoot():
             return None
-        _, index = self.parent.findNextLevel(self.keys[0])
+        index = self.getIndexInParent()
         if index >= 1:  # 自己不是最左边的
-            return self.parent.children[index - 1] 
+            return self.parent.getChild(index - 1)
         else:
             return None
 
     def getNextSibling(self):
-        if self.isRoot() or not self.keys:
+        if self.isRoot():
             return None
-        _, index = self.parent.findNextLevel(self.keys[0])
+        index = self.getIndexInParent()
         if index + 1 < len(self.parent.children):  # 自己不是最右边的
-            return self.parent.children[index + 1] 
+            return self.parent.getChild(index + 1)
         else:
             return None
 
     def borrowLeftNode(self, sibling, parentIndex):
-        parentKey = self.parent.keys.pop(-1)
-        siblingKey = sibling.keys.pop(-1)
+        # 父亲中的分隔key下移到自己，左兄弟最大的key上移到父亲
+        parentKey = self.parent.keys[parentIndex - 1]
+        self.parent.keys[parentIndex - 1] = sibling.keys.pop(-1)
         child = sibling.children.pop(-1)
-        child.parent = self
+        if isinstance(child, Node):
+            child.parent = self
 
-        self.parent.keys.insert(0, siblingKey)
         self.keys.insert(0, parentKey)
         self.children.insert(0, child)
+        self.markDirty()
+        sibling.markDirty()
+        self.parent.markDirty()
 
     def borrowRightNode(self, sibling, parentIndex):
-        parentKey = self.parent.keys.pop(0)
-        siblingKey = sibling.keys.pop(0)
+        parentKey = self.parent.keys[parentIndex]
+        self.parent.keys[parentIndex] = sibling.keys.pop(0)
         child = sibling.children.pop(0)
-        child.parent = self
+        if isinstance(child, Node):
+            child.parent = self
 
-        self.parent.keys.append(siblingKey)
         self.keys.append(parentKey)
         self.children.append(child)
+        self.markDirty()
+        sibling.markDirty()
+        self.parent.markDirty()
 
     def getLeftmostLeaf(self):
         if not self:
             return None
 
         while not self.isLeaf():
-            self = self.children[0]
+            self = self.getChild(0)
         return self
 
     def getRightmostLeaf(self):
@@ -143,42 +174,58 @@ class Node:
             return None
 
         while not self.isLeaf():
-            self = self.children[-1]
+            self = self.getChild(-1)
         return self
 
 class LeafNode(Node):
-    def __init__(self, order=4, parent=None, keys=[], children=[]) -> None:
-        super().__init__(order, parent, keys, children)
-        self.prevLeaf = None  # 叶子链表的上一个
-        self.nextLeaf = None
-        # 特别注意：叶子结点的children是特殊的：它是value
+    # 叶子链表的指针可能是未读入内存的页号，通过 prevLeaf / nextLeaf 属性访问时按需读入
+    __slots__ = ('_prevLeaf', '_nextLeaf')
+
+    def __init__(self, order=4, parent=None, keys=None, children=None, pager=None) -> None:
+        if children is None:
+            children = array('q')
+        self._prevLeaf = None  # 叶子链表的上一个
+        self._nextLeaf = None
+        super().__init__(order, parent, keys, children, pager)
+        # 特别注意：叶子结点的children是特殊的：它是value，即记录地址组成的 array('q')
+        # 非唯一索引的叶子中，每个key对应一个排好序的地址数组 array('q')（posting），children是这些数组组成的list
 
     def __str__(self) -> str:
         return 'LeafNode: keys =' + str(self.keys)
-    
-    def addKeyAndValue(self, key, value):
-        if not self.keys:  # 结点没有key
-            self.keys.append(key)  # 直接插入
-            self.children.append([value])
-            return
 
-        for i, existedKey in enumerate(self.keys):  # 在适当的位置插入
-            # print('self.keys = ', self.keys)
-            if key == existedKey:
-                self.children[i].append(value)
-                return
-            elif key < existedKey:
-                self.keys = self.keys[ : i] + [key] + self.keys[i :]
-                self.children = self.children[ : i] + [[value]] + self.children[i : ]
-                return
-            elif i + 1 == len(self.keys):
-                self.keys.append(key)
-                self.children.append([value])
-                return
+    @property
+    def prevLeaf(self):
+        leaf = self._prevLeaf
+        if type(leaf) is int:
+            leaf = self._prevLeaf = self.pager.loadNode(leaf)
+        return leaf
+
+    @prevLeaf.setter
+    def prevLeaf(self, leaf):
+        self._prevLeaf = leaf
+
+    @property
+    def nextLeaf(self):
+        leaf = self._nextLeaf
+        if type(leaf) is int:
+            leaf = self._nextLeaf = self.pager.loadNode(leaf)
+        return leaf
+
+    @nextLeaf.setter
+    def nextLeaf(self, leaf):
+        self._nextLeaf = leaf
+
+    def addKeyAndValue(self, key, value):
+        i = bisect_left(self.keys, key)  # 二分查找适当的位置插入
+        if i < len(self.keys) and self.keys[i] == key:
+            raise BPlusTreeException(f'索引中已存在 key {key}')
+        self.keys.insert(i, key)
+        self.children.insert(i, value)
+        self.markDirty()
 
     def split(self):  # override
-        topNode = Node(self.order)
-        siblingNode = LeafNode(self.order)
+        topNode = Node(self.order, pager=self.pager)
+        siblingNode = LeafNode(self.order, pager=self.pager)
         splitConst = int(self.order // 2)
 
         self.parent = topNode
@@ -188,13 +235,17 @@ class LeafNode(Node):
         siblingNode.children = self.children[splitConst : ]
         siblingNode.prevLeaf = self
         siblingNode.nextLeaf = self.nextLeaf
+        if self.nextLeaf is not None:
+            self.nextLeaf.prevLeaf = siblingNode
+            self.nextLeaf.markDirty()
 
-        topNode.keys = [siblingNode.keys[0]]
+        topNode.keys = siblingNode.keys[0 : 1]
         topNode.children = [self, siblingNode]
 
         self.keys = self.keys[ : splitConst]
         self.children = self.children[ : splitConst]
         self.nextLeaf = siblingNode
+        self.markDirty()
 
         return topNode
 
@@ -204,6 +255,9 @@ class LeafNode(Node):
         self.keys.insert(0, key)
         self.children.insert(0, data)
         self.parent.keys[parentIndex - 1] = key
+        self.markDirty()
+        sibling.markDirty()
+        self.parent.markDirty()
 
     def borrowRightNode(self, sibling, parentIndex):
         key = sibling.keys.pop(0)
@@ -211,50 +265,89 @@ class LeafNode(Node):
         self.keys.append(key)
         self.children.append(data)
         self.parent.keys[parentIndex] = sibling.keys[0]
+        self.markDirty()
+        sibling.markDirty()
+        self.parent.markDirty()
 
 
 class BPlusTree:
     INF = 0x3f3f3f3f
-    def __init__(self, order=4) -> None:
+    fillFactor = 0.9  # 批量构建时每个结点的填充率，留一些空位给之后的插入
+
+    def __init__(self, order=4, keyType=None, pager=None, root=None, isUnique=True) -> None:
+        # pager 为空时是纯内存的树；否则结点对应索引文件中的页，root 可以是从文件读入的根结点
         self.order = order
-        self.root = LeafNode(
-            order=order, 
-            parent=None,
-            keys=[],
-            children=[]
-        )  # 根结点
-        #  非常奇怪的一点：如果写LeafNode(order=order)会错！必须传所有参数
+        self.keyType = keyType  # key的array类型码：'i'（int）、'd'（float）。None表示用list存（char）
+        self.isUnique = isUnique  # 为False时同一个key可以对应多条记录，叶子中存放地址数组
+        self.pager = pager
+        if root is None:
+            root = LeafNode(
+                order=order,
+                parent=None,
+                keys=self.newKeys(),
+                children=self.newValues(),
+                pager=pager
+            )
+        self.root = root  # 根结点
+
+    def newKeys(self, keys=()):  # 按keyType创建存放key的容器
+        if self.keyType is None:
+            return list(keys)
+        return array(self.keyType, keys)
+
+    def newValues(self, values=()):  # 叶子中存放value的容器。唯一索引是地址数组，非唯一索引是地址数组的list
+        if self.isUnique:
+            return array('q', values)
+        return list(values)
+
+    def iterAddrs(self, values, reverse=False):  # 把叶子中的一段value展开成记录地址。reverse时倒过来
+        if reverse:
+            values = reversed(values)
+        if self.isUnique:
+            return values
+        if reverse:
+            return chain.from_iterable(map(reversed, values))
+        return chain.from_iterable(values)
 
     def find(self, key):
+        # 返回 (是否找到, 叶子结点, 下标)。找不到时下标是key应该插入的位置
         node = self.root
         if node.isEmpty():  # 空树
             return False, node, -1
         node = node.findLeaf(key)
+        if node.isEmpty():
+            return False, node, 0
 
-        if node == self.root.getRightmostLeaf() and node.keys[-1] < key:
+        if node.nextLeaf is None and node.keys[-1] < key:  # 最右边的叶子
             return False, node, BPlusTree.INF  # 太大了
-        if node == self.root.getLeftmostLeaf() and node.keys[0] > key:
+        if node.prevLeaf is None and node.keys[0] > key:  # 最左边的叶子
             return False, node, -BPlusTree.INF  # 太小了
 
-        for i, existedKey in enumerate(node.keys):
-            if existedKey == key:
-                return True, node, i
-            if existedKey > key:
-                return False, node, i
-            if i + 1 == len(node.keys):
-                return False, node, i + 1
+        i = bisect_left(node.keys, key)
+        return i < len(node.keys) and node.keys[i] == key, node, i
 
     def insert(self, key, value):
         node = self.root
         node = node.findLeaf(key)
 
+        if not self.isUnique:
+            i = bisect_left(node.keys, key)
+            if i < len(node.keys) and node.keys[i] == key:  # key已存在，把地址加进它的posting
+                posting = node.children[i]
+                j = bisect_left(posting, value)
+                if j == len(posting) or posting[j] != value:
+                    posting.insert(j, value)
+                    node.markDirty()
+                return
+            value = array('q', [value])
+
         node.addKeyAndValue(key, value)  # node必为LeafNode
 
         while node.isOverflow():  #  溢出了
             if not node.isRoot():  # 不是根
                 parent = node.parent
                 node = node.split()  # 分裂并设定为父亲
-                _, index = parent.findNextLevel(node.keys[0])
+                index = bisect_right(parent.keys, node.keys[0])
                 parent.mergeUp(node, index)
                 node = parent  # 迭代向上检查
             else:
@@ -265,65 +358,192 @@ class BPlusTree:
     def mergeOnDelete(leftNode: Node, rightNode: Node):
         parent = leftNode.parent
 
-        _, index = parent.findNextLevel(leftNode.keys[0])
+        index = leftNode.getIndexInParent()
         parentKey = parent.keys.pop(index)
         parent.children.pop(index)
         parent.children[index] = leftNode
-        
+
         if leftNode.isLeaf() and rightNode.isLeaf():
             leftNode.nextLeaf = rightNode.nextLeaf
+            if rightNode.nextLeaf is not None:
+                rightNode.nextLeaf.prevLeaf = leftNode
+                rightNode.nextLeaf.markDirty()
         else:
             leftNode.keys.append(parentKey)
             for rightNodeChild in rightNode.children:
-                rightNodeChild.parent = leftNode
+                if isinstance(rightNodeChild, Node):
+                    rightNodeChild.parent = leftNode
 
         leftNode.keys += rightNode.keys
         leftNode.children += rightNode.children
+        leftNode.markDirty()
+        parent.markDirty()
+        rightNode.free()
 
-    def delete(self, key):
+    def delete(self, key, value=None):
+        # 非唯一索引给出value时，只从key的posting中删除这个地址，posting删空了才删除key
         node = self.root
         node = node.findLeaf(key)
 
-        if key not in node.keys:
+        index = bisect_left(node.keys, key)
+        if index == len(node.keys) or node.keys[index] != key:
             return False
-        
-        index = node.keys.index(key)
-        node.children[index].pop()  # 删
-
-        if len(node.children[index]) == 0:  # 该结点删完了
-            node.children.pop(index)  # 删掉 [] stub
-            node.keys.pop(index)
-
-            while node.isUnderflow() and not node.isRoot():
-                prevSibling = node.getPrevSibling()
-                nextSibling = node.getNextSibling()
-                _, parentIndex = node.parent.findNextLevel(key)
-
-                if prevSibling is not None and not prevSibling.isNearlyUnderflow():  # 尽可能借用
-                    node.borrowLeftNode(prevSibling, parentIndex)
-                elif nextSibling is not None and not nextSibling.isNearlyUnderflow():
-                    node.borrowRightNode(nextSibling, parentIndex)
-                elif prevSibling is not None and prevSibling.isNearlyUnderflow():  # 借不到再向上递归调整
-                    self.mergeOnDelete(prevSibling, node)
-                elif nextSibling is not None and nextSibling.isNearlyUnderflow():
-                    self.mergeOnDelete(node, nextSibling)
-
-                node = node.parent  # 迭代向上
-            
-            if node.isRoot() and not node.isLeaf() and len(node.children) == 1:
-                # 删除过程中出现了冗余根结点
-                self.root = node.children[0]
-                self.root.parent = None
+
+        if not self.isUnique and value is not None:
+            posting = node.children[index]
+            j = bisect_left(posting, value)
+            if j == len(posting) or posting[j] != value:
+                return False
+            posting.pop(j)
+            node.markDirty()
+            if len(posting) > 0:
+                return True
+
+        node.children.pop(index)  # 删
+        node.keys.pop(index)
+        node.markDirty()
+
+        while node.isUnderflow() and not node.isRoot():
+            prevSibling = node.getPrevSibling()
+            nextSibling = node.getNextSibling()
+            parentIndex = node.getIndexInParent()
+
+            if prevSibling is not None and not prevSibling.isNearlyUnderflow():  # 尽可能借用
+                node.borrowLeftNode(prevSibling, parentIndex)
+            elif nextSibling is not None and not nextSibling.isNearlyUnderflow():
+                node.borrowRightNode(nextSibling, parentIndex)
+            elif prevSibling is not None and prevSibling.isNearlyUnderflow():  # 借不到再向上递归调整
+                self.mergeOnDelete(prevSibling, node)
+            elif nextSibling is not None and nextSibling.isNearlyUnderflow():
+                self.mergeOnDelete(node, nextSibling)
+
+            node = node.parent  # 迭代向上
+
+        if node.isRoot() and not node.isLeaf() and len(node.children) == 1:
+            # 删除过程中出现了冗余根结点
+            self.root = node.getChild(0)
+            self.root.parent = None
+            node.free()
 
         return True
 
+    @staticmethod
+    def groupSizes(total, target, capacity):
+        # 把total个元素尽量均匀地分成若干组，每组不超过capacity个，且尽量接近target个
+        groupNum = max(1, total // target, -(-total // capacity))
+        size, extra = divmod(total, groupNum)
+        return [size + 1] * extra + [size] * (groupNum - extra)
+
+    @staticmethod
+    def bulkLoad(items, order=4, fillFactor=None, keyType=None, pager=None, isUnique=True):
+        # 自底向上批量构建B+树。items是按key升序排好的 [(key, value), ...]，且key互不相同
+        # 非唯一索引的value是该key对应的排好序的地址数组 array('q')
+        # 先把叶子结点按填充率装满并串成链表，再逐层向上构建内部结点，复杂度为O(n)
+        if fillFactor is None:
+            fillFactor = BPlusTree.fillFactor
+        if not items:
+            return BPlusTree(order=order, keyType=keyType, pager=pager, isUnique=isUnique)
+        tree = BPlusTree(order=order, keyType=keyType, isUnique=isUnique)  # 根结点在下面构建，先不给空根分配页
+
+        capacity = order - 1  # 每个结点最多有几个key
+        target = max(math.ceil(order / 2), min(capacity, round(capacity * fillFactor)))
+
+        level = []  # 当前层的 (结点, 该子树中最小的key)
+        prevLeaf = None
+        start = 0
+        for size in BPlusTree.groupSizes(len(items), target, capacity):
+            group = items[start : start + size]
+            start += size
+            leaf = LeafNode(
+                order=order,
+                parent=None,
+                keys=tree.newKeys(key for key, _ in group),
+                children=tree.newValues(value for _, value in group),
+                pager=pager
+            )
+            leaf.prevLeaf = prevLeaf
+            if prevLeaf is not None:
+                prevLeaf.nextLeaf = leaf
+            prevLeaf = leaf
+            level.append((leaf, leaf.keys[0]))
+
+        while len(level) > 1:  # 内部结点的孩子数 = key数 + 1
+            upperLevel = []
+            start = 0
+            for size in BPlusTree.groupSizes(len(level), target + 1, capacity + 1):
+                group = level[start : start + size]
+                start += size
+                node = Node(
+                    order=order,
+                    parent=None,
+                    keys=tree.newKeys(lowKey for _, lowKey in group[1:]),  # 右边子树中最小的key作为分隔
+                    children=[child for child, _ in group],
+                    pager=pager
+                )
+                for child, _ in group:
+                    child.parent = node
+                upperLevel.append((node, group[0][1]))
+            level = upperLevel
+
+        tree.pager = pager
+        tree.root = level[0][0]
+        return tree
+
+    def iterRange(self, low=None, high=None, includeLow=True, includeHigh=True, reverse=False):
+        # 按key从小到大依次返回 low 到 high 之间的记录地址。low / high 为None表示没有下界 / 上界
+        # 先找到low所在的叶子，再沿叶子链表往右走，走过high就停下。不把地址都放进集合，调用者可以随时停止
+        # reverse时从大到小：先找到high所在的叶子，沿叶子链表往左走
+        if self.root.isEmpty():
+            return
+        if reverse:
+            yield from self.iterRangeReversed(low, high, includeLow, includeHigh)
+            return
+        if low is None:
+            leaf = self.root.getLeftmostLeaf()
+            start = 0
+        else:
+            leaf = self.root.findLeaf(low)
+            start = bisect_left(leaf.keys, low) if includeLow else bisect_right(leaf.keys, low)
+
+        while leaf is not None:
+            keys = leaf.keys
+            end = len(keys)
+            if high is not None:
+                end = bisect_right(keys, high) if includeHigh else bisect_left(keys, high)
+            if start < end:
+                yield from self.iterAddrs(leaf.children[start : end])
+            if end < len(keys):  # 这个叶子中已经有比high大的key了
+                return
+            leaf = leaf.nextLeaf
+            start = 0
+
+    def iterRangeReversed(self, low, high, includeLow, includeHigh):  # iterRange的倒序版本
+        if high is None:
+            leaf = self.root.getRightmostLeaf()
+            end = len(leaf.keys)
+        else:
+            leaf = self.root.findLeaf(high)
+            end = bisect_right(leaf.keys, high) if includeHigh else bisect_left(leaf.keys, high)
+
+        while leaf is not None:
+            keys = leaf.keys
+            start = 0
+            if low is not None:
+                start = bisect_left(keys, low) if includeLow else bisect_right(keys, low)
+            if start < end:
+                yield from self.iterAddrs(leaf.children[start : end], reverse=True)
+            if start > 0:  # 这个叶子中已经有比low小的key了
+                return
+            leaf = leaf.prevLeaf
+            if leaf is not None:
+                end = len(leaf.keys)
+
     def getAllData(self):  # 正序遍历B+树叶子链表。返回集合
         data = set()
         node = self.root.getLeftmostLeaf()
 
         while node is not None:
-            for existedData in node.children:
-                data.add(existedData[0])
+            data.update(self.iterAddrs(node.children))
             node = node.nextLeaf
         return data
 
@@ -340,4 +560,4 @@ if __name__ == '__main__':
     newTree = BPlusTree(order=4)
 
     print(newTree.getAllData())
-    
+
@@ -1,24 +1,101 @@
 import os
+import json
+import mmap
 import struct
+from collections import OrderedDict
+from itertools import islice
+from operator import eq, ne, le, ge, lt, gt
 from exception import BufferException
+try:  # 可选依赖：装了numpy时，全表扫描可以用向量化的扫描引擎
+    import numpy as np
+except ImportError:
+    np = None
 # struct.unpack() 用来解释读取到的二进制串
 # struct.pack() 用来将数据转换为二进制串
 
-def string2Bytes(values):
-    for i, value in enumerate(values):  # string转为bytes
-        if isinstance(value, str):
-            values[i] = values[i].encode('utf-8')
+comparators = {  # where 子句中的运算符
+    '<>': ne, '!=': ne, '=': eq, '==': eq, '<=': le, '>=': ge, '<': lt, '>': gt
+}
+
+
+def roundFloat(value):
+    # float字段在记录文件中存为4字节float。索引的key、where中和float字段比较的值都先舍入成同样的值，
+    # 这样 0.1 和从记录中读回的 0.10000000149011612 是同一个key。超出4字节float范围的值原样返回
+    try:
+        return struct.unpack('<f', struct.pack('<f', value))[0]
+    except OverflowError:
+        return value
 
 class BufferMgr:  # PLUS RecordMgr
-    class Buffer:
-        # TODO: 目前只实现了一个表一个buffer，未来扩展为一个表多个buffer
-        bufferSize = 1024  # 每个buffer最多可以有几个record
-        bufferNum = 1  # 每个表最多有几个buffer（暂时无用）
-        def __init__(self, path, tableName, columns):
-            self.tableName = tableName
-            self.offset = 0  # buffer在磁盘文件中的位置索引
+    pageSize = 4096  # 页的大小（Byte）。缓冲池与文件交互的单位是页，不支持记录的跨页存储
+    poolSize = 4 * 1024 * 1024  # 缓冲池的总内存预算（Byte），由所有表共享
+    readAheadSize = 1024 * 1024  # 全表扫描时一次read()预读多少Byte
+    storageMode = 'pool'  # 'pool'：记录文件通过缓冲池读写；'mmap'：记录文件被映射到内存
+    mmapGrowSize = 1024 * 1024  # mmap模式下文件不够用时，每次至少变长多少Byte
+    scanEngine = 'numpy'  # 全表扫描的引擎。'numpy'：整块record看作结构化数组，用布尔数组筛选；'python'：逐行判断。没有numpy时总是'python'
+    limitBatchSize = 256  # 有LIMIT时，索引查到的地址第一批读几个，之后每批加倍。与LIMIT的大小无关，这样同一查询翻页时记录的顺序不变
+    orderBatchSize = 4096  # 按索引的顺序读记录时（ORDER BY），每批最多读几个地址：批内按地址顺序读，再按索引的顺序返回
+
+    class Frame:  # 缓冲池中的一个页帧
+        def __init__(self, buffer, pageNo, data):
+            self.buffer = buffer  # 这一页属于哪个表的Buffer
+            self.pageNo = pageNo  # 页在文件中的编号
+            self.data = data  # 页的内容（bytearray）
             self.isDirty = False  # 是否被改写，与文件内容不符了
-            self.pinned = False  # 是否被锁定
+            self.pinCount = 0  # 被锁定的次数。大于0时不允许被换出
+
+    class BufferPool:  # 所有表共享的缓冲池，采用LRU替换算法
+        def __init__(self, frameNum, logMgr=None):
+            self.frameNum = frameNum  # 缓冲池中最多有几个页帧
+            self.logMgr = logMgr  # 脏页写回文件之前，先把日志写入文件（WAL）
+            self.frames = OrderedDict()  # (tableName, pageNo) -> Frame，越靠后越是最近使用过的
+            self.hits = 0
+            self.misses = 0
+
+        def fetchPage(self, buffer, pageNo):
+            key = (buffer.tableName, pageNo)
+            frame = self.frames.get(key)
+            if frame is not None:  # buffer hit
+                self.frames.move_to_end(key)
+                self.hits += 1
+                return frame
+
+            self.misses += 1  # buffer not hit，需要从文件中读取
+            if len(self.frames) >= self.frameNum:
+                self.evict()
+            frame = BufferMgr.Frame(buffer, pageNo, buffer.readPage(pageNo))
+            self.frames[key] = frame
+            return frame
+
+        def evict(self):  # 换出最久没有使用过的、没有被锁定的页
+            for key, frame in self.frames.items():
+                if frame.pinCount == 0:
+                    break
+            else:
+                raise BufferException('Buffer操作异常：缓冲池已满，且所有的页都被锁定！')
+
+            if frame.isDirty:  # 写回
+                frame.buffer.writePage(frame)
+            del self.frames[key]
+
+        def getResidentFrame(self, buffer, pageNo):  # 只查找，不读文件，也不改变LRU顺序
+            return self.frames.get((buffer.tableName, pageNo))
+
+        def flushTable(self, buffer):  # 把一个表的所有脏页按页号顺序写回文件。返回写了几页
+            dirtyPages = sorted(buffer.dirtyPages.items())
+            for _, frame in dirtyPages:
+                buffer.writePage(frame)
+            return len(dirtyPages)
+
+        def dropTable(self, buffer):  # 表被删除了，它的页直接丢弃，不写回
+            keys = [key for key, frame in self.frames.items() if frame.buffer is buffer]
+            for key in keys:
+                del self.frames[key]
+
+    class Buffer:  # 一个表的记录文件。文件被切分为若干页，页的内容缓存在共享的缓冲池中
+        def __init__(self, path, tableName, columns, pool):
+            self.tableName = tableName
+            self.pool = pool
             self.formatList = ['<c']  # 小端，char
             self.recordSize = 1  # 单个record占用多少Byte
             #  record: 0, pointer: 1。尽管是布尔变量，但还是用了1 Byte来存储
@@ -36,215 +113,424 @@ class BufferMgr:  # PLUS RecordMgr
             if self.recordSize < 5:
                 self.recordSize = 5  # 至少得有5个byte
 
-            self.curSize = 1
-            self.content = []
+            # 解码器只构造一次。fieldStructs[i]用来在第fieldOffsets[i]个Byte处单独解码第i个字段
+            self.recordStruct = struct.Struct(''.join(self.formatList))
+            self.fieldStructs = []
+            self.fieldOffsets = []
+            self.charIndices = []  # 哪些字段是char，解码后要变成str
+            offset = 1
+            for i, fieldFormat in enumerate(self.formatList[1:]):
+                fieldStruct = struct.Struct('<' + fieldFormat)
+                self.fieldStructs.append(fieldStruct)
+                self.fieldOffsets.append(offset)
+                offset += fieldStruct.size
+                if fieldFormat.endswith('s'):
+                    self.charIndices.append(i)
+
+            if np is not None:  # numpy扫描引擎用的结构化dtype，第i个字段叫 f{i}，偏移量和fieldOffsets一致
+                formats = {'i': '<i4', 'f': '<f4'}
+                self.recordDtype = np.dtype({
+                    'names': ['tag'] + [f'f{i}' for i in range(len(self.fieldOffsets))],
+                    'formats': ['u1'] + [formats.get(fieldFormat, 'S' + fieldFormat[:-1]) for fieldFormat in self.formatList[1:]],
+                    'offsets': [0] + self.fieldOffsets,
+                    'itemsize': self.recordSize
+                })
+
+            self.recordsPerPage = max(1, BufferMgr.pageSize // self.recordSize)  # 每页最多有几个record
+            self.pageBytes = self.recordsPerPage * self.recordSize  # 每页实际占用多少Byte
 
             self.recordFile = os.path.join(path, f'{self.tableName}.dat')
-            self.adjustOffset(self.offset)
+            self.openFile()
 
+            self.dirtyPages = {}  # 这个表在缓冲池中的脏页：页号 -> Frame
             ### 关键代码
             self.insertPos = struct.unpack(
                 '<I', 
-                self.content[0][1:5]
+                self.getRecord(0)[1:5]
             )[0]  # 小端，integer or long
+            self.savedInsertPos = self.insertPos  # 文件中表头记录的insertPos
+
+        def openFile(self):
+            self.file = open(self.recordFile, 'rb+')
+            self.file.seek(0, os.SEEK_END)
+            self.recordNum = self.file.tell() // self.recordSize  # 共有几行（含第0行的表头和缓冲池中新追加的行）
+
+        def getPageNum(self):
+            return (self.recordNum + self.recordsPerPage - 1) // self.recordsPerPage
+
+        def readPage(self, pageNo):  # 由缓冲池调用。超出文件末尾的部分补0
+            data = bytearray(self.pageBytes)
+            self.file.seek(pageNo * self.pageBytes)
+            self.file.readinto(data)
+            return data
+
+        def writePage(self, frame):  # 由缓冲池调用。只写回页中有效的record
+            if self.pool.logMgr is not None:  # 先写日志，保证文件中的修改一定能在日志中找到
+                self.pool.logMgr.flush()
+            start = frame.pageNo * self.recordsPerPage
+            count = min(self.recordsPerPage, self.recordNum - start)
+            if count > 0:
+                self.file.seek(frame.pageNo * self.pageBytes)
+                self.file.write(memoryview(frame.data)[ : count * self.recordSize])
+            frame.isDirty = False
+            self.dirtyPages.pop(frame.pageNo, None)
+
+        def getRecord(self, addr):
+            frame = self.pool.fetchPage(self, addr // self.recordsPerPage)
+            offset = (addr % self.recordsPerPage) * self.recordSize
+            return bytes(frame.data[offset : offset + self.recordSize])
+
+        def checkRecordSize(self, record):
+            # 页是bytearray，长度不对的record切片赋值会改变页的长度，后面的记录都会错位
+            if len(record) != self.recordSize:
+                raise BufferException(f'record 的长度是 {len(record)} Byte，与表的记录长度 {self.recordSize} Byte 不符')
+
+        def setRecord(self, addr, record):  # 只写入缓冲池，不写入文件（write-back）
+            self.checkRecordSize(record)
+            frame = self.pool.fetchPage(self, addr // self.recordsPerPage)
+            offset = (addr % self.recordsPerPage) * self.recordSize
+            frame.data[offset : offset + self.recordSize] = record
+            if not frame.isDirty:
+                frame.isDirty = True
+                self.dirtyPages[frame.pageNo] = frame
+            if addr >= self.recordNum:  # 在文件末尾追加
+                self.recordNum = addr + 1
+
+        def packHole(self, nextPos):  # 空洞链表的结点
+            return struct.pack(
+                f'<cI{self.recordSize - 5}s',
+                b'\x01',  # 是空洞链表的node
+                nextPos,  # 存储下一个插入位置
+                b'\x00' * (self.recordSize - 5)  # 后面全是0
+            )
 
-        def getBufferRange(self):
-            return range(self.offset, self.offset + self.curSize)
-
-        def save(self):
-            if self.isDirty is True:
-                with open(self.recordFile, 'rb+') as recordFile:
-                    recordFile.seek(self.offset * self.recordSize)  # 移动文件指针
-                    for record in self.content:
-                        recordFile.write(record)
-                        # print('把一个脏记录写入文件！')
-
-                    recordFile.seek(0)  # 改空洞链表的表头
-                    recordFile.write(struct.pack(
-                        f'<cI{self.recordSize - 5}s', 
-                        b'\x01',  # 是空洞链表的node
-                        self.insertPos,  # 存储插入位置
-                        b'\x00' * (self.recordSize - 5)  # 后面全是0
-                    ))
-                self.isDirty = False
-
-        def adjustOffset(self, offset):
-            # adjust()
-            if self.pinned is True:
-                raise BufferException('Buffer操作异常：不允许调整被锁定的Buffer！')
-            elif self.isDirty is True:
-                self.save()
-
-            self.content = []
-            with open(self.recordFile, 'rb') as recordFile:
-                recordFile.seek(offset * self.recordSize)
-                for i in range(self.bufferSize):
-                    record = recordFile.read(self.recordSize)
-                    if record == b'':  # 什么也读不出来(EOF)，该停止了。
-                        self.curSize = i  # 获取当前大小
-                        break
-                    self.content.append(record)
-            self.offset = offset
-
-        def isFull(self):
-            return self.curSize == self.bufferSize
+        def save(self):  # 只写回脏页。返回写了几页
+            if self.insertPos != self.savedInsertPos:
+                self.setRecord(0, self.packHole(self.insertPos))  # 改空洞链表的表头
+                self.savedInsertPos = self.insertPos
+            writeNum = self.pool.flushTable(self)
+            if writeNum > 0:
+                self.file.flush()
+                os.fsync(self.file.fileno())
+            return writeNum
+
+        def close(self):
+            self.file.close()
+
+        def scanChunks(self):
+            # 顺序扫描，每次返回 (起始地址, 块的内容, 块中有几个record)
+            # 已经在缓冲池中的页直接使用（它可能是dirty的）；
+            # 不在缓冲池中的连续若干页用一次read()预读，且不放入缓冲池，以免全表扫描把缓冲池中的热点页都挤出去
+            pageNum = self.getPageNum()
+            readAheadPages = max(1, BufferMgr.readAheadSize // self.pageBytes)
+            pageNo = 0
+            while pageNo < pageNum:
+                start = pageNo * self.recordsPerPage
+                frame = self.pool.getResidentFrame(self, pageNo)
+                if frame is not None:  # buffer hit
+                    frame.pinCount += 1  # 扫描这一页的时候不允许它被换出
+                    try:
+                        yield start, frame.data, min(self.recordsPerPage, self.recordNum - start)
+                    finally:
+                        frame.pinCount -= 1
+                    pageNo += 1
+                    continue
+
+                endPage = pageNo + 1  # 预读到下一个在缓冲池中的页为止
+                while endPage < pageNum and endPage - pageNo < readAheadPages \
+                        and self.pool.getResidentFrame(self, endPage) is None:
+                    endPage += 1
+                self.file.seek(pageNo * self.pageBytes)
+                chunk = self.file.read(min(endPage * self.recordsPerPage, self.recordNum) * self.recordSize
+                                       - pageNo * self.pageBytes)
+                yield start, chunk, len(chunk) // self.recordSize
+                pageNo = endPage
+
+        def scanRecords(self):
+            # 逐块顺序扫描，返回 (地址, 二进制record)。record是块的memoryview切片，不复制
+            # 跳过表头和空洞链表的结点
+            recordSize = self.recordSize
+            for start, chunk, count in self.scanChunks():
+                view = memoryview(chunk)
+                for i in range(count):
+                    offset = i * recordSize
+                    if chunk[offset] == 1:  # 空洞链表（表头也是），往后
+                        continue
+                    yield start + i, view[offset : offset + recordSize]
+
+        def fetchRecords(self, addrs):
+            # 按地址顺序读取给定的记录，返回 (地址, 二进制record)。record是页的memoryview切片，不复制
+            # 同一页的记录一起读，每页只读一次。要读的页很多时，不在缓冲池中的连续若干页用一次read()读入，
+            # 且不放入缓冲池，和全表扫描一样不挤出热点页；要读的页不多时经过缓冲池，下次查找可以直接命中
+            addrs = sorted(addrs)
+            recordSize = self.recordSize
+            recordsPerPage = self.recordsPerPage
+            pages = []  # [(页号, 这一页中要读的地址)]
+            for addr in addrs:
+                pageNo = addr // recordsPerPage
+                if pages and pages[-1][0] == pageNo:
+                    pages[-1][1].append(addr)
+                else:
+                    pages.append((pageNo, [addr]))
+            bypassPool = len(pages) > self.pool.frameNum // 4
+            readAheadPages = max(1, BufferMgr.readAheadSize // self.pageBytes)
+
+            i = 0
+            while i < len(pages):
+                pageNo = pages[i][0]
+                frame = self.pool.getResidentFrame(self, pageNo)
+                if frame is None and not bypassPool:
+                    frame = self.pool.fetchPage(self, pageNo)
+                if frame is not None:
+                    frame.pinCount += 1  # 读这一页的时候不允许它被换出
+                    try:
+                        view = memoryview(frame.data)
+                        for addr in pages[i][1]:
+                            offset = (addr - pageNo * recordsPerPage) * recordSize
+                            yield addr, view[offset : offset + recordSize]
+                    finally:
+                        frame.pinCount -= 1
+                    i += 1
+                    continue
+
+                end = i + 1  # 页号连续、都不在缓冲池中的几页一起读
+                while end < len(pages) and pages[end][0] == pages[end - 1][0] + 1 \
+                        and end - i < readAheadPages and self.pool.getResidentFrame(self, pages[end][0]) is None:
+                    end += 1
+                self.file.seek(pageNo * self.pageBytes)
+                chunk = self.file.read((pages[end - 1][0] + 1 - pageNo) * self.pageBytes)
+                view = memoryview(chunk)
+                for _, pageAddrs in pages[i : end]:
+                    for addr in pageAddrs:
+                        offset = (addr - pageNo * recordsPerPage) * recordSize
+                        yield addr, view[offset : offset + recordSize]
+                i = end
+
+        def fetchRecordsInBatches(self, addrs, batchSize):
+            # 有LIMIT时用：按索引给出的顺序每次只取一批地址，批内排好序后读；结果够了就不再向索引要地址
+            # 剩下的条件可能筛掉一些记录，所以每批比上一批大一倍
+            addrs = iter(addrs)
+            while True:
+                batch = list(islice(addrs, batchSize))
+                if not batch:
+                    return
+                yield from self.fetchRecords(batch)
+                batchSize *= 2
+
+        def fetchRecordsInOrder(self, addrs):
+            # 按给定的顺序（索引的顺序）返回 (地址, 二进制record)
+            # 每次取一批地址，批内按地址顺序读、每页只读一次，再恢复原来的顺序。批的大小从limitBatchSize加倍到orderBatchSize，内存有界
+            # 读完一批后页可能被换出，所以record复制成bytes
+            addrs = iter(addrs)
+            batchSize = BufferMgr.limitBatchSize
+            while True:
+                batch = list(islice(addrs, batchSize))
+                if not batch:
+                    return
+                records = {addr: bytes(record) for addr, record in self.fetchRecords(batch)}
+                for addr in batch:
+                    yield addr, records[addr]
+                batchSize = min(batchSize * 2, BufferMgr.orderBatchSize)
 
         def decodeRecord(self, record):  # 一个二进制record解码成正常数据
-            record = list(struct.unpack(''.join(self.formatList), record))
-            for i, item in enumerate(record):
-                if isinstance(item, bytes):
-                    record[i] = record[i].decode('utf-8').rstrip('\x00')  # 规范的python str
-            
-            return record[1:]  # 第一个Byte作为标志不要返回
+            record = list(self.recordStruct.unpack_from(record))[1:]  # 第一个Byte作为标志不要返回
+            for i in self.charIndices:
+                record[i] = record[i].rstrip(b'\x00').decode('utf-8')  # 规范的python str
+            return record
             # 返回值示例：[19, 'AAN', 24, 'F']
 
-        # operators = ['<>', '!=', '=', '==', '<=', '>=', '<', '>']
-        @staticmethod
-        def checkWheres(record, columnHash, wheres):
-            if wheres == []:
-                return True
+        def decodeField(self, record, columnIndex):  # 只解码二进制record中的一个字段
+            value = self.fieldStructs[columnIndex].unpack_from(record, self.fieldOffsets[columnIndex])[0]
+            if isinstance(value, bytes):
+                value = value.rstrip(b'\x00').decode('utf-8')
+            return value
+
+        def compileWhere(self, columnIndex, operator, rVal):
+            # 把一个条件编译成函数 check(record)。字段的偏移量、解码器、运算符都事先绑定好
+            if operator not in comparators:
+                raise BufferException('where 子句中出现了不支持的运算符！')
+            compare = comparators[operator]
+            unpack = self.fieldStructs[columnIndex].unpack_from
+            offset = self.fieldOffsets[columnIndex]
+
+            if columnIndex in self.charIndices:
+                if isinstance(rVal, str):  # utf-8编码后按字节比较与按字符比较的顺序一致，不需要解码
+                    rVal = rVal.encode('utf-8')
+                    return lambda record: compare(unpack(record, offset)[0].rstrip(b'\x00'), rVal)
+                return lambda record: compare(unpack(record, offset)[0].rstrip(b'\x00').decode('utf-8'), rVal)
+            if self.formatList[columnIndex + 1] == 'f' and isinstance(rVal, (int, float)):
+                rVal = roundFloat(rVal)
+            return lambda record: compare(unpack(record, offset)[0], rVal)
+
+        def compileWheres(self, columnHash, wheres):
+            # 每次查询只编译一次，返回 predicate(record)，record是未解码的二进制record
+            # 没有条件时返回None
+            checks = []
+            for where in wheres:
+                columnIndex = columnHash[where['lVal']]
+                isChar = columnIndex in self.charIndices
+                isEqual = comparators.get(where['operator']) is eq
+                checks.append((isChar, not isEqual, self.compileWhere(columnIndex, where['operator'], where['rVal'])))
+            checks.sort(key=lambda check: check[:2])  # 数值字段的等值条件最便宜、最有可能不满足，先判断
+
+            predicate = None
+            for _, __, check in reversed(checks):
+                if predicate is None:
+                    predicate = check
+                else:
+                    predicate = (lambda check, rest: lambda record: check(record) and rest(record))(check, predicate)
+            return predicate
 
+        def useNumpy(self):
+            return np is not None and BufferMgr.scanEngine == 'numpy'
+
+        def compileMask(self, columnHash, wheres):
+            # numpy引擎：把条件编译成函数 mask(array)，对一整块record一次算出布尔数组，表头和空洞链表的结点都是False
+            # 条件中有类型不匹配等不能向量化的情况时返回None，由调用者改为逐行判断
+            checks = []
             for where in wheres:
                 columnIndex = columnHash[where['lVal']]
-                lVal = record[columnIndex]
-                rVal = where['rVal']
                 operator = where['operator']
-                if operator == '<>' or operator == '!=':
-                    if lVal == rVal:
-                        return False
-                elif operator == '=' or operator == '==':
-                    if lVal != rVal:
-                        return False
-                elif operator == '<=':
-                    if not lVal <= rVal:
-                        return False
-                elif operator == '>=':
-                    if not lVal >= rVal:
-                        return False
-                elif operator == '<':
-                    if not lVal < rVal:
-                        return False
-                elif operator == '>':
-                    if not lVal > rVal:
-                        return False
-                else:
+                rVal = where['rVal']
+                if operator not in comparators:
                     raise BufferException('where 子句中出现了不支持的运算符！')
-            return True
-
-        def bPlusFindRecords(self, uniqueKeyResultAddrs):
+                if columnIndex in self.charIndices:
+                    if not isinstance(rVal, str):
+                        return None
+                    rVal = rVal.encode('utf-8')  # 'S' 类型比较时忽略末尾的\x00，和逐行判断时 rstrip 一致
+                    cast = None
+                elif isinstance(rVal, bool) or not isinstance(rVal, (int, float)):
+                    return None
+                elif self.formatList[columnIndex + 1] == 'f':
+                    rVal = roundFloat(rVal)
+                    cast = np.float64  # float字段解码成double再比较，和struct解码的结果一致
+                elif isinstance(rVal, float):
+                    cast = np.float64
+                elif -2 ** 63 <= rVal < 2 ** 63:
+                    cast = np.int64
+                else:
+                    return None
+                checks.append((f'f{columnIndex}', comparators[operator], rVal, cast))
+
+            def mask(array):
+                result = array['tag'] != 1
+                for field, compare, rVal, cast in checks:
+                    column = array[field] if cast is None else array[field].astype(cast)
+                    result &= compare(column, rVal)
+                return result
+            return mask
+
+        def vectorScanFindRecords(self, mask):
+            # 全表扫描（numpy引擎）：每段record整体看作结构化数组，不逐行unpack，只有满足条件的record才转换成Python对象
+            # 逐个返回 (地址, 记录)。每次只看readAheadSize大小的一段，映射区整个作为一块时也不会一次转换出所有结果
+            step = max(1, BufferMgr.readAheadSize // self.recordSize)
+            for start, chunk, count in self.scanChunks():
+                for offset in range(0, count, step):
+                    array = np.frombuffer(chunk, self.recordDtype, min(step, count - offset), offset * self.recordSize)
+                    indices = np.flatnonzero(mask(array))
+                    if len(indices) == 0:
+                        continue
+                    for i in range(0, len(indices), 1024):  # 每次只把一小批转换成Python对象
+                        batch = indices[i : i + 1024]
+                        for addr, record in zip((batch + (start + offset)).tolist(), array[batch].tolist()):
+                            record = list(record[1:])  # 第一个Byte作为标志不要返回
+                            for j in self.charIndices:
+                                record[j] = record[j].decode('utf-8')  # tolist() 已经去掉了末尾的\x00
+                            yield addr, record
+
+        def scanColumns(self, columnIndices):
+            # 全表扫描，只解码指定的几个字段，逐块返回 (地址列表, [每个字段的值列表])。建索引、批量导入时用
+            for start, chunk, count in self.scanChunks():
+                if self.useNumpy():
+                    array = np.frombuffer(chunk, self.recordDtype, count)
+                    indices = np.flatnonzero(array['tag'] != 1)
+                    if len(indices) == 0:
+                        continue
+                    array = array[indices]
+                    columns = []
+                    for i in columnIndices:
+                        values = array[f'f{i}'].tolist()
+                        if i in self.charIndices:
+                            values = [value.decode('utf-8') for value in values]
+                        columns.append(values)
+                    yield (indices + start).tolist(), columns
+                    continue
+
+                addrs = []
+                columns = [[] for _ in columnIndices]
+                view = memoryview(chunk)
+                for j in range(count):
+                    offset = j * self.recordSize
+                    if chunk[offset] == 1:  # 空洞链表（表头也是）
+                        continue
+                    addrs.append(start + j)
+                    record = view[offset : offset + self.recordSize]
+                    for values, i in zip(columns, columnIndices):
+                        values.append(self.decodeField(record, i))
+                if addrs:
+                    yield addrs, columns
+
+        # 下面三种查找都是生成器，逐个返回 (地址, 记录)，找到一条就返回一条，不把整个结果放进内存
+        # batchSize不是None时（有LIMIT），索引查到的地址分批读，见fetchRecordsInBatches
+        def bPlusFindRecords(self, uniqueKeyResultAddrs, batchSize=None):
             # 不用全表扫描，只有B+索引
-            results = []  # 查找出来的记录
-            correspondingAddrs = []  # 每个记录的地址。
-            with open(self.recordFile, 'rb') as recordFile:
-                recordFile.seek(self.recordSize)
-                for addr in uniqueKeyResultAddrs:  
-                    # B+树结果
-                    if addr in self.getBufferRange():
-                        record = self.content[addr - self.offset]
-                        record = self.decodeRecord(record)
-                        results += [record]
-                        correspondingAddrs.append(addr)
-                    else:
-                        recordFile.seek(self.recordSize * addr)
-                        record = recordFile.read(self.recordSize)
-                        record = self.decodeRecord(record)
-                        results += [record]
-                        correspondingAddrs.append(addr)
-            return results, correspondingAddrs
+            if batchSize is None:
+                records = self.fetchRecords(uniqueKeyResultAddrs)  # 索引查到的地址，按地址顺序读
+            else:
+                records = self.fetchRecordsInBatches(uniqueKeyResultAddrs, batchSize)
+            for addr, record in records:
+                yield addr, self.decodeRecord(record)
 
         def scanFindRecords(self, columnHash, notUniqueKeyWheres):
             # 全表扫描
-            results = []  # 查找出来的记录
-            correspondingAddrs = []  # 每个记录的地址
-
-            with open(self.recordFile, 'rb') as recordFile:
-                recordFile.seek(self.recordSize)
-                addr = 0
-                while True:
-                    addr += 1  # buffer在磁盘文件中的位置索引
-                    if addr in self.getBufferRange():  # buffer hit。直接从buffer里面读取即可
-                        for record in self.content:
-                            if record[0] == 1:
-                                continue
-                            record = self.decodeRecord(record)
-                            if self.checkWheres(record, columnHash, notUniqueKeyWheres):
-                                results += [record]
-                                correspondingAddrs.append(addr)
-                        addr = self.getBufferRange()[-1]
-                        recordFile.seek(self.recordSize * (addr + 1))  #  由于只实现了1个Buffer，所以接下来就是文件扫描了
-                    else:  # buffer not hit. 需要从文件中读取
-                        # not hit 也不会写 buffer
-                        record = recordFile.read(self.recordSize)  # read()会自动移动文件指针
-                        if record == b'':  # EOF
-                            break
-                        elif record[0] == 1:  # 空洞链表，往后
-                            continue
-                        record = self.decodeRecord(record)
-                        if self.checkWheres(record, columnHash, notUniqueKeyWheres):
-                            results += [record]
-                            correspondingAddrs.append(addr)
-
-            return results, correspondingAddrs
-
-        def findRecords(self, columnHash, notUniqueKeyWheres, uniqueKeyResultAddrs):
-            #  全表扫描 + B+索引都有
-            results = []  # 查找出来的记录
-            correspondingAddrs = []
-
-            with open(self.recordFile, 'rb') as recordFile:
-                recordFile.seek(self.recordSize)
-                addr = 0
-                while True:
-                    addr += 1  # buffer在磁盘文件中的位置索引
-                    if addr in self.getBufferRange():  # buffer hit。直接从buffer里面读取即可
-                        for record in self.content:
-                            if record[0] == 1:
-                                continue
-                            record = self.decodeRecord(record)
-                            if self.checkWheres(record, columnHash, notUniqueKeyWheres) and addr in uniqueKeyResultAddrs:
-                                results += [record]
-                                correspondingAddrs.append(addr)
-                        addr = self.getBufferRange()[-1]
-                        recordFile.seek(self.recordSize * (addr + 1))  #  由于只实现了1个Buffer，所以接下来就是文件扫描了
-                    else:  # buffer not hit. 需要从文件中读取
-                        # not hit 也不会写 buffer
-                        record = recordFile.read(self.recordSize)
-
-                        if record == b'':  # EOF
-                            break
-                        elif record[0] == 1:  # 空洞链表，往后
-                            continue
-                        else:
-                            record = self.decodeRecord(record)
-                            if self.checkWheres(record, columnHash, notUniqueKeyWheres) and addr in uniqueKeyResultAddrs:
-                                results += [record]
-                                correspondingAddrs.append(addr)
-
-            return results, correspondingAddrs
+            if self.useNumpy():
+                mask = self.compileMask(columnHash, notUniqueKeyWheres)
+                if mask is not None:
+                    yield from self.vectorScanFindRecords(mask)
+                    return
+            predicate = self.compileWheres(columnHash, notUniqueKeyWheres)
+            for addr, record in self.scanRecords():
+                if predicate is None or predicate(record):  # 通过筛选的record才完整解码
+                    yield addr, self.decodeRecord(record)
+
+        def findRecords(self, columnHash, notUniqueKeyWheres, uniqueKeyResultAddrs, batchSize=None):
+            #  先用索引查到地址，只读这些记录，再判断剩下的条件（fetch-then-filter），复杂度只和查到的记录数有关
+            predicate = self.compileWheres(columnHash, notUniqueKeyWheres)
+            if batchSize is None:
+                records = self.fetchRecords(uniqueKeyResultAddrs)
+            else:
+                records = self.fetchRecordsInBatches(uniqueKeyResultAddrs, batchSize)
+            for addr, record in records:
+                if predicate is None or predicate(record):  # 通过筛选的record才完整解码
+                    yield addr, self.decodeRecord(record)
+
+        def orderedFindRecords(self, columnHash, notUniqueKeyWheres, orderedAddrs):
+            # 按索引的顺序读记录，再判断剩下的条件。ORDER BY 的字段上有B+树索引时用，不需要排序
+            predicate = self.compileWheres(columnHash, notUniqueKeyWheres)
+            for addr, record in self.fetchRecordsInOrder(orderedAddrs):
+                if predicate is None or predicate(record):
+                    yield addr, self.decodeRecord(record)
+
+        def lookupRecords(self, columnHash, notUniqueKeyWheres, addrLists):
+            # 索引嵌套循环连接用：addrLists是一批外表记录各自在索引中查到的地址list，整批一起按地址顺序读，每页只读一次
+            # 再判断剩下的条件，返回与addrLists一一对应的记录list。几条外表记录查到同一条记录时，只读一次、解码一次
+            predicate = self.compileWheres(columnHash, notUniqueKeyWheres)
+            records = {}
+            for addr, record in self.fetchRecords({addr for addrs in addrLists for addr in addrs}):
+                records[addr] = self.decodeRecord(record) if predicate is None or predicate(record) else None
+            return [[records[addr] for addr in addrs if records[addr] is not None] for addrs in addrLists]
+
+        def countRecords(self):  # 数一数表中有几条记录：只看每个record的第一个Byte，0是记录，1是空洞（包括表头）
+            num = 0
+            for start, chunk, count in self.scanChunks():
+                num += bytes(memoryview(chunk)[0 : count * self.recordSize : self.recordSize]).count(0)
+            return num
 
         def deleteRecords(self, correspondingAddrs):
             #  直接用指针删
-            with open(self.recordFile, 'rb+') as recordFile:
-                for addr in correspondingAddrs:
-                    if addr in self.getBufferRange():  # buffer中删除
-                        self.content[addr - self.offset] = struct.pack(  # 删掉，变成空洞链表的结点
-                            f'<cI{self.recordSize - 5}s',
-                            b'\x01', 
-                            self.insertPos,
-                            b'\x00' * (self.recordSize - 5)
-                        )
-                        self.insertPos = addr  # 链表头结点的指针指向刚刚删掉的位置
-                        self.isDirty = True  # buffer与文件的内容不统一了
-                    else:
-                        recordFile.seek(self.recordSize * addr)
-                        recordFile.write(struct.pack(
-                            f'<cI{self.recordSize - 5}s',
-                            b'\x01', 
-                            self.insertPos,
-                            b'\x00' * (self.recordSize - 5)                                    
-                        ))
-                        self.insertPos = addr
-                # recordFile.flush()
+            for addr in correspondingAddrs:
+                self.setRecord(addr, self.packHole(self.insertPos))  # 删掉，变成空洞链表的结点
+                self.insertPos = addr  # 链表头结点的指针指向刚刚删掉的位置
 
         def checkUnique(self, record, columns, uniqueKeyNotWithIndexColumns):
             # 全表扫描检查插入记录是否违反字段定义的唯一性
@@ -261,95 +547,275 @@ class BufferMgr:  # PLUS RecordMgr
                         uniqueBytesIndex += [(i, i + column.charLen)]
                     i += column.charLen
 
-            if self.isDirty:  # Buffer Dirty了，必须先在里面搜
-                for existedRecord in self.content:  # 与已存在的数据作比较
-                    if existedRecord[0] == 1:
-                        continue
-                    for i, j in uniqueBytesIndex:
-                        if existedRecord[i : j] == record[i : j]:
+            if self.useNumpy():
+                self.vectorCheckUnique(record, columns, uniqueKeyNotWithIndexColumns)
+                return
+
+            recordSize = self.recordSize
+            for _, chunk, count in self.scanChunks():  # 在整块中直接查找该字段的二进制串
+                end = count * recordSize
+                for i, j in uniqueBytesIndex:
+                    value = record[i : j]
+                    pos = chunk.find(value, 0, end)
+                    while pos != -1:
+                        offset = pos - i  # 命中的位置必须恰好是某个真实record的这个字段
+                        if offset >= 0 and offset % recordSize == 0 and chunk[offset] == 0:
                             raise BufferException(f'记录插入失败，原因它违反了表中某字段定义的唯一性')
-
-            with open(self.recordFile, 'rb') as recordFile:
-                recordFile.seek(self.recordSize)
-                index = 0
-                while True:
-                    index += 1
-                    if index in self.getBufferRange() and self.isDirty:  # 查到了在Buffer里的记录，可以跳过（注意：必须Dirty）
-                        index = self.getBufferRange()[-1]
-                        recordFile.seek(self.recordSize * (index + 1))
-                    else:  # not hit
-                        existedRecord = recordFile.read(self.recordSize)
-                        if existedRecord == b'':
-                            break
-                        elif existedRecord[0] == 1:
-                            continue
-                        else:
-                            for i, j in uniqueBytesIndex:
-                                if existedRecord[i : j] == record[i : j]:
-                                    raise BufferException(f'记录插入失败，原因它违反了表中某字段定义的唯一性')
+                        pos = chunk.find(value, pos + 1, end)
+
+        def vectorCheckUnique(self, record, columns, uniqueKeyNotWithIndexColumns):
+            # numpy引擎：对每块record一次比较整列。和按二进制串查找一样比较的是字段的原始字节，float按 '<u4' 比较
+            newRecord = np.frombuffer(record, self.recordDtype, 1)
+            uniqueFields = []
+            for i, column in enumerate(columns):
+                if column in uniqueKeyNotWithIndexColumns:
+                    field = f'f{i}'
+                    value = newRecord[field]
+                    uniqueFields.append((field, column.type == 'float', value.view('<u4') if column.type == 'float' else value))
+
+            for _, chunk, count in self.scanChunks():
+                array = np.frombuffer(chunk, self.recordDtype, count)
+                isRecord = array['tag'] == 0
+                for field, isFloat, value in uniqueFields:
+                    values = array[field].view('<u4') if isFloat else array[field]
+                    if np.any(isRecord & (values == value)):
+                        raise BufferException(f'记录插入失败，原因它违反了表中某字段定义的唯一性')
 
         def insertRecord(self, values, columns, uniqueKeyNotWithIndexColumns):
-            string2Bytes(values)
-
-            record = b''
-            record += struct.pack('<c', b'\x00')
-            for i, value in enumerate(values):
-                try:
-                    record += struct.pack(self.formatList[i + 1], value)  # i + 1，第一个是真假record标记，不用管
-                except struct.error as structError:
-                    print(structError)
-                    print(f'检测到变量 {value} 无法打包成二进制，请检查整型类型是否溢出等类似问题！')
-                    exit(1)
-            # record = 读取到的二进制record
+            record = self.packRecord(values)  # 补齐到recordSize
 
             if uniqueKeyNotWithIndexColumns != []:
                 print('进入全表扫描')
                 self.checkUnique(record, columns, uniqueKeyNotWithIndexColumns)
 
-            if not self.insertPos in self.getBufferRange():
-                self.adjustOffset(self.insertPos)
-                # print('self.offset =', self.offset)
-
-            insertPos = self.insertPos  # 新记录会在这里被插入。只插入Buffer，不插入文件
-            if self.insertPos - self.offset == self.curSize:  # 如果插入的是顺序下一个空位
+            insertPos = self.insertPos  # 新记录会在这里被插入。只插入缓冲池，不插入文件
+            if insertPos == self.recordNum:  # 如果插入的是顺序下一个空位
                 self.insertPos += 1
-                self.content.append(record)
-                self.curSize += 1
-            elif self.insertPos - self.offset < self.curSize:  # 如果插入一个空洞
+            elif insertPos < self.recordNum:  # 如果插入一个空洞
                 self.insertPos = struct.unpack(
                     '<cI',
-                    self.content[self.insertPos - self.offset][0:5]
+                    self.getRecord(insertPos)[0:5]
                 )[1]  # 链表接过去
-                self.content[insertPos - self.offset] = record  # 插入内容
             else:
                 raise BufferException('插入到了不合法的地点！')
 
-            self.isDirty = True
+            self.setRecord(insertPos, record)  # 插入内容
             return insertPos
 
-
-    def __init__(self, path, catalogTables):
+        def packRecord(self, values):  # 一条记录打包成二进制record，不修改values
+            values = [value.encode('utf-8') if isinstance(value, str) else value for value in values]
+            try:
+                record = self.recordStruct.pack(b'\x00', *values)
+            except struct.error as structError:
+                raise BufferException(f'检测到记录 {values} 无法打包成二进制（{structError}），请检查整型类型是否溢出等类似问题！')
+            return record.ljust(self.recordSize, b'\x00')
+
+        def checkUniqueRecords(self, records, columns, uniqueKeyNotWithIndexColumns):
+            # 批量插入时，只全表扫描一遍，检查这一批record是否与表中已有的记录违反唯一性。和checkUnique一样比较字段的原始字节
+            fields = []  # (字段下标, 这一批record中这个字段的原始字节)
+            for i, column in enumerate(columns):
+                if column in uniqueKeyNotWithIndexColumns:
+                    start = self.fieldOffsets[i]
+                    end = start + self.fieldStructs[i].size
+                    fields.append((i, start, end, {record[start : end] for record in records}))
+            if not fields:
+                return
+
+            if self.useNumpy():
+                newArray = np.frombuffer(b''.join(records), self.recordDtype)
+                for _, chunk, count in self.scanChunks():
+                    array = np.frombuffer(chunk, self.recordDtype, count)
+                    isRecord = array['tag'] == 0
+                    for i, _, __, ___ in fields:
+                        values, newValues = array[f'f{i}'], newArray[f'f{i}']
+                        if self.formatList[i + 1] == 'f':  # float按原始字节比较
+                            values, newValues = values.view('<u4'), newValues.view('<u4')
+                        if np.any(isRecord & np.isin(values, newValues)):
+                            raise BufferException(f'记录插入失败，原因它违反了表中某字段定义的唯一性')
+                return
+
+            for _, record in self.scanRecords():
+                for _, start, end, values in fields:
+                    if bytes(record[start : end]) in values:  # 页中的memoryview不能作为set的key
+                        raise BufferException(f'记录插入失败，原因它违反了表中某字段定义的唯一性')
+
+        def allocateRecords(self, num):
+            # 为num条新记录分配位置，先用空洞链表中的空位，再接在文件末尾。只计算，不修改任何内容
+            # 返回 [(地址, 插入这一条之后的insertPos), ...]，写日志用
+            slots = []
+            insertPos = self.insertPos
+            while len(slots) < num and insertPos < self.recordNum:
+                addr = insertPos
+                insertPos = struct.unpack('<cI', self.getRecord(addr)[0:5])[1]  # 链表接过去
+                slots.append((addr, insertPos))
+            for addr in range(insertPos, insertPos + num - len(slots)):
+                slots.append((addr, addr + 1))
+            return slots
+
+        def writeRecords(self, slots, records):
+            # 把一批record写到allocateRecords()分配的位置。空洞逐个写，接在文件末尾的部分按页整块写入
+            i = 0
+            while i < len(slots) and slots[i][0] < self.recordNum:
+                self.setRecord(slots[i][0], records[i])
+                i += 1
+            if i < len(slots):
+                self.appendRecords(b''.join(records[i : ]))
+            if slots:
+                self.insertPos = slots[-1][1]
+
+        def appendRecords(self, data):  # 在文件末尾追加若干个record，每页只从缓冲池取一次
+            addr = self.recordNum
+            self.recordNum += len(data) // self.recordSize
+            pos = 0
+            while pos < len(data):
+                pageNo = addr // self.recordsPerPage
+                offset = (addr % self.recordsPerPage) * self.recordSize
+                size = min(self.pageBytes - offset, len(data) - pos)
+                frame = self.pool.fetchPage(self, pageNo)
+                frame.data[offset : offset + size] = data[pos : pos + size]
+                if not frame.isDirty:
+                    frame.isDirty = True
+                    self.dirtyPages[frame.pageNo] = frame
+                addr += size // self.recordSize
+                pos += size
+
+
+    class MmapBuffer(Buffer):
+        # mmap存储模式：整个记录文件被映射到内存，读写record就是对映射区切片，不需要seek/read，也不经过缓冲池
+        def openFile(self):
+            super().openFile()
+            self.mm = mmap.mmap(self.file.fileno(), 0)
+
+        def remap(self, newRecordNum):
+            # 文件变长后重新映射。新增的行都初始化为空洞链表的结点，第i行指向第i+1行，
+            # 正好接在空洞链表的末尾，因此即使没有save()，文件也是合法的
+            try:
+                self.mm.close()
+            except BufferError:  # 还有memoryview引用着旧的映射，等它们被回收时再释放
+                pass
+            self.file.seek(self.recordNum * self.recordSize)
+            self.file.write(b''.join(
+                self.packHole(addr + 1) for addr in range(self.recordNum, newRecordNum)
+            ))
+            self.file.flush()
+            self.mm = mmap.mmap(self.file.fileno(), 0)
+            self.recordNum = newRecordNum
+
+        def getRecord(self, addr):  # override
+            offset = addr * self.recordSize
+            return self.mm[offset : offset + self.recordSize]
+
+        def setRecord(self, addr, record):  # override
+            self.checkRecordSize(record)
+            if addr >= self.recordNum:  # 映射区不够用了
+                growNum = max(1, BufferMgr.mmapGrowSize // self.recordSize)
+                self.remap(max(addr + 1, self.recordNum + growNum))
+            offset = addr * self.recordSize
+            self.mm[offset : offset + self.recordSize] = record
+            granularity = mmap.ALLOCATIONGRANULARITY  # 一个record可能跨两个内存页
+            self.dirtyPages[offset // granularity] = True
+            self.dirtyPages[(offset + self.recordSize - 1) // granularity] = True
+
+        def appendRecords(self, data):  # override。映射区只扩大一次，整块写入
+            start = self.recordNum * self.recordSize
+            num = len(data) // self.recordSize
+            self.remap(self.recordNum + max(num, BufferMgr.mmapGrowSize // self.recordSize))
+            self.mm[start : start + len(data)] = data
+            granularity = mmap.ALLOCATIONGRANULARITY
+            for pageNo in range(start // granularity, (start + len(data) - 1) // granularity + 1):
+                self.dirtyPages[pageNo] = True
+
+        def save(self):  # override。只把改过的内存页同步到文件，连续的页合并成一次flush
+            if self.insertPos != self.savedInsertPos:
+                self.setRecord(0, self.packHole(self.insertPos))  # 改空洞链表的表头
+                self.savedInsertPos = self.insertPos
+            granularity = mmap.ALLOCATIONGRANULARITY
+            pages = sorted(self.dirtyPages)
+            runStart = 0
+            for i, pageNo in enumerate(pages):
+                if i + 1 == len(pages) or pages[i + 1] != pageNo + 1:  # 一段连续的页结束了
+                    start = pages[runStart] * granularity
+                    end = min((pageNo + 1) * granularity, len(self.mm))
+                    self.mm.flush(start, end - start)
+                    runStart = i + 1
+            self.dirtyPages.clear()
+            return len(pages)
+
+        def close(self):  # override
+            try:
+                self.mm.close()
+            except BufferError:
+                pass
+            self.file.close()
+
+        def scanChunks(self):  # override。整个映射区就是一个块
+            yield 0, self.mm, self.recordNum
+
+        def fetchRecords(self, addrs):  # override。直接对映射区切片，由操作系统按需读页
+            view = memoryview(self.mm)
+            recordSize = self.recordSize
+            for addr in sorted(addrs):
+                offset = addr * recordSize
+                yield addr, view[offset : offset + recordSize]
+
+    def __init__(self, path, catalogTables, poolSize=None, storageMode=None, logMgr=None):
         self.path = os.path.join(path, 'dbfiles/records')
         if not os.path.exists(self.path):
             os.makedirs(self.path)
-        
+
+        if poolSize is None:
+            poolSize = BufferMgr.poolSize
+        if storageMode is None:
+            storageMode = BufferMgr.storageMode
+        if storageMode == 'pool':
+            self.bufferClass = self.Buffer
+        elif storageMode == 'mmap':
+            self.bufferClass = self.MmapBuffer
+        else:
+            raise BufferException(f'抱歉，不支持 {storageMode} 存储模式')
+        self.pool = self.BufferPool(max(1, poolSize // BufferMgr.pageSize), logMgr)  # 所有表共享一个缓冲池
         self.buffers = {}
+        self.rowNumFile = os.path.join(self.path, 'rowNums.json')
+        self.rowNums = {}  # 表名 -> 表中有几条记录。插入、删除时维护，count(*)不需要读记录文件。None表示还不知道，第一次用到时数一遍
+        self.rowNumLsn = 0  # rowNums.json中的行数已经包含了lsn不超过它的日志，重放日志时只计入之后的
+        self.isRowNumDirty = False
         self.load(catalogTables)
 
-    def save(self):
+    def save(self):  # 返回写了几页
+        writeNum = 0
         for buffer in self.buffers.values():
-            buffer.save()
+            writeNum += buffer.save()
+        if self.isRowNumDirty:  # 行数和当前的lsn一起写入。写完之后、清空日志之前崩溃时，重放的日志不会被重复计入
+            if self.pool.logMgr is not None:
+                self.rowNumLsn = self.pool.logMgr.lsn
+            with open(self.rowNumFile + '.tmp', 'w') as rowNumFile:
+                json.dump({'lsn': self.rowNumLsn, 'rowNums': self.rowNums}, rowNumFile)
+            os.replace(self.rowNumFile + '.tmp', self.rowNumFile)
+            self.isRowNumDirty = False
+        return writeNum
 
     def load(self, catalogTables):
+        savedRowNums = {}
+        if os.path.exists(self.rowNumFile):
+            with open(self.rowNumFile) as rowNumFile:
+                saved = json.load(rowNumFile)
+            self.rowNumLsn = saved['lsn']
+            savedRowNums = saved['rowNums']
+        for tableName in catalogTables:
+            self.rowNums[tableName] = savedRowNums.get(tableName)
         for tableName, catalogTable in catalogTables.items():
-            self.buffers[tableName] = self.Buffer(
+            self.buffers[tableName] = self.bufferClass(
                 path=self.path,
                 tableName=tableName,
-                columns=catalogTable.columns
+                columns=catalogTable.columns,
+                pool=self.pool
             )
 
-    def findRecords(self, tableName, columnHash, notUniqueKeyWheres, uniqueKeyWheres, uniqueKeyResultAddrs):
+    def iterRecords(self, tableName, columnHash, notUniqueKeyWheres, uniqueKeyWheres, uniqueKeyResultAddrs, limit=None):
+        # 返回 (地址, 记录) 的迭代器，记录在迭代的时候才读出、解码。调用者不再迭代时，扫描就停止
+        # limit：调用者最多要几条记录（LIMIT + OFFSET）。给出时索引查到的地址分批读，不必先把索引查到的所有地址都取出来排序
         buffer = self.buffers[tableName]
+        batchSize = None if limit is None else BufferMgr.limitBatchSize
         if uniqueKeyWheres == []:  # 纯全表扫描
             print('您正在进行全表扫描。')
             return buffer.scanFindRecords(
@@ -359,24 +825,110 @@ class BufferMgr:  # PLUS RecordMgr
         elif notUniqueKeyWheres == []:  # 纯B+树
             print('您正在进行在B+树索引帮助下的查询。')
             return buffer.bPlusFindRecords(
-                uniqueKeyResultAddrs
+                uniqueKeyResultAddrs,
+                batchSize
             )
-        else:  #  带条件的全表扫描
-            print('您正在进行在B+树索引帮助下的全表扫描。')
+        else:  #  用索引查到的记录再筛选
+            print('您正在进行在B+树索引帮助下的查询，并筛选查到的记录。')
             return buffer.findRecords(
                 columnHash, 
                 notUniqueKeyWheres, 
-                uniqueKeyResultAddrs
+                uniqueKeyResultAddrs,
+                batchSize
             )
 
+    def iterOrderedRecords(self, tableName, columnHash, notUniqueKeyWheres, orderedAddrs):
+        # 按B+树索引给出的顺序返回 (地址, 记录) 的迭代器
+        print('您正在按B+树索引的顺序进行查询。')
+        return self.buffers[tableName].orderedFindRecords(columnHash, notUniqueKeyWheres, orderedAddrs)
+
+    def lookupRecords(self, tableName, columnHash, notUniqueKeyWheres, addrLists):  # 索引嵌套循环连接用，见Buffer.lookupRecords
+        return self.buffers[tableName].lookupRecords(columnHash, notUniqueKeyWheres, addrLists)
+
+    def findRecords(self, tableName, columnHash, notUniqueKeyWheres, uniqueKeyWheres, uniqueKeyResultAddrs):
+        # 返回 (记录列表, 地址列表)。删除、建索引要先拿到全部结果再修改表，用这个
+        recordsFound = []
+        correspondingAddrs = []
+        for addr, record in self.iterRecords(tableName, columnHash, notUniqueKeyWheres, uniqueKeyWheres, uniqueKeyResultAddrs):
+            recordsFound.append(record)
+            correspondingAddrs.append(addr)
+        return recordsFound, correspondingAddrs
+
+    def scanColumns(self, tableName, columnIndices):  # 全表扫描，逐块返回 (地址列表, [每个字段的值列表])
+        return self.buffers[tableName].scanColumns(columnIndices)
+
+    def scanRecords(self, tableName):  # 全表扫描，依次返回解码后的记录。优化器统计用
+        buffer = self.buffers[tableName]
+        for _, record in buffer.scanRecords():
+            yield buffer.decodeRecord(record)
+
+    def getRecordNum(self, tableName):  # 文件中一共有几行（含表头和空洞）
+        return self.buffers[tableName].recordNum
+
+    def getPageNum(self, tableName):  # 记录不跨页存储，页数按每页的记录数计算
+        return self.buffers[tableName].getPageNum()
+
     def deleteRecords(self, tableName, correspondingAddrs):
         buffer = self.buffers[tableName]
         buffer.deleteRecords(correspondingAddrs)
+        self.changeRowNum(tableName, -len(correspondingAddrs))
+
+    def changeRowNum(self, tableName, delta):
+        if self.rowNums[tableName] is not None:
+            self.rowNums[tableName] += delta
+            self.isRowNumDirty = True
+
+    def getRowNum(self, tableName):  # 表中有几条记录（不含空洞）
+        if self.rowNums[tableName] is None:  # 没有保存过行数（例如旧版本建的表），数一遍以后就一直维护
+            self.rowNums[tableName] = self.buffers[tableName].countRecords()
+            self.isRowNumDirty = True
+        return self.rowNums[tableName]
+
+    def getRecord(self, tableName, addr):  # 二进制的record，写日志用
+        return self.buffers[tableName].getRecord(addr)
+
+    def decodeRecord(self, tableName, record):
+        return self.buffers[tableName].decodeRecord(record)
+
+    def redoInsert(self, tableName, addr, record, insertPos, lsn):
+        # 重放插入日志：直接写入日志中的record和插入后的insertPos，不依赖文件中空洞链表的内容
+        buffer = self.buffers[tableName]
+        buffer.setRecord(addr, record)
+        buffer.insertPos = insertPos
+        if lsn > self.rowNumLsn:
+            self.changeRowNum(tableName, 1)
+
+    def redoDelete(self, tableName, addr, nextPos, lsn):
+        # 重放删除日志：空洞指向日志中记下的nextPos，不依赖当前的insertPos。
+        # 数据文件可能已经包含了这些修改（检查点写完数据、清空日志前崩溃，或者脏页被换出），重放多少次结果都一样
+        buffer = self.buffers[tableName]
+        buffer.setRecord(addr, buffer.packHole(nextPos))
+        buffer.insertPos = addr
+        if lsn > self.rowNumLsn:
+            self.changeRowNum(tableName, -1)
 
     def insertRecord(self, tableName, values, columns, uniqueKeyNotWithIndexColumns):
         # 注意传参
         buffer = self.buffers[tableName]
-        return buffer.insertRecord(values, columns, uniqueKeyNotWithIndexColumns)
+        insertPos = buffer.insertRecord(values, columns, uniqueKeyNotWithIndexColumns)
+        self.changeRowNum(tableName, 1)
+        return insertPos
+
+    def packRecords(self, tableName, rows):  # 批量插入：把一批记录打包成二进制record
+        buffer = self.buffers[tableName]
+        return [buffer.packRecord(values) for values in rows]
+
+    def checkUniqueRecords(self, tableName, records, columns, uniqueKeyNotWithIndexColumns):
+        if uniqueKeyNotWithIndexColumns != []:
+            print('进入全表扫描')
+            self.buffers[tableName].checkUniqueRecords(records, columns, uniqueKeyNotWithIndexColumns)
+
+    def allocateRecords(self, tableName, num):
+        return self.buffers[tableName].allocateRecords(num)
+
+    def writeRecords(self, tableName, slots, records):
+        self.buffers[tableName].writeRecords(slots, records)
+        self.changeRowNum(tableName, len(records))
 
     def createTable(self, tableName, columns):  # 文件初始化一个表
         # 注意传参
@@ -399,14 +951,21 @@ class BufferMgr:  # PLUS RecordMgr
                 1,  # 空洞链表的头结点（第0行）指向第1行
                 b'\x00' * (recordSize - 5)
             ))
-        self.buffers[tableName] = BufferMgr.Buffer(  # 一个表对应一个Buffer
+        self.buffers[tableName] = self.bufferClass(  # 一个表对应一个Buffer
             path=self.path,
             tableName=tableName,
-            columns=columns
+            columns=columns,
+            pool=self.pool
         )
+        self.rowNums[tableName] = 0
+        self.isRowNumDirty = True
 
     def dropTable(self, tableName):
-        self.buffers.pop(tableName)
+        buffer = self.buffers.pop(tableName)
+        del self.rowNums[tableName]
+        self.isRowNumDirty = True
+        self.pool.dropTable(buffer)
+        buffer.close()
         recordFile = os.path.join(self.path, f'{tableName}.dat')
         os.remove(recordFile)
 
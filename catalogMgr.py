@@ -23,7 +23,8 @@ class CatalogMgr:
     self.tables 的格式：
     {'stu': <CatalogMgr.CatalogTable object>, 'tableName': ...}
     self.indices 的格式：
-    {'indexName': {'tableName': ..., 'columnName': ...}, 'indexName2': ...}
+    {'indexName': {'tableName': ..., 'columnName': ..., 'using': 'btree'}, 'indexName2': ...}
+    using 是索引的类型：'btree' 或 'hash'，旧的目录文件中没有这一项，即 'btree'
     '''
 
     def __init__(self, path):
@@ -32,16 +33,33 @@ class CatalogMgr:
         self.path = os.path.join(path, 'dbfiles/catalogs')
         self.tableCatalog = os.path.join(self.path, 'tableCatalog.json')
         self.indexCatalog = os.path.join(self.path, 'indexCatalog.json')
+        self.isTableCatalogDirty = False  # 逻辑表被修改过，提交时需要重写 tableCatalog.json
+        self.isIndexCatalogDirty = False
         if not os.path.exists(self.path):
             os.makedirs(self.path)
             tableCatalog = open(self.tableCatalog, 'w')
             indexCatalog = open(self.indexCatalog, 'w')
             tableCatalog.close()
             indexCatalog.close()
+            self.isTableCatalogDirty = True
+            self.isIndexCatalogDirty = True
             self.save()
         self.load()
 
-    def save(self):  # 向文件写入逻辑表、逻辑索引
+    def save(self):  # 向文件写入被修改过的逻辑表、逻辑索引。返回写了几个文件
+        writeNum = 0
+        if self.isTableCatalogDirty:
+            self.saveTables()
+            self.isTableCatalogDirty = False
+            writeNum += 1
+        if self.isIndexCatalogDirty:
+            with open(self.indexCatalog, 'w') as indexCatalog:
+                json.dump(self.indices, indexCatalog)
+            self.isIndexCatalogDirty = False
+            writeNum += 1
+        return writeNum
+
+    def saveTables(self):
         writeTables = {}
         for tableName, catalogTable in self.tables.items():
             columns = {}  # 由列名到逻辑列的哈希
@@ -58,8 +76,6 @@ class CatalogMgr:
 
         with open(self.tableCatalog, 'w') as tableCatalog:
             json.dump(writeTables, tableCatalog)
-        with open(self.indexCatalog, 'w') as indexCatalog:
-            json.dump(self.indices, indexCatalog)
 
     def load(self):  # 内存读取逻辑表、逻辑索引
         with open(self.tableCatalog, 'r') as tableCatalog:
@@ -117,16 +133,16 @@ class CatalogMgr:
         table = self.CatalogTable(tableName, columns, primaryKey)
 
         self.tables[tableName] = table
+        self.isTableCatalogDirty = True
 
-    def createIndex(self, indexName, tableName, attributeName):
-        columns = self.tables[tableName].columns
-        for column in columns:
-            if column.columnName == attributeName and column.isUnique is False:
-                raise QueryException(f'抱歉，只支持在声明为 Unique 的属性上创建索引！')
+    def createIndex(self, indexName, tableName, attributeName, using='btree'):
+        # 在非 unique 的属性上创建的是非唯一索引
         self.indices[indexName] = {
             'tableName': tableName,
-            'columnName': attributeName
+            'columnName': attributeName,
+            'using': using
         }
+        self.isIndexCatalogDirty = True
 
     def dropTable(self, tableName):
         self.tables.pop(tableName)
@@ -136,13 +152,18 @@ class CatalogMgr:
                 dropIndexNames.append(indexName)
         for dropIndexName in dropIndexNames:
             self.indices.pop(dropIndexName)
+        self.isTableCatalogDirty = True
+        if dropIndexNames:
+            self.isIndexCatalogDirty = True
 
 
     def dropIndex(self, indexName):
         tableName = self.indices[indexName]['tableName']
         keyName = self.indices[indexName]['columnName']
+        using = self.indices[indexName].get('using', 'btree')
         self.indices.pop(indexName)
-        return tableName, keyName  # 给indexMgr用
+        self.isIndexCatalogDirty = True
+        return tableName, keyName, using  # 给indexMgr用
 
     def checkValidType(self, tableName, values):  
         # 检查试图插入的记录的各属性类型与表的定义是否匹配
@@ -11,4 +11,7 @@ class BufferException(Exception):  # Buffer操作异常
     pass
 
 class IndexMgrException(Exception): 
-    pass
\ No newline at end of file
+    pass
+
+class HashIndexException(Exception):  # 哈希索引操作异常
+    pass
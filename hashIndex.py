@@ -0,0 +1,168 @@
+import zlib
+import struct
+from array import array
+from bisect import bisect_left
+from exception import HashIndexException
+
+'''
+可扩展哈希（extendible hashing）索引，只支持等值查找
+'''
+
+
+class Bucket:
+    # 桶里的key没有顺序，查找时在整个桶里找。pager 不为空时，桶对应索引文件中的一页
+    __slots__ = ('localDepth', 'keys', 'values', 'pager', 'pageNo')
+
+    def __init__(self, localDepth, keys, values, pager=None) -> None:
+        self.localDepth = localDepth  # 桶里所有key的哈希值的低 localDepth 位都相同
+        self.keys = keys
+        self.values = values  # 唯一索引是地址组成的 array('q')，非唯一索引是地址数组（posting）组成的list
+        self.pager = pager
+        self.pageNo = None
+        if pager is not None:
+            pager.allocate(self)  # 新桶分配一页，并记为dirty
+
+    def __str__(self) -> str:
+        return 'Bucket: keys =' + str(self.keys)
+
+    def markDirty(self):
+        if self.pager is not None:
+            self.pager.dirty[self.pageNo] = self
+
+    def find(self, key):  # 返回key在桶中的下标，没有则返回-1
+        try:
+            return self.keys.index(key)
+        except (ValueError, TypeError):
+            return -1
+
+
+class HashIndex:
+    bucketSize = 64  # 默认每个桶最多放几个key，放满了就分裂
+    maxDepth = 24  # 目录最多 2 ** maxDepth 项。哈希值相同的key太多时，桶不再分裂，直接放进去
+
+    def __init__(self, bucketSize=None, keyType=None, pager=None, isUnique=True, directory=None) -> None:
+        # directory 是目录：第i项是哈希值低位等于i的key所在的桶，可能还是未读入内存的页号
+        self.bucketSize = bucketSize if bucketSize is not None else HashIndex.bucketSize
+        self.keyType = keyType  # key的array类型码：'i'（int）、'd'（float）。None表示用list存（char）
+        self.isUnique = isUnique
+        self.pager = pager
+        self.pageNo = None  # 目录所在的页
+        if directory is None:
+            directory = [Bucket(0, self.newKeys(), self.newValues(), pager)]
+            if pager is not None:
+                pager.allocate(self)  # 目录也占一页
+        self.directory = directory
+        self.globalDepth = len(directory).bit_length() - 1
+
+    def newKeys(self):
+        if self.keyType is None:
+            return []
+        return array(self.keyType)
+
+    def newValues(self):
+        if self.isUnique:
+            return array('q')
+        return []
+
+    def markDirty(self):  # 目录被修改了
+        if self.pager is not None:
+            self.pager.dirty[self.pageNo] = self
+
+    def hashKey(self, key):
+        # 哈希值要写进文件，不能用随进程变化的 hash()。int和float都按double编码，这样 3 和 3.0 的哈希值相同
+        if self.keyType is None:
+            return zlib.crc32(key.encode('utf-8'))
+        return zlib.crc32(struct.pack('<d', key))
+
+    def getBucket(self, i):  # 取目录第i项的桶。还是页号时，按需从索引文件读入
+        bucket = self.directory[i]
+        if type(bucket) is int:
+            bucket = self.pager.loadNode(bucket)
+            self.directory[i] = bucket
+        return bucket
+
+    def findBucket(self, key):
+        return self.getBucket(self.hashKey(key) & ((1 << self.globalDepth) - 1))
+
+    def find(self, key):  # 返回key对应的value（地址或posting），找不到返回None
+        if not isinstance(key, str if self.keyType is None else (int, float)):  # 类型不对，不可能相等
+            return None
+        bucket = self.findBucket(key)
+        i = bucket.find(key)
+        if i < 0:
+            return None
+        return bucket.values[i]
+
+    def findAddrs(self, key):  # 返回key对应的所有地址
+        value = self.find(key)
+        if value is None:
+            return []
+        if self.isUnique:
+            return [value]
+        return value
+
+    def insert(self, key, value):
+        hashValue = self.hashKey(key)
+        while True:
+            i = hashValue & ((1 << self.globalDepth) - 1)
+            bucket = self.getBucket(i)
+            pos = bucket.find(key)
+            if pos >= 0:
+                if self.isUnique:
+                    raise HashIndexException(f'索引中已存在 key {key}')
+                posting = bucket.values[pos]  # key已存在，把地址加进它的posting
+                j = bisect_left(posting, value)
+                if j == len(posting) or posting[j] != value:
+                    posting.insert(j, value)
+                    bucket.markDirty()
+                return
+            if len(bucket.keys) < self.bucketSize or bucket.localDepth >= HashIndex.maxDepth:
+                bucket.keys.append(key)
+                bucket.values.append(value if self.isUnique else array('q', [value]))
+                bucket.markDirty()
+                return
+            self.split(i, bucket)  # 桶满了，分裂后重新找桶
+
+    def split(self, i, bucket):
+        if bucket.localDepth == self.globalDepth:  # 目录翻倍，新的一半和旧的一半指向相同的桶
+            self.directory += self.directory
+            self.globalDepth += 1
+            self.markDirty()
+
+        oldStep = 1 << bucket.localDepth
+        bucket.localDepth += 1
+        newBucket = Bucket(bucket.localDepth, self.newKeys(), self.newValues(), self.pager)
+        keys, values = bucket.keys, bucket.values
+        bucket.keys, bucket.values = self.newKeys(), self.newValues()
+        for key, value in zip(keys, values):  # 按哈希值的第 localDepth 位重新分配
+            target = newBucket if self.hashKey(key) & oldStep else bucket
+            target.keys.append(key)
+            target.values.append(value)
+        bucket.markDirty()
+
+        for j in range(i & (oldStep - 1), len(self.directory), oldStep):  # 原来指向这个桶的目录项
+            if j & oldStep:
+                self.directory[j] = newBucket
+        self.markDirty()
+
+    def delete(self, key, value=None):
+        # 非唯一索引给出value时，只从key的posting中删除这个地址，posting删空了才删除key。桶不合并
+        bucket = self.findBucket(key)
+        i = bucket.find(key)
+        if i < 0:
+            return False
+
+        if not self.isUnique and value is not None:
+            posting = bucket.values[i]
+            j = bisect_left(posting, value)
+            if j == len(posting) or posting[j] != value:
+                return False
+            posting.pop(j)
+            bucket.markDirty()
+            if len(posting) > 0:
+                return True
+
+        bucket.keys.pop(i)
+        bucket.values.pop(i)
+        bucket.markDirty()
+        return True
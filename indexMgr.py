@@ -1,12 +1,14 @@
 import os
 import json
-from copy import deepcopy
-
+import struct
+from array import array
+from itertools import chain
 from exception import IndexMgrException
+from bufferMgr import roundFloat
 
-from bPlusTree import Node
-from bPlusTree import LeafNode
+from bPlusTree import Node, LeafNode
 from bPlusTree import BPlusTree
+from hashIndex import Bucket, HashIndex
 
 '''
 管理数据库索引，实现 B+ 树数据结构
@@ -20,334 +22,624 @@ def bytes2String(values):  # 如果values里面有bytes，则转换为string。
 
 class IndexMgr:
     # 实现的是非聚簇索引
-    order = 4  # 2-3-4树
+    order = 128  # 默认的阶数，即每个结点最多有几个孩子。阶数越大，树越矮，查找时经过的结点越少
+    maxOrder = 65535  # 结点的key数在页中存为2字节无符号整数，阶数不能超过它
+
+    class Pager:
+        # 一个索引对应一个文件。第0页是元数据页，其余每个结点占一页，按页号寻址
+        # 结点太大放不下一页时，用溢出页串起来。结点在第一次访问时才从文件读入，提交时只写回dirty的结点
+        pageSize = 4096
+        magic = b'MIDX'
+        metaStruct = struct.Struct('<4sIIIIcHH')  # magic, 阶数, 根的页号, 总页数, 空闲页链表头, key类型, 表名长度, 字段名长度
+        # 元数据之后是表名、字段名，再之后1字节表示是否是非唯一索引（旧文件中这里是0，即唯一索引）
+        nodeStruct = struct.Struct('<BHII')  # 是否叶子, key数, 上一个叶子的页号, 下一个叶子的页号（0表示没有）
+        linkStruct = struct.Struct('<I')  # 每页开头：下一个溢出页（空闲页则是下一个空闲页）的页号，0表示没有
+        keySizes = {'i': 4, 'd': 8}
+
+        def __init__(self, path, tableName=None, keyName=None, order=None, keyType=None, isUnique=True):
+            # tableName为空时打开已有的索引文件，否则新建一个（第一次提交时才真正创建文件）
+            self.path = path
+            self.nodes = {}  # 已经读入内存的结点：页号 -> 结点
+            self.dirty = {}  # 需要写回的结点：页号 -> 结点
+            self.overflowPages = {}  # 结点的第一页 -> 它的溢出页
+            self.freePages = []  # 空闲页的栈，栈顶是空闲链表头
+            self.freshFreePages = set()  # 上次提交后新释放的页，需要写入空闲链表的指针
+            if tableName is None:
+                self.file = open(path, 'rb+')
+                self.readMeta()
+            else:
+                self.file = None
+                self.tableName = tableName
+                self.keyName = keyName
+                self.order = order
+                self.keyType = keyType
+                self.isUnique = isUnique
+                self.rootPage = 0
+                self.pageCount = 1
+
+        def readMeta(self):
+            self.file.seek(0)
+            data = self.file.read(IndexMgr.Pager.pageSize)
+            magic, self.order, self.rootPage, self.pageCount, freeHead, keyType, tableNameLen, keyNameLen = \
+                IndexMgr.Pager.metaStruct.unpack_from(data)
+            if magic != self.magic:
+                raise IndexMgrException(f'索引文件 {self.path} 已损坏！')
+            self.keyType = None if keyType == b's' else keyType.decode()
+            offset = IndexMgr.Pager.metaStruct.size
+            self.tableName = data[offset : offset + tableNameLen].decode('utf-8')
+            offset += tableNameLen
+            self.keyName = data[offset : offset + keyNameLen].decode('utf-8')
+            offset += keyNameLen
+            self.isUnique = data[offset] == 0
+
+            freePages = []
+            while freeHead != 0:  # 从链表头开始收集空闲页
+                freePages.append(freeHead)
+                freeHead, = IndexMgr.Pager.linkStruct.unpack(self.readPage(freeHead)[ : 4])
+            self.freePages = freePages[ : : -1]
+
+        def writeMeta(self):
+            tableName = self.tableName.encode('utf-8')
+            keyName = self.keyName.encode('utf-8')
+            keyType = b's' if self.keyType is None else self.keyType.encode()
+            freeHead = self.freePages[-1] if self.freePages else 0
+            data = IndexMgr.Pager.metaStruct.pack(self.magic, self.order, self.rootPage,
+                                                  self.pageCount, freeHead, keyType, len(tableName), len(keyName))
+            self.writePage(0, data + tableName + keyName + bytes([not self.isUnique]))
+
+        def readPage(self, pageNo):
+            self.file.seek(pageNo * IndexMgr.Pager.pageSize)
+            return self.file.read(IndexMgr.Pager.pageSize)
+
+        def writePage(self, pageNo, data):
+            self.file.seek(pageNo * IndexMgr.Pager.pageSize)
+            self.file.write(data.ljust(IndexMgr.Pager.pageSize, b'\x00'))
+
+        def openTree(self):  # 只读入根结点，其余结点按需读入
+            root = self.loadNode(self.rootPage)
+            return BPlusTree(order=self.order, keyType=self.keyType, pager=self, root=root, isUnique=self.isUnique)
+
+        def allocatePage(self):  # 优先复用空闲页
+            if self.freePages:
+                pageNo = self.freePages.pop()
+                self.freshFreePages.discard(pageNo)
+            else:
+                pageNo = self.pageCount
+                self.pageCount += 1
+            return pageNo
+
+        def releasePage(self, pageNo):
+            self.freePages.append(pageNo)
+            self.freshFreePages.add(pageNo)
+
+        def allocate(self, node):  # 给新结点分配一页
+            node.pageNo = self.allocatePage()
+            self.nodes[node.pageNo] = node
+            self.dirty[node.pageNo] = node
+
+        def free(self, node):
+            self.nodes.pop(node.pageNo, None)
+            self.dirty.pop(node.pageNo, None)
+            for pageNo in self.overflowPages.pop(node.pageNo, []):
+                self.releasePage(pageNo)
+            self.releasePage(node.pageNo)
+
+        def readData(self, pageNo):  # 顺着溢出页读出一页开始的全部内容
+            chunks = []
+            overflowPages = []
+            nextPage = pageNo
+            while True:  # 顺着溢出页读出整个结点
+                page = self.readPage(nextPage)
+                chunks.append(page[4 : ])
+                nextPage, = IndexMgr.Pager.linkStruct.unpack(page[ : 4])
+                if nextPage == 0:
+                    break
+                overflowPages.append(nextPage)
+            if overflowPages:
+                self.overflowPages[pageNo] = overflowPages
+            return b''.join(chunks)
+
+        def loadNode(self, pageNo):
+            node = self.nodes.get(pageNo)
+            if node is not None:
+                return node
+
+            data = self.readData(pageNo)
+            isLeaf, keyCount, prevPage, nextPage = IndexMgr.Pager.nodeStruct.unpack_from(data)
+            keys, offset = self.decodeKeys(data, IndexMgr.Pager.nodeStruct.size, keyCount)
+            if isLeaf:
+                children = self.decodeValues(data, offset, keyCount)
+                node = LeafNode(order=self.order, parent=None, keys=keys, children=children)
+                node.prevLeaf = prevPage if prevPage != 0 else None  # 先存页号，访问时再读入
+                node.nextLeaf = nextPage if nextPage != 0 else None
+            else:
+                children = array('I')
+                children.frombytes(data[offset : offset + 4 * (keyCount + 1)])
+                node = Node(order=self.order, parent=None, keys=keys, children=children.tolist())
+            node.pager = self
+            node.pageNo = pageNo
+            self.nodes[pageNo] = node
+            return node
+
+        def decodeValues(self, data, offset, keyCount):
+            # 唯一索引：每个key一个8字节地址。非唯一索引：先是每个posting的长度（4字节），再是所有地址
+            addrs = array('q')
+            if self.isUnique:
+                addrs.frombytes(data[offset : offset + 8 * keyCount])
+                return addrs
+            lengths = array('I')
+            lengths.frombytes(data[offset : offset + 4 * keyCount])
+            offset += 4 * keyCount
+            addrs.frombytes(data[offset : offset + 8 * sum(lengths)])
+            postings = []
+            start = 0
+            for length in lengths:
+                postings.append(addrs[start : start + length])
+                start += length
+            return postings
+
+        def encodeValues(self, values):
+            if self.isUnique:
+                return array('q', values).tobytes()
+            lengths = array('I', [len(posting) for posting in values])
+            return lengths.tobytes() + b''.join(posting.tobytes() for posting in values)
+
+        def decodeKeys(self, data, offset, keyCount):  # 返回 (keys, 读完后的偏移)
+            if self.keyType is not None:
+                keys = array(self.keyType)
+                end = offset + IndexMgr.Pager.keySizes[self.keyType] * keyCount
+                keys.frombytes(data[offset : end])
+                return keys, end
+            keys = []
+            for _ in range(keyCount):  # char类型的key：2字节长度 + utf-8编码
+                length = data[offset] | (data[offset + 1] << 8)
+                offset += 2
+                keys.append(data[offset : offset + length].decode('utf-8'))
+                offset += length
+            return keys, offset
+
+        def encodeNode(self, node):
+            if node.isLeaf():
+                prevLeaf, nextLeaf = node._prevLeaf, node._nextLeaf
+                prevPage = prevLeaf if type(prevLeaf) is int else (0 if prevLeaf is None else prevLeaf.pageNo)
+                nextPage = nextLeaf if type(nextLeaf) is int else (0 if nextLeaf is None else nextLeaf.pageNo)
+                children = self.encodeValues(node.children)
+            else:
+                prevPage = nextPage = 0
+                children = array('I', [child if type(child) is int else child.pageNo for child in node.children]).tobytes()
+
+            if self.keyType is not None:
+                keys = array(self.keyType, node.keys).tobytes()
+            else:
+                encodedKeys = [key.encode('utf-8') for key in node.keys]
+                keys = b''.join(len(key).to_bytes(2, 'little') + key for key in encodedKeys)
+            header = IndexMgr.Pager.nodeStruct.pack(node.isLeaf(), len(node.keys), prevPage, nextPage)
+            return header + keys + children
+
+        def writeNode(self, node):
+            self.writeData(node.pageNo, self.encodeNode(node))
+
+        def writeData(self, firstPage, data):  # 从firstPage开始写，放不下时用溢出页
+            capacity = IndexMgr.Pager.pageSize - 4
+            pageNum = max(1, -(-len(data) // capacity))  # 需要几页
+            pages = [firstPage] + self.overflowPages.pop(firstPage, [])
+            while len(pages) < pageNum:
+                pages.append(self.allocatePage())
+            for pageNo in pages[pageNum : ]:  # 结点变小了，多余的溢出页还回去
+                self.releasePage(pageNo)
+            pages = pages[ : pageNum]
+            if pageNum > 1:
+                self.overflowPages[firstPage] = pages[1 : ]
+
+            for i, pageNo in enumerate(pages):
+                nextPage = pages[i + 1] if i + 1 < pageNum else 0
+                chunk = data[i * capacity : (i + 1) * capacity]
+                self.writePage(pageNo, IndexMgr.Pager.linkStruct.pack(nextPage) + chunk)
+
+        def save(self, tree):  # 只写回dirty的结点。返回是否写了文件
+            return self.saveNodes(tree.root.pageNo)
+
+        def saveNodes(self, rootPage):
+            if self.file is not None and not self.dirty and not self.freshFreePages and rootPage == self.rootPage:
+                return False
+            if self.file is None:
+                self.file = open(self.path, 'wb+')
+
+            for node in self.dirty.values():
+                self.writeNode(node)
+            positions = {pageNo: i for i, pageNo in enumerate(self.freePages)}
+            for pageNo in self.freshFreePages:  # 空闲页的栈中，每一页指向它下面的一页
+                i = positions[pageNo]
+                nextPage = self.freePages[i - 1] if i > 0 else 0
+                self.writePage(pageNo, IndexMgr.Pager.linkStruct.pack(nextPage))
+            self.rootPage = rootPage
+            self.writeMeta()
+            self.file.flush()
+            os.fsync(self.file.fileno())
+
+            self.dirty.clear()
+            self.freshFreePages.clear()
+            return True
+
+        def close(self):
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+
+    class HashPager(Pager):
+        # 哈希索引的文件，页的管理和 Pager 相同。元数据页中的阶数存桶的大小，根的页号存目录所在的页
+        # 目录页存全局深度和每一项指向的桶的页号，每个桶占一页：局部深度、key数、key、value
+        magic = b'MHSH'
+        bucketStruct = struct.Struct('<BH')  # 局部深度, key数
+        directoryStruct = struct.Struct('<B')  # 全局深度，目录一共有 2 ** 全局深度 项
+
+        def openTree(self):  # 只读入目录，桶按需读入
+            data = self.readData(self.rootPage)
+            globalDepth, = IndexMgr.HashPager.directoryStruct.unpack_from(data)
+            start = IndexMgr.HashPager.directoryStruct.size
+            directory = array('I')
+            directory.frombytes(data[start : start + 4 * (1 << globalDepth)])
+            index = HashIndex(bucketSize=self.order, keyType=self.keyType, pager=self,
+                              isUnique=self.isUnique, directory=directory.tolist())
+            index.pageNo = self.rootPage
+            return index
+
+        def loadNode(self, pageNo):
+            bucket = self.nodes.get(pageNo)
+            if bucket is not None:
+                return bucket
+
+            data = self.readData(pageNo)
+            localDepth, keyCount = IndexMgr.HashPager.bucketStruct.unpack_from(data)
+            keys, offset = self.decodeKeys(data, IndexMgr.HashPager.bucketStruct.size, keyCount)
+            values = self.decodeValues(data, offset, keyCount)
+            bucket = Bucket(localDepth, keys, values)
+            bucket.pager = self
+            bucket.pageNo = pageNo
+            self.nodes[pageNo] = bucket
+            return bucket
+
+        def encodeNode(self, node):
+            if isinstance(node, HashIndex):  # 目录
+                header = IndexMgr.HashPager.directoryStruct.pack(node.globalDepth)
+                return header + array('I', [bucket if type(bucket) is int else bucket.pageNo
+                                            for bucket in node.directory]).tobytes()
+            if self.keyType is not None:
+                keys = array(self.keyType, node.keys).tobytes()
+            else:
+                encodedKeys = [key.encode('utf-8') for key in node.keys]
+                keys = b''.join(len(key).to_bytes(2, 'little') + key for key in encodedKeys)
+            header = IndexMgr.HashPager.bucketStruct.pack(node.localDepth, len(node.keys))
+            return header + keys + self.encodeValues(node.values)
+
+        def save(self, index):  # 只写回dirty的桶和目录。返回是否写了文件
+            return self.saveNodes(index.pageNo)
 
     '''
         self.tables 的格式：
-        {'stu': {'uniqueKeyName1': tree1, 'uniqueKeyName2': tree2}, 'tableName': ...}
+        {'stu': {'uniqueKeyName1': tree1, 'keyName2': tree2}, 'tableName': ...}
+        每棵树存放在 dbfiles/indices/表名.字段名.idx 中
+        unique 字段上的索引是唯一索引；其他字段上的是非唯一索引，每个key对应一个地址数组（posting）
+        self.hashTables 的格式相同，存放 using hash 创建的哈希索引，文件是 dbfiles/indices/表名.字段名.hidx
+        同一个字段上可以同时有B+树索引和哈希索引：等值查找用哈希索引，范围查找用B+树
     '''
 
-    def __init__(self, path):
+    def __init__(self, path, catalogTables):
         self.tables = {}  # 用索引表示的逻辑表
+        self.hashTables = {}  # 哈希索引
+        self.catalogTables = catalogTables  # 和CatalogMgr共享，用来确定key的类型
         self.path = os.path.join(path, 'dbfiles/indices')
-        self.indexFile = os.path.join(self.path, 'indexFile.json')
+        self.indexFile = os.path.join(self.path, 'indexFile.json')  # 旧版本的索引文件，读入后转换为 .idx 文件
+        self.droppedFiles = []  # 被删除的索引，提交时才删除文件
         #  在主键上自动创建的索引不会出现在键值对上
         if not os.path.exists(self.path):
             os.makedirs(self.path)
-            indexFile = open(self.indexFile, 'w')
-            indexFile.close()
-            self.save()
         self.load()
-    
-    def save(self):
-        writeTables = {}
-        for tableName, trees in self.tables.items():
-            writeTables[tableName] = {}
-            for primaryKey, tree in trees.items():
-                writeTables[tableName][primaryKey] = self.recursivelyStoreNode(tree.root)
-        
-        with open(self.indexFile, 'w') as indexFile:
-            json.dump(writeTables, indexFile)
-
-    def recursivelyStoreNode(self, root: Node):
-        if not isinstance(root, Node):  # 到头了
-            return root
-
-        rootDict = {
-            'keys': root.keys,
-            'isLeaf': root.isLeaf()
-        }
-        rootDict['children'] = []
-        for child in root.children:
-            #  **重要语句** 嵌套存字典
-            subDict = self.recursivelyStoreNode(child)
-            rootDict['children'].append(subDict)
-
-        return rootDict
+
+    def getIndexFile(self, tableName, keyName, using='btree'):
+        suffix = 'hidx' if using == 'hash' else 'idx'
+        return os.path.join(self.path, f'{tableName}.{keyName}.{suffix}')
+
+    def getAllIndices(self):  # 所有的B+树和哈希索引
+        for trees in self.tables.values():
+            yield from trees.values()
+        for hashes in self.hashTables.values():
+            yield from hashes.values()
+
+    def save(self):  # 只写回被修改过的索引。返回写了几个索引文件
+        activeFiles = set()
+        for index in self.getAllIndices():
+            activeFiles.add(index.pager.path)
+        for indexFile in self.droppedFiles:
+            if indexFile not in activeFiles and os.path.exists(indexFile):
+                os.remove(indexFile)
+        self.droppedFiles = []
+
+        writeNum = 0
+        for index in self.getAllIndices():
+            if index.pager.save(index):
+                writeNum += 1
+        if os.path.exists(self.indexFile):  # 旧格式已经全部转换了
+            os.remove(self.indexFile)
+        return writeNum
 
     def load(self):
-        with open(self.indexFile, 'r') as indexFile:
-            readTables = json.loads(indexFile.read())
+        for fileName in sorted(os.listdir(self.path)):
+            if fileName.endswith('.idx'):
+                pager = self.Pager(os.path.join(self.path, fileName))
+                self.tables.setdefault(pager.tableName, {})[pager.keyName] = pager.openTree()
+            elif fileName.endswith('.hidx'):
+                pager = self.HashPager(os.path.join(self.path, fileName))
+                self.hashTables.setdefault(pager.tableName, {})[pager.keyName] = pager.openTree()
+        for tableName in self.catalogTables:  # 索引全被删掉的表也要有记录
+            self.tables.setdefault(tableName, {})
+            self.hashTables.setdefault(tableName, {})
+
+        if os.path.exists(self.indexFile):
+            with open(self.indexFile, 'r') as indexFile:
+                content = indexFile.read()
+            readTables = json.loads(content) if content.strip() else {}
             for tableName, trees in readTables.items():
-                self.tables[tableName] = {}
+                self.tables.setdefault(tableName, {})
                 for uniqueKey, tree in trees.items():
-                    loadedTree = BPlusTree()
-                    self.tables[tableName][uniqueKey] = loadedTree
-                    if len(tree['keys']) == 0:  # 空的
-                        loadedTree.root = LeafNode()
-                    elif tree['isLeaf'] is True:  # 根结点是叶子结点
-                        loadedTree.root = LeafNode(
-                            order=IndexMgr.order,
-                            parent=None,
-                            keys=tree['keys'],
-                            children=tree['children']
-                        )
-                    else:  # 非叶子结点
-                        loadedTree.root = Node(
-                            order=IndexMgr.order,
-                            parent=None,
-                            keys=tree['keys'],
-                            children=tree['children']
-                        )
-                        loadedTree.root.children = self.recursivelyLoadChilren(
-                                                            tree['children'],
-                                                            loadedTree.root
-                                                        )
-                    self.loadLeafs(loadedTree)  # 建立链表
-
-    def recursivelyLoadChilren(self, childrenList, parent):  # 递归向下地构造整棵树
-        loadedChildren = []
-        for child in childrenList:
-            if child['isLeaf'] is True:
-                childNode = LeafNode(
-                    order=IndexMgr.order,
-                    parent=parent,
-                    keys=child['keys'],
-                    children=child['children']
-                )
-                loadedChildren.append(childNode)
-            else:
-                childNode = Node(
-                    order=IndexMgr.order,
-                    parent=parent,
-                    keys=child['keys'],
-                    children=child['children']
-                )
-                loadedChildren.append(childNode)
-                childNode.children = self.recursivelyLoadChilren(
-                                        child['children'],
-                                        loadedChildren[-1]
-                                    )
-        return loadedChildren
-
-    def loadLeafs(self, loadedTree: BPlusTree):
-        # 全部load完成后，还要对叶子结点建立链表
-        root = loadedTree.root
-        leftmostLeaf = root.getLeftmostLeaf()
-        rightmostLeaf = root.getRightmostLeaf()
-
-        curLeaf = leftmostLeaf
-        curLeaf.prevLeaf = None
-        while curLeaf != rightmostLeaf:
-            tmpNode = curLeaf
-            nextSibling = None
-            while nextSibling is None:
-                nextSibling = tmpNode.getNextSibling()
-                tmpNode = tmpNode.parent
-            nextLeaf = nextSibling.getLeftmostLeaf()
-            curLeaf.nextLeaf, nextLeaf.prevLeaf, curLeaf = \
-                nextLeaf, curLeaf, nextLeaf
-        curLeaf.nextLeaf = None
-
-    def getUniqueKeysWithIndex(self, tableName):  # API调用，给出在哪些uniqueKey上建立了索引
+                    if uniqueKey in self.tables[tableName]:
+                        continue
+                    items = []  # 按叶子结点从左到右的顺序收集 (key, value)
+                    self.recursivelyCollectItems(tree, items)
+                    order = tree.get('order', IndexMgr.order)
+                    self.tables[tableName][uniqueKey] = self.newTree(tableName, uniqueKey, order, items)
+
+    def recursivelyCollectItems(self, nodeDict, items):
+        if nodeDict['isLeaf'] is True:
+            for key, value in zip(nodeDict['keys'], nodeDict['children']):
+                if isinstance(value, list):  # 旧格式中叶子的value是 [addr]
+                    value = value[0]
+                items.append((key, value))
+        else:
+            for child in nodeDict['children']:
+                self.recursivelyCollectItems(child, items)
+
+    def newTree(self, tableName, keyName, order, items=()):
+        # items是按key排好序的 [(key, addr), ...]。非唯一索引中相同key的地址合并为一个posting
+        keyType = self.getKeyType(tableName, keyName)
+        isUnique = self.checkUniqueKey(tableName, keyName)
+        if keyType == 'd':  # 舍入不改变顺序
+            items = [(roundFloat(key), addr) for key, addr in items]
+        if not isUnique:
+            postings = []
+            for key, addr in items:
+                if postings and postings[-1][0] == key:
+                    postings[-1][1].append(addr)
+                else:
+                    postings.append((key, [addr]))
+            items = [(key, array('q', sorted(addrs))) for key, addrs in postings]
+        pager = self.Pager(self.getIndexFile(tableName, keyName), tableName, keyName, order, keyType, isUnique)
+        return BPlusTree.bulkLoad(items, order=order, keyType=keyType, pager=pager, isUnique=isUnique)
+
+    def newHash(self, tableName, keyName, items=()):  # items是 [(key, addr), ...]，不需要排序
+        keyType = self.getKeyType(tableName, keyName)
+        isUnique = self.checkUniqueKey(tableName, keyName)
+        pager = self.HashPager(self.getIndexFile(tableName, keyName, 'hash'), tableName, keyName,
+                               HashIndex.bucketSize, keyType, isUnique)
+        index = HashIndex(keyType=keyType, pager=pager, isUnique=isUnique)
+        for key, addr in items:
+            index.insert(self.toKey(index, key), addr)
+        return index
+
+    def checkUniqueKey(self, tableName, keyName):  # 主键和声明为unique的字段上建唯一索引
+        table = self.catalogTables[tableName]
+        for column in table.columns:
+            if column.columnName == keyName:
+                return column.isUnique or keyName == table.primaryKey
+        return True
+
+    def getKeyType(self, tableName, keyName):  # int和float的key用array紧凑存储，char仍用list
+        for column in self.catalogTables[tableName].columns:
+            if column.columnName == keyName:
+                return {'int': 'i', 'float': 'd'}.get(column.type)
+        return None
+
+    @staticmethod
+    def toKey(index, value):  # float字段的key舍入成记录文件中存的4字节float。插入、删除、查找都要经过这里
+        if index.keyType == 'd' and isinstance(value, (int, float)):
+            return roundFloat(value)
+        return value
+
+    def getTableIndices(self, tableName):  # 表上所有的 (字段名, B+树或哈希索引)
+        yield from self.tables[tableName].items()
+        yield from self.hashTables[tableName].items()
+
+    def getUniqueKeysWithIndex(self, tableName):  # API调用，给出在哪些uniqueKey上建立了（唯一）索引
         uniqueKeysWithIndex = []
-        trees = self.tables[tableName]
-        for uniqueKey in trees.keys():
-            uniqueKeysWithIndex.append(uniqueKey)
+        for uniqueKey, index in self.getTableIndices(tableName):
+            if index.isUnique and uniqueKey not in uniqueKeysWithIndex:
+                uniqueKeysWithIndex.append(uniqueKey)
         return uniqueKeysWithIndex
 
-    def insertRecord(self, tableName, values, insertPos, uniqueKeyHash):
+    def getKeysWithIndex(self, tableName, using=None):
+        # API调用，给出在哪些字段上建立了索引（包括非唯一索引）。using为 'btree' 或 'hash' 时只看这一种索引
+        if using == 'hash':
+            return list(self.hashTables[tableName].keys())
+        if using == 'btree':
+            return list(self.tables[tableName].keys())
+        return list(self.tables[tableName].keys() | self.hashTables[tableName].keys())
+
+    def checkIndexUsable(self, tableName, where):  # 这个条件能否用索引查找。哈希索引只能用于等值查找
+        if where['lVal'] in self.tables[tableName]:
+            return True
+        return where['lVal'] in self.hashTables[tableName] and where['operator'] in ('=', '==')
+
+    def insertRecord(self, tableName, values, insertPos, columnHash):
         bytes2String(values)  # 先转换
-        trees = self.tables[tableName]
-        for uniqueKey, tree in trees.items():
-            if uniqueKey in uniqueKeyHash.keys():   # 在这个字段上建立过索引
-                uniqueIndex = uniqueKeyHash[uniqueKey]
-                value = values[uniqueIndex]
-                tree.insert(key=value, value=insertPos)
-
-    def deleteRecord(self, tableName, values, uniqueKeyHash):
-        #  删除多条记录，需要API调用多次deleteRecord()
-        trees = self.tables[tableName]
-        for uniqueKey, tree in trees.items():
-            if uniqueKey in uniqueKeyHash.keys():
-                uniqueIndex = uniqueKeyHash[uniqueKey]
-                value = values[uniqueIndex]
-                tree.delete(key=value)
+        for keyName, index in self.getTableIndices(tableName):
+            if keyName in columnHash.keys():   # 在这个字段上建立过索引
+                value = values[columnHash[keyName]]
+                index.insert(key=self.toKey(index, value), value=insertPos)
+
+    def insertRecords(self, tableName, rows, addrs, columnHash):
+        # 批量插入：每个索引的 (key, 地址) 排好序后依次插入，相邻的key落在同一个叶子上，从根往下的路径都在缓存中
+        for values in rows:
+            bytes2String(values)
+        for keyName, index in self.getTableIndices(tableName):
+            if keyName in columnHash.keys():
+                keyIndex = columnHash[keyName]
+                keys = (self.toKey(index, values[keyIndex]) for values in rows)
+                for key, addr in sorted(zip(keys, addrs), key=lambda item: item[0]):
+                    index.insert(key=key, value=addr)
+
+    def insertItems(self, tableName, indexItems):
+        # indexItems: {(字段名, 'btree' 或 'hash'): [(key, addr), ...]}。每个索引按key的顺序依次插入
+        for (keyName, using), items in indexItems.items():
+            index = (self.hashTables if using == 'hash' else self.tables)[tableName][keyName]
+            for key, addr in sorted(((self.toKey(index, key), addr) for key, addr in items), key=lambda item: item[0]):
+                index.insert(key=key, value=addr)
+
+    def deleteRecord(self, tableName, values, addr, columnHash):
+        #  删除多条记录，需要API调用多次deleteRecord()。非唯一索引要按地址删除
+        for keyName, index in self.getTableIndices(tableName):
+            if keyName in columnHash.keys():
+                value = values[columnHash[keyName]]
+                index.delete(key=self.toKey(index, value), value=addr)
 
     def createTable(self, tableName, primaryKey):
-        newTree = BPlusTree(order=IndexMgr.order)
+        newTree = self.newTree(tableName, primaryKey, IndexMgr.order)
         self.tables[tableName] = {}
         self.tables[tableName][primaryKey] = newTree
+        self.hashTables[tableName] = {}
 
     def dropTable(self, tableName):
-        self.tables.pop(tableName)
-
-    def createIndex(self, tableName, uniqueKey, uniqueKeyValuesDict):
-        trees = self.tables[tableName]
-        newTree = BPlusTree(order=IndexMgr.order)
-        trees[uniqueKey] = newTree
-        for uniqueKeyValue, uniqueKeyAddr in uniqueKeyValuesDict.items():
-            newTree.insert(key=uniqueKeyValue, value=uniqueKeyAddr)
-
-    def dropIndex(self, tableName, keyName):
-        self.tables[tableName].pop(keyName)
-
-    def select4UniqueKey(self, tableName, uniqueKeywheres):  # 仅适合uniqueKey！！！
-        # API必须保证只传已经建立了索引的uniqueKey的wheres
-        # 如果没有已经建立索引的uniqueKey的wheres，则该函数不应该被调用
-        # 返回集合。
-        totalAddrs = set()
-        for where in uniqueKeywheres:
-            attributeName = where['lVal']
-            rVal = where['rVal']
-            operator = where['operator']
-            partialAddrs = self.findLeafs(tableName, attributeName, operator, rVal)
-
-            if totalAddrs == set():
-                totalAddrs = partialAddrs
+        indices = list(self.tables.pop(tableName).values()) + list(self.hashTables.pop(tableName).values())
+        for index in indices:
+            index.pager.close()
+            self.droppedFiles.append(index.pager.path)
+
+    def createIndex(self, tableName, uniqueKey, uniqueKeyValuesAndAddrs, order=None, using='btree'):
+        # uniqueKeyValuesAndAddrs: [(key, addr), ...]。B+树排序后自底向上批量构建，不逐个插入
+        if using == 'hash':
+            self.hashTables[tableName][uniqueKey] = self.newHash(tableName, uniqueKey, uniqueKeyValuesAndAddrs)
+            return
+        if order is None:
+            order = IndexMgr.order
+        items = sorted(uniqueKeyValuesAndAddrs, key=lambda item: item[0])
+        self.tables[tableName][uniqueKey] = self.newTree(tableName, uniqueKey, order, items)
+
+    def rebuildIndex(self, tableName, keyName, items, using='btree'):
+        # 用 [(key, addr), ...] 自底向上重新构建一个已有的索引，阶数不变。提交时新的索引覆盖原来的文件
+        indices = self.hashTables if using == 'hash' else self.tables
+        index = indices[tableName][keyName]
+        index.pager.close()
+        self.createIndex(tableName, keyName, items, None if using == 'hash' else index.order, using)
+
+    def dropIndex(self, tableName, keyName, using='btree'):
+        if using == 'hash':
+            index = self.hashTables[tableName].pop(keyName)
+        else:
+            index = self.tables[tableName].pop(keyName)
+        index.pager.close()
+        self.droppedFiles.append(index.pager.path)
+
+    def select4UniqueKey(self, tableName, uniqueKeywheres):  # 唯一索引和非唯一索引都适用
+        # API必须保证只传已经建立了索引的字段的wheres
+        # 如果没有已经建立索引的字段的wheres，则该函数不应该被调用
+        # 返回地址的迭代器。只有一个条件时按key的顺序边查边返回，不先放进集合
+        # 有多个条件时，优化器已经把选择率最小的条件放在最前面：其余条件查到的地址取交集，再用它筛选第一个条件查到的地址
+        if not uniqueKeywheres:
+            return iter(())
+        otherAddrs = None
+        for where in uniqueKeywheres[1 : ]:
+            partialAddrs = self.findLeafs(tableName, where['lVal'], where['operator'], where['rVal'])
+            if otherAddrs is None:
+                otherAddrs = partialAddrs
             else:
-                totalAddrs = totalAddrs & partialAddrs  # 交集
-
-        return totalAddrs
-
-    def findLeafs(self, tableName, uniqueKey, operator, rVal):  # 条件查找。返回所有地址的集合
-        tree = self.tables[tableName][uniqueKey]
-        root = tree.root
-        addrs = set()
-
-        if operator == '<>' or operator == '!=':
-            leaf = root.getLeftmostLeaf()
-            flag, exceptedLeaf, index = tree.find(rVal)  # 被排除的Leaf
-            if flag is False:  # 全要了
-                addrs = tree.getAllData()
-            else:  # 要有一个排除
-                while leaf:
-                    for i, addr in enumerate(leaf.children):
-                        if leaf == exceptedLeaf and i == index:  # 要排除一个
-                            continue
-                        addrs.add(addr[0])
-                    leaf = leaf.nextLeaf
+                otherAddrs &= partialAddrs  # 交集
+            if not otherAddrs:  # 已经没有满足条件的记录了，剩下的索引不用查
+                return iter(())
+
+        where = uniqueKeywheres[0]
+        addrs = self.iterLeafs(tableName, where['lVal'], where['operator'], where['rVal'])
+        if otherAddrs is None:
+            return addrs
+        return (addr for addr in addrs if addr in otherAddrs)
+
+    def findLeafs(self, tableName, keyName, operator, rVal):  # 条件查找。返回所有地址的集合
+        return set(self.iterLeafs(tableName, keyName, operator, rVal))
+
+    def iterLeafs(self, tableName, keyName, operator, rVal):
+        # 条件查找。返回地址的迭代器：B+树上按key的顺序沿叶子链表返回，需要多少取多少
+        # 唯一索引中叶子的每个value是一个地址，非唯一索引中是一个posting，由 tree.iterRange 展开
+        # 等值查找优先用哈希索引
+        if operator in ('=', '==') and keyName in self.hashTables[tableName]:
+            index = self.hashTables[tableName][keyName]
+            return iter(index.findAddrs(self.toKey(index, rVal)))
+
+        tree = self.tables[tableName][keyName]
+        rVal = self.toKey(tree, rVal)
+        if operator == '<>' or operator == '!=':  # 比rVal小的和比rVal大的
+            return chain(
+                tree.iterRange(high=rVal, includeHigh=False),
+                tree.iterRange(low=rVal, includeLow=False)
+            )
         elif operator == '=' or operator == '==':
-            leaf = root.getLeftmostLeaf()
-            flag, includedLeaf, index = tree.find(rVal)  # 只要这个Leaf
-            if flag is False:  # 全不要
-                addrs = set()
-            else:  # 只要一个
-                addrs.add(includedLeaf.children[index][0])
-        elif operator == '<=':
-            leaf = root.getLeftmostLeaf()
-            flag, includedLeaf, index = tree.find(rVal)
-            if flag is False:  # 找不到
-                if index == BPlusTree.INF:  # 全都要
-                    addrs = tree.getAllData()
-                elif index == -BPlusTree.INF:  # 全不要
-                    addrs = set()
-                else:
-                    flag = False
-                    while leaf and not flag:
-                        for i, addr in enumerate(leaf.children):
-                            if leaf == includedLeaf and i + 1 == index:  # 注意是i + 1
-                                flag = True  # 结束
-                            addrs.add(addr[0])
-                        leaf = leaf.nextLeaf
-            else:  # 找得到
-                flag = False
-                while leaf and not flag:
-                    for i, addr in enumerate(leaf.children):
-                        if leaf == includedLeaf and i == index:  # 注意是i
-                            flag = True  # 结束
-                        addrs.add(addr[0])
-                    leaf = leaf.nextLeaf
-        elif operator == '>=':
-            leaf = root.getRightmostLeaf()
-            flag, includedLeaf, index = tree.find(rVal)
-            if flag is False:  # 找不到
-                if index == BPlusTree.INF: 
-                    addrs = set()
-                elif index == -BPlusTree.INF:
-                    addrs = tree.getAllData()
-                else:
-                    flag = False
-                    while leaf and not flag:
-                        for i, addr in enumerate(leaf.children):  
-                            if leaf == includedLeaf:  
-                                flag = True 
-                                if i < index:
-                                    continue
-                            addrs.add(addr[0])
-                        leaf = leaf.prevLeaf
-            else:  # 找得到
-                flag = False
-                while leaf and not flag:
-                    for i, addr in enumerate(leaf.children):  
-                        if leaf == includedLeaf:  
-                            flag = True 
-                            if i < index:
-                                continue
-                        addrs.add(addr[0])
-                    leaf = leaf.prevLeaf
-        elif operator == '<':
-            leaf = root.getLeftmostLeaf()
-            flag, includedLeaf, index = tree.find(rVal)
-            if flag is False:  # 找不到
-                if index == BPlusTree.INF:  # 全都要
-                    addrs = tree.getAllData()
-                elif index == -BPlusTree.INF:  # 全不要
-                    addrs = set()
-                else:
-                    flag = False
-                    while leaf and not flag:
-                        for i, addr in enumerate(leaf.children):
-                            if leaf == includedLeaf and i + 1 == index:  # 注意是i + 1
-                                flag = True  # 结束
-                            addrs.add(addr[0])
-                        leaf = leaf.nextLeaf
-            else:  # 找得到
-                flag = False
-                while leaf and not flag:
-                    for i, addr in enumerate(leaf.children):
-                        if leaf == includedLeaf and i == index:  # 注意要及时结束
-                            flag = True  # 结束
-                            break
-                        addrs.add(addr[0])
-                    leaf = leaf.nextLeaf
-        elif operator == '>':
-            leaf = root.getRightmostLeaf()
-            flag, includedLeaf, index = tree.find(rVal)
-            if flag is False:  # 找不到
-                if index == BPlusTree.INF: 
-                    addrs = set()
-                elif index == -BPlusTree.INF:
-                    addrs = tree.getAllData()
-                else:
-                    flag = False
-                    while leaf and not flag:
-                        for i, addr in enumerate(leaf.children):  
-                            if leaf == includedLeaf:  
-                                flag = True 
-                                if i < index:
-                                    continue
-                            addrs.add(addr[0])
-                        leaf = leaf.prevLeaf
-            else:  # 找得到
-                flag = False
-                while leaf and not flag:
-                    for i, addr in enumerate(leaf.children):  
-                        if leaf == includedLeaf:  
-                            flag = True 
-                            if i < index + 1:
-                                continue
-                        addrs.add(addr[0])
-                    leaf = leaf.prevLeaf
+            return tree.iterRange(low=rVal, high=rVal)
+        elif operator == '<=' or operator == '<':
+            return tree.iterRange(high=rVal, includeHigh=operator == '<=')
+        elif operator == '>=' or operator == '>':
+            return tree.iterRange(low=rVal, includeLow=operator == '>=')
         else:
-            raise IndexMgrException('where 子句中出现了不支持的运算符！')       
-
-        return addrs
+            raise IndexMgrException('where 子句中出现了不支持的运算符！')
+
+    def iterOrdered(self, tableName, keyName, wheres, reverse=False):
+        # ORDER BY 用：沿keyName上的B+树叶子链表按key的顺序（reverse时从大到小）返回地址
+        # wheres是keyName上的范围条件（=、<、<=、>、>=），合并成一个区间，决定从哪个叶子开始、走到哪里停下
+        tree = self.tables[tableName][keyName]
+        low = high = None
+        includeLow = includeHigh = True
+        for where in wheres:
+            operator, rVal = where['operator'], self.toKey(tree, where['rVal'])
+            if operator in ('=', '==', '>=', '>') and (low is None or rVal > low or (rVal == low and operator == '>')):
+                low, includeLow = rVal, operator != '>'
+            if operator in ('=', '==', '<=', '<') and (high is None or rVal < high or (rVal == high and operator == '<')):
+                high, includeHigh = rVal, operator != '<'
+        return tree.iterRange(low, high, includeLow, includeHigh, reverse)
+
+    def getExtremeKey(self, tableName, keyName, isMax=False):
+        # min() / max() 用：B+树最左边叶子的第一个key是最小值，最右边叶子的最后一个key是最大值，只读一条路径上的结点
+        # 空表返回None
+        root = self.tables[tableName][keyName].root
+        if root.isEmpty():
+            return None
+        if isMax:
+            return root.getRightmostLeaf().keys[-1]
+        return root.getLeftmostLeaf().keys[0]
 
     def checkUnique(self, tableName, insertValues, uniqueKeyWithIndexHash):
-        trees = self.tables[tableName]
-        for uniqueKey, tree in trees.items():
-            uniqueIndex = uniqueKeyWithIndexHash[uniqueKey]
-            value = insertValues[uniqueIndex]
-            flag, _, __ = tree.find(value)
-            if flag is True:  # 找到了
+        for uniqueKey, uniqueIndex in uniqueKeyWithIndexHash.items():
+            if self.checkExistKey(tableName, uniqueKey, insertValues[uniqueIndex]):  # 找到了
                 raise IndexMgrException(f'记录插入失败，原因它违反了表中属性 {uniqueKey} 定义的唯一性')
 
+    def checkUniqueRecords(self, tableName, rows, uniqueKeyWithIndexHash):
+        # 批量插入：先检查这一批记录之间是否重复，再按key的顺序在索引中逐个查找
+        for uniqueKey, uniqueIndex in uniqueKeyWithIndexHash.items():
+            values = sorted(values[uniqueIndex] for values in rows)
+            if self.getKeyType(tableName, uniqueKey) == 'd':  # 舍入后相等的两个值存进记录文件后也相等
+                values = [roundFloat(value) for value in values]
+            for i, value in enumerate(values):
+                if (i > 0 and value == values[i - 1]) or self.checkExistKey(tableName, uniqueKey, value):
+                    raise IndexMgrException(f'记录插入失败，原因它违反了表中属性 {uniqueKey} 定义的唯一性')
+
+    def checkExistKey(self, tableName, keyName, value):  # 索引中是否已有这个key
+        if keyName in self.hashTables[tableName]:  # 有哈希索引时不用走B+树
+            index = self.hashTables[tableName][keyName]
+            return index.find(self.toKey(index, value)) is not None
+        tree = self.tables[tableName][keyName]
+        flag, _, __ = tree.find(self.toKey(tree, value))
+        return flag
+
 if __name__ == '__main__':
     tableName = 'test'
     primaryKey = 'id'
     primaryKeyPos = 0
-    indexMgr = IndexMgr(os.getcwd())
+    indexMgr = IndexMgr(os.getcwd(), {})
     indexMgr.dropTable(tableName)
     indexMgr.save()
     exit(0)
@@ -5,7 +5,7 @@ from cmd import Cmd
 
 from api import Api
 
-from exception import BufferException, QueryException, SqlSyntaxError
+from exception import BufferException, IndexMgrException, QueryException, SqlSyntaxError
 
 # Disable print()
 def blockPrint():
@@ -139,7 +139,24 @@ class SqlParser:
         if ',' in attributeName:
             raise SqlSyntaxError('抱歉，本程序不支持在单个 create index 语句中为多属性创建索引')
 
-        return indexName, tableName, attributeName
+        order = None  # 可选的 with (order = n)，指定 B+ 树的阶数
+        using = 'btree'  # 可选的 using hash / using btree，指定索引的类型
+        options = sql[findRBracket + 1 :].strip()
+        matchUsing = re.match(r'^using (hash|btree)\b ?', options)
+        if matchUsing is not None:
+            using = matchUsing.group(1)
+            options = options[matchUsing.end() :].strip()
+        if options != '':
+            matchOrder = re.match(r'^with ?\( ?order ?= ?([0-9]+) ?\)$', options)
+            if matchOrder is None or using == 'hash':
+                raise SqlSyntaxError(f'create index 语句中的 {options} 不合法！')
+            order = int(matchOrder.group(1))
+            if order < 3:
+                raise SqlSyntaxError('B+ 树的阶数至少为 3！')
+            if order > 65535:  # 结点的key数在索引文件中存为2字节无符号整数
+                raise SqlSyntaxError('B+ 树的阶数最多为 65535！')
+
+        return indexName, tableName, attributeName, order, using
 
     def drop(sql):
         sql = sql.strip(';').strip()
@@ -170,15 +187,47 @@ class SqlParser:
             raise SqlSyntaxError('select 语句中缺失 from！')
         attributeNames = sql[:findFrom].strip().split(',')  # 定位属性名
         attributeNames = list(map(str.strip, attributeNames))
+
+        limit, offset = None, 0
+        match = re.search(r' limit (\d+)(?: offset (\d+))?$', sql)  # limit n [offset m] 只能写在最后
+        if match is not None:
+            limit = int(match.group(1))
+            offset = int(match.group(2) or 0)
+            sql = sql[: match.start()]
+        elif re.search(r" (limit|offset) [^' ]+$", sql):
+            raise SqlSyntaxError('抱歉，limit 子句的格式是 limit n [offset m]，n 和 m 必须是非负整数')
+
+        orderBy = None
+        match = re.search(r' order by (\w+ ?\( ?(?:\*|\w+) ?\)|\w+(?:\.\w+)?)(?: (asc|desc))?$', sql)  # order by 字段名或聚合函数 [asc|desc]，写在limit之前
+        if match is not None:
+            orderBy = (match.group(1), match.group(2) or 'asc')
+            sql = sql[: match.start()]
+        elif re.search(r" order by\b[^']*$", sql):
+            raise SqlSyntaxError('抱歉，order by 子句的格式是 order by 字段名 [asc|desc]')
+
+        groupBy = None
+        match = re.search(r' group by (\w+(?: ?, ?\w+)*)$', sql)  # group by 字段名, ...，写在order by之前
+        if match is not None:
+            groupBy = [columnName.strip() for columnName in match.group(1).split(',')]
+            sql = sql[: match.start()]
+        elif re.search(r" group by\b[^']*$", sql):
+            raise SqlSyntaxError('抱歉，group by 子句的格式是 group by 字段名, 字段名, ...')
         
         findWhere = sql.find('where')
+        tableName = sql[findFrom + 4 : findWhere if findWhere != -1 else len(sql)].strip()
+        if tableName == '':
+            raise SqlSyntaxError('select 语句中缺失表名！')
+        join = None
+        if re.search(r'\bjoin\b', tableName):  # 表名 [inner] join 表名 on 字段 = 字段，字段可以写成 表名.字段名
+            match = re.fullmatch(r'(\w+) (?:inner )?join (\w+) on ([\w.]+) ?==? ?([\w.]+)', tableName)
+            if match is None:
+                raise SqlSyntaxError('抱歉，join 的格式是 表名 join 表名 on 表名.字段名 = 表名.字段名')
+            tableName = match.group(1)
+            join = (match.group(2), match.group(3), match.group(4))
+
         if findWhere == -1:  # 没有where
-            tableName = sql[findFrom + 4 : ].strip()
-            if tableName == '':
-                raise SqlSyntaxError('select 语句中缺失表名！')
-            return tableName, attributeNames, None
+            return tableName, attributeNames, None, limit, offset, orderBy, groupBy, join
         else:
-            tableName = sql[findFrom + 4 : findWhere].strip()
             conditions = sql[findWhere + 5 :].strip().split('and')
             conditions = list(map(str.strip, conditions))
             wheres = []
@@ -202,7 +251,7 @@ class SqlParser:
                     'lVal': lVal,
                     'rVal': rVal
                 })
-            return tableName, attributeNames, wheres
+            return tableName, attributeNames, wheres, limit, offset, orderBy, groupBy, join
     
     def insert(sql):
         sql = sql.strip(';').strip()
@@ -218,13 +267,18 @@ class SqlParser:
         
         tableName = sql[findInto + 4 : findValues].strip()
 
-        findLBracket = sql.find('(')
-        findRBracket = sql.find(')')
-        values = sql[findLBracket + 1 : findRBracket].split(',')
-        values = list(map(str.strip, values))
-        values = list(map(SqlParser.strAutoDataType, values))
+        # values 后面可以有多组括号，用逗号隔开：values (...), (...), ...
+        valuesSql = sql[findValues + 6 : ].strip()
+        rows = []
+        for row in re.findall(r'\(([^()]*)\)', valuesSql):
+            values = row.split(',')
+            values = list(map(str.strip, values))
+            values = list(map(SqlParser.strAutoDataType, values))
+            rows.append(values)
+        if rows == [] or re.sub(r'\([^()]*\)', '', valuesSql).replace(',', '').strip() != '':
+            raise SqlSyntaxError('insert 语句中 values 的格式不合法！')
 
-        return tableName, values
+        return tableName, rows
 
     def delete(sql):
         sql = sql.strip(';').strip()
@@ -280,6 +334,24 @@ class SqlParser:
             return 'table', tableName
         return 'tables', None
 
+    def load(sql):  # load data from 'file.csv' into 表名
+        sql = sql.strip(';').strip()
+        sql = re.sub(' +', ' ', sql)
+
+        match = re.match(r"^data from '([^']+)' into (\w+)$", sql)
+        if match is None:
+            raise SqlSyntaxError("抱歉，load 语句的格式是 load data from '文件名' into 表名")
+        return match.group(2), match.group(1)  # 表名, 文件名
+
+    def copy(sql):  # copy 表名 to 'file.csv'
+        sql = sql.strip(';').strip()
+        sql = re.sub(' +', ' ', sql)
+
+        match = re.match(r"^(\w+) to '([^']+)'$", sql)
+        if match is None:
+            raise SqlSyntaxError("抱歉，copy 语句的格式是 copy 表名 to '文件名'")
+        return match.group(1), match.group(2)  # 表名, 文件名
+
 
 class Interpreter(Cmd):  # 交互式shell
     prompt = 'MiniSQL>> '
@@ -296,7 +368,7 @@ class Interpreter(Cmd):  # 交互式shell
             if returnVal[0] == 'table':
                 self.api.createTable(returnVal[1][0], returnVal[1][1], returnVal[1][2])
             elif returnVal[0] == 'index':
-                self.api.createIndex(returnVal[1][0], returnVal[1][1], returnVal[1][2])
+                self.api.createIndex(*returnVal[1])
         except SqlSyntaxError as syntaxErr:
             print(syntaxErr)
 
@@ -318,25 +390,41 @@ class Interpreter(Cmd):  # 交互式shell
         try:
             returnVal = SqlParser.select(arg)
             if returnVal[2] == None:
-                self.api.select(returnVal[0], returnVal[1], dict())
+                self.api.select(returnVal[0], returnVal[1], dict(), *returnVal[3:])
             else:
-                self.api.select(returnVal[0], returnVal[1], returnVal[2])
+                self.api.select(returnVal[0], returnVal[1], returnVal[2], *returnVal[3:])
         except SqlSyntaxError as syntaxErr:
             print(syntaxErr)
+        except QueryException as queryExcepetion:
+            print(queryExcepetion)
         '''''
         select * from student;
         select * from student where sno = '88888888';
         select * from student where sage > 20 and sgender = 'F';
+        select * from student where sage > 20 limit 10 offset 20;
+        select * from student where sage > 20 order by sno desc limit 10;
+        select sgender, count(*), avg(sage) from student where sage > 20 group by sgender order by count(*) desc;
+        select student.sname, sc.grade from student join sc on student.sno = sc.sno where sc.grade > 90;
         '''
 
     def do_insert(self, arg):
         try:
             returnVal = SqlParser.insert(arg)
-            self.api.insert(returnVal[0], returnVal[1])
+            if len(returnVal[1]) == 1:
+                self.api.insert(returnVal[0], returnVal[1][0])
+            else:  # 多行一起插入
+                self.api.insertMany(returnVal[0], returnVal[1])
         except SqlSyntaxError as syntaxErr:
             print(syntaxErr)
+        except QueryException as queryExcepetion:  # 例如违反了唯一性，整批都没有插入
+            print(queryExcepetion)
+        except BufferException as bufferException:
+            print(bufferException)
+        except IndexMgrException as indexMgrException:
+            print(indexMgrException)
         '''''
         insert into student values ('12345678', 'wy', 22, 'M');
+        insert into student values ('12345678', 'wy', 22, 'M'), ('12345679', 'zs', 21, 'F');
         '''
 
     def do_delete(self, arg):
@@ -348,6 +436,8 @@ class Interpreter(Cmd):  # 交互式shell
                 self.api.delete(returnVal[0], returnVal[1])
         except SqlSyntaxError as syntaxErr:
             print(syntaxErr)
+        except QueryException as queryExcepetion:  # 例如表不存在，或者条件中的值和字段的类型不符
+            print(queryExcepetion)
         '''''
         delete from student;
         delete from student where sno = '88888888';
@@ -369,6 +459,32 @@ class Interpreter(Cmd):  # 交互式shell
         show table student
         '''
 
+    def do_load(self, arg):
+        try:
+            returnVal = SqlParser.load(arg)
+            self.api.loadData(returnVal[0], returnVal[1])
+        except SqlSyntaxError as syntaxErr:
+            print(syntaxErr)
+        except QueryException as queryExcepetion:
+            print(queryExcepetion)
+        except FileNotFoundError as fileNotFoundError:
+            print(fileNotFoundError)
+        '''
+        load data from 'student.csv' into student;
+        '''
+
+    def do_copy(self, arg):
+        try:
+            returnVal = SqlParser.copy(arg)
+            self.api.copyTable(returnVal[0], returnVal[1])
+        except SqlSyntaxError as syntaxErr:
+            print(syntaxErr)
+        except QueryException as queryExcepetion:
+            print(queryExcepetion)
+        '''
+        copy student to 'student.csv';
+        '''
+
     def do_execfile(self, arg): 
         # 本execfile每行读入一个sql语句，即不允许单个sql语句占据多行
         
@@ -391,7 +507,9 @@ class Interpreter(Cmd):  # 交互式shell
                         'select': self.do_select,
                         'insert': self.do_insert,
                         'delete': self.do_delete,
-                        'show': self.do_show
+                        'show': self.do_show,
+                        'load': self.do_load,
+                        'copy': self.do_copy
                     }
                     sql = line[seperator : ]
                     switch[sqlCommand](sql)
@@ -405,7 +523,7 @@ class Interpreter(Cmd):  # 交互式shell
 
     def do_quit(self, arg):
         try:
-            self.api.save()
+            self.api.close()
             self.stdout.write('所有对数据库的更改已保存。\n')
             self.stdout.write('Bye')
             return True
@@ -417,8 +535,8 @@ class Interpreter(Cmd):  # 交互式shell
 
     def do_commit(self, arg):
         try:
-            self.api.save()
-            self.stdout.write('所有对数据库的更改已保存。\n')
+            self.api.commit()
+            self.stdout.write('所有对数据库的更改已提交。\n')
         except SqlSyntaxError as syntaxErr:
             print(syntaxErr)
 
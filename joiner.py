@@ -0,0 +1,100 @@
+import pickle
+import tempfile
+from itertools import chain, islice
+
+'''
+两个表的等值连接：select ... from a join b on a.x = b.y
+每个算子都是生成器，左右两侧的记录由各自的扫描（全表扫描或索引查找）边读边给出，连接的结果也是查到一行就返回一行
+输出的每一行是左表的记录接上右表的记录
+1. 哈希连接：用内表（估计行数较少的一侧）的全部记录按连接字段建哈希表，外表的记录边读边探测，有LIMIT时外表读够就停
+   内表超过 buildSize 行时改用 grace hash join：两侧都按连接字段的哈希值分成 partitionNum 个分区写入临时文件，
+   再逐个分区连接。一个分区仍然放不下时对它再分区，最多分 maxDepth 层（例如连接字段上大量重复的值，再分也分不开）
+2. 索引嵌套循环连接：内表的连接字段上有索引时，外表的记录每攒一批，就一起在内表的索引中查找，
+   查到的地址整批按地址顺序读（每页只读一次）。批的大小从 firstBatchSize 加倍到 maxBatchSize，有LIMIT时第一批就能返回结果
+'''
+
+
+class Joiner:
+    buildSize = 100000  # 构建哈希表时内存中最多放几行，超过时分区写入临时文件
+    partitionNum = 16  # grace hash join 每层分几个区
+    maxDepth = 3  # 最多分几层
+    blockSize = 1000  # 写临时文件时每次pickle几行
+    firstBatchSize = 64  # 索引嵌套循环连接：第一批外表记录有几行，之后每批加倍
+    maxBatchSize = 4096
+
+    def __init__(self, leftKeyIndex, rightKeyIndex):
+        self.keyIndices = (leftKeyIndex, rightKeyIndex)  # 连接字段在左表、右表记录中的下标
+
+    def hashJoin(self, leftRecords, rightRecords, inner):
+        # inner：0 表示用左表构建哈希表，1 表示用右表
+        records = (leftRecords, rightRecords)
+        return self.hashJoinPartition(records[inner], records[1 - inner], inner, 0)
+
+    def hashJoinPartition(self, buildRecords, probeRecords, inner, depth):
+        buildKey = self.keyIndices[inner]
+        probeKey = self.keyIndices[1 - inner]
+        buildRecords = iter(buildRecords)
+        table = {}
+        buildNum = 0
+        for record in buildRecords:
+            table.setdefault(record[buildKey], []).append(record)
+            buildNum += 1
+            if buildNum > Joiner.buildSize and depth < Joiner.maxDepth:
+                break
+        else:  # 内表放得下，外表边读边探测
+            for record in probeRecords:
+                matches = table.get(record[probeKey])
+                if matches is not None:
+                    for match in matches:
+                        yield match + record if inner == 0 else record + match
+            return
+
+        buildFiles = probeFiles = []
+        try:
+            buildFiles = self.partition(chain(chain.from_iterable(table.values()), buildRecords), buildKey, depth)
+            table = None
+            probeFiles = self.partition(probeRecords, probeKey, depth)
+            for buildFile, probeFile in zip(buildFiles, probeFiles):
+                yield from self.hashJoinPartition(self.readPartition(buildFile), self.readPartition(probeFile), inner, depth + 1)
+        finally:
+            for file in buildFiles + probeFiles:
+                file.close()  # 临时文件关闭后自动删除
+
+    def partition(self, records, keyIndex, depth):
+        # 按连接字段的哈希值把记录分到 partitionNum 个临时文件中。每层的哈希函数不同，上一层分到一起的记录这一层能分开
+        files = [tempfile.TemporaryFile() for _ in range(Joiner.partitionNum)]
+        blocks = [[] for _ in range(Joiner.partitionNum)]
+        for record in records:
+            i = hash((depth, record[keyIndex])) % Joiner.partitionNum
+            blocks[i].append(record)
+            if len(blocks[i]) >= Joiner.blockSize:
+                pickle.dump(blocks[i], files[i], pickle.HIGHEST_PROTOCOL)
+                blocks[i] = []
+        for file, block in zip(files, blocks):
+            if block:
+                pickle.dump(block, file, pickle.HIGHEST_PROTOCOL)
+            file.seek(0)
+        return files
+
+    def readPartition(self, file):  # 逐块读回一个分区
+        while True:
+            try:
+                block = pickle.load(file)
+            except EOFError:
+                return
+            yield from block
+
+    def indexNestedLoopJoin(self, outerRecords, lookup, inner):
+        # inner：内表是左表（0）还是右表（1）
+        # lookup(keys)：在内表的索引中查找一批key，返回与keys一一对应的内表记录list
+        outerKey = self.keyIndices[1 - inner]
+        outerRecords = iter(outerRecords)
+        batchSize = Joiner.firstBatchSize
+        while True:
+            batch = list(islice(outerRecords, batchSize))
+            if not batch:
+                return
+            for record, matches in zip(batch, lookup([record[outerKey] for record in batch])):
+                for match in matches:
+                    yield match + record if inner == 0 else record + match
+            batchSize = min(batchSize * 2, Joiner.maxBatchSize)
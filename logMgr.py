@@ -0,0 +1,151 @@
+import os
+import time
+import zlib
+import struct
+import threading
+
+'''
+管理重做日志（redo log）。通过 Api 执行的插入、删除都先追加到日志中，
+日志按批写入文件并 fsync（group commit），崩溃后启动时重放日志即可恢复
+'''
+
+
+class LogMgr:
+    groupCommitWindow = 0.01  # 组提交的时间窗口（秒）。窗口内追加的日志一起 fsync；为0时每条日志都立即 fsync
+    bufferSize = 1024 * 1024  # 内存中攒了这么多Byte的日志时，不等窗口结束就写入文件
+    checkpointSize = 8 * 1024 * 1024  # 日志超过这么多Byte时做检查点，限制启动时要重放的日志量。为0时不按大小触发
+    checkpointInterval = 300  # 距离上次检查点超过这么多秒时做检查点。为0时不按时间触发
+
+    headerStruct = struct.Struct('<II')  # 日志记录的长度, crc32校验和。用来发现写了一半的日志
+    recordStruct = struct.Struct('<QcIIH')  # lsn, 操作, 记录地址, 操作后的insertPos, 表名长度
+
+    '''
+        每条日志的格式：header + lsn, 操作, 地址, insertPos, 表名长度 + 表名 + record
+        插入：b'I'，record是插入的二进制记录，insertPos是插入后空洞链表的表头
+        删除：b'D'，record是删除前的二进制记录（重放时用来删除索引），insertPos是删除前空洞链表的表头，也就是删掉后这个空洞指向的位置
+        检查点：b'C'，清空日志后写在开头，lsn是检查点的lsn，之前的修改都已经写入数据文件
+    '''
+
+    def __init__(self, path, groupCommitWindow=None, checkpointSize=None, checkpointInterval=None):
+        self.path = os.path.join(path, 'dbfiles/logs')
+        self.logFile = os.path.join(self.path, 'redo.log')
+        if not os.path.exists(self.path):
+            os.makedirs(self.path)
+        if groupCommitWindow is None:
+            groupCommitWindow = LogMgr.groupCommitWindow
+        self.groupCommitWindow = groupCommitWindow
+        self.checkpointSize = LogMgr.checkpointSize if checkpointSize is None else checkpointSize
+        self.checkpointInterval = LogMgr.checkpointInterval if checkpointInterval is None else checkpointInterval
+
+        self.file = open(self.logFile, 'ab+')
+        self.lsn = 0  # 最后一条日志的编号
+        self.checkpointLsn = 0  # 最近一次检查点的lsn
+        self.lastCheckpointTime = time.time()
+        self.logSize = os.path.getsize(self.logFile)  # 日志文件的大小（含还没写入文件的）
+        self.validSize = 0  # 日志文件中完整的日志一共多少Byte
+        self.recordNum = 0  # 上次检查点之后追加了几条日志
+        self.pending = bytearray()  # 还没有写入文件的日志
+        self.lock = threading.RLock()
+        self.hasPending = threading.Event()
+        self.isClosed = False
+        self.flusher = None
+        if self.groupCommitWindow > 0:  # 后台线程每个窗口 fsync 一次
+            self.flusher = threading.Thread(target=self.flushLoop, daemon=True)
+            self.flusher.start()
+
+    def flushLoop(self):
+        while not self.isClosed:
+            self.hasPending.wait()
+            time.sleep(self.groupCommitWindow)  # 等窗口内的其他日志一起写
+            self.flush()
+
+    def append(self, op, tableName, addr, insertPos, record):
+        self.appendMany(op, tableName, [(addr, insertPos, record)])
+
+    def appendMany(self, op, tableName, entries):  # entries: [(地址, insertPos, record), ...]。一批日志只加一次锁
+        tableName = tableName.encode('utf-8')
+        with self.lock:
+            for addr, insertPos, record in entries:
+                self.lsn += 1
+                payload = LogMgr.recordStruct.pack(self.lsn, op, addr, insertPos, len(tableName)) + tableName + record
+                self.pending += LogMgr.headerStruct.pack(len(payload), zlib.crc32(payload))
+                self.pending += payload
+                self.logSize += LogMgr.headerStruct.size + len(payload)
+                self.recordNum += 1
+                if len(self.pending) >= LogMgr.bufferSize:
+                    self.flush()
+            if self.groupCommitWindow <= 0:
+                self.flush()
+            elif self.pending:
+                self.hasPending.set()
+
+    def logInsert(self, tableName, addr, insertPos, record):
+        self.append(b'I', tableName, addr, insertPos, record)
+
+    def logInserts(self, tableName, entries):  # 批量插入的日志
+        self.appendMany(b'I', tableName, entries)
+
+    def logDelete(self, tableName, addr, nextPos, record):
+        self.append(b'D', tableName, addr, nextPos, record)
+
+    def needCheckpoint(self):
+        if self.recordNum == 0:
+            return False
+        if self.checkpointSize > 0 and self.logSize >= self.checkpointSize:
+            return True
+        return self.checkpointInterval > 0 and time.time() - self.lastCheckpointTime >= self.checkpointInterval
+
+    def flush(self):  # 把攒下的日志写入文件并 fsync。返回写了几个Byte
+        with self.lock:
+            self.hasPending.clear()
+            writeNum = len(self.pending)
+            if writeNum > 0:
+                self.file.write(self.pending)
+                self.file.flush()
+                os.fsync(self.file.fileno())
+                self.pending.clear()
+            return writeNum
+
+    def readRecords(self):
+        # 按顺序返回日志中的 (lsn, 操作, 表名, 地址, insertPos, record)。遇到写了一半的日志就停止
+        with self.lock:
+            self.file.seek(0)
+            data = self.file.read()
+        offset = 0
+        while offset + LogMgr.headerStruct.size <= len(data):
+            length, checksum = LogMgr.headerStruct.unpack_from(data, offset)
+            start = offset + LogMgr.headerStruct.size
+            payload = data[start : start + length]
+            if len(payload) < length or zlib.crc32(payload) != checksum:
+                break
+            lsn, op, addr, insertPos, tableNameLen = LogMgr.recordStruct.unpack_from(payload)
+            tableStart = LogMgr.recordStruct.size
+            tableName = payload[tableStart : tableStart + tableNameLen].decode('utf-8')
+            self.lsn = max(self.lsn, lsn)
+            offset = start + length
+            self.validSize = offset
+            if op == b'C':
+                self.checkpointLsn = lsn
+            elif lsn > self.checkpointLsn:  # 检查点之前的修改已经在数据文件中了
+                yield lsn, op, tableName, addr, insertPos, payload[tableStart + tableNameLen : ]
+
+    def truncate(self):  # 日志中的修改都已经写入数据文件，清空日志，只留下一条检查点日志
+        with self.lock:
+            self.flush()
+            self.file.truncate(0)
+            self.checkpointLsn = self.lsn
+            payload = LogMgr.recordStruct.pack(self.lsn, b'C', 0, 0, 0)
+            self.file.write(LogMgr.headerStruct.pack(len(payload), zlib.crc32(payload)) + payload)
+            self.file.flush()
+            os.fsync(self.file.fileno())
+            self.logSize = self.validSize = LogMgr.headerStruct.size + len(payload)
+            self.recordNum = 0
+            self.lastCheckpointTime = time.time()
+
+    def close(self):
+        self.isClosed = True
+        self.hasPending.set()  # 唤醒后台线程，让它退出
+        if self.flusher is not None:
+            self.flusher.join()
+        self.flush()
+        self.file.close()
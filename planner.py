@@ -0,0 +1,354 @@
+import math
+import random
+
+from joiner import Joiner
+from hashIndex import HashIndex
+from exception import QueryException
+
+'''
+查询优化器：为 select / delete 的 where 子句选择访问路径
+按表维护统计信息（行数、每个字段的最小值、最大值、不同值的个数），估计每个条件的选择率，
+在全表扫描、单个索引查找、多个索引查找结果取交集之间选代价最小的一个
+两个表连接时，在哈希连接和索引嵌套循环连接之间、以及用哪一侧作内表之间选代价最小的一个
+'''
+
+
+class Planner:
+    # 代价的单位是顺序读一页。和 PostgreSQL 的默认值一样，随机读一页的代价是顺序读的4倍
+    seqPageCost = 1.0
+    randomPageCost = 4.0
+    cpuTupleCost = 0.01  # 对一条记录判断where条件
+    cpuIndexTupleCost = 0.005  # 从索引中取出一个地址
+    cpuOperatorCost = 0.0025  # 排序时比较一次
+    defaultSelectivity = 1 / 3  # 无法估计时（例如char类型的范围条件）的选择率
+    sampleSize = 30000  # 统计不同值的个数时最多抽样几行
+    leafSampleNum = 32  # 从非唯一索引估计不同值的个数时，随机抽几个叶子
+    analyzeRatio = 0.2  # 修改的行数超过总行数的这个比例后，下次查询前重新统计
+
+    class ColumnStats:  # 一个字段的统计信息
+        def __init__(self, minValue=None, maxValue=None, distinctNum=0):
+            self.minValue = minValue
+            self.maxValue = maxValue
+            self.distinctNum = distinctNum
+
+    class TableStats:  # 一个表的统计信息
+        def __init__(self, rowNum, columns):
+            self.rowNum = rowNum
+            self.columns = columns  # 字段名 -> ColumnStats。用到哪个字段才统计哪个字段
+            self.modifyNum = 0  # 统计之后插入、删除了几行
+
+    class Plan:
+        def __init__(self, method, indexWheres, residualWheres, estimatedRows, cost):
+            self.method = method  # 'seqScan'、'indexScan'、'indexIntersect'，或 ORDER BY 时的 'indexOrder'（沿B+树按顺序读，不需要排序）
+            self.indexWheres = indexWheres  # 用索引查找的条件
+            self.residualWheres = residualWheres  # 取出记录之后再判断的条件
+            self.estimatedRows = estimatedRows
+            self.cost = cost
+
+        def __str__(self) -> str:
+            return f'Plan: {self.method}, 估计 {self.estimatedRows:.0f} 行，代价 {self.cost:.1f}'
+
+    class JoinPlan:
+        def __init__(self, method, inner, plans, estimatedRows, cost):
+            self.method = method  # 'hashJoin' 或 'indexNestedLoop'
+            self.inner = inner  # 内表是左表（0）还是右表（1）。哈希连接用内表构建哈希表，索引嵌套循环连接在内表的索引中查找
+            self.plans = plans  # 两个表各自的访问路径。索引嵌套循环连接不扫描内表，内表的条件都在读出记录后判断
+            self.estimatedRows = estimatedRows
+            self.cost = cost
+
+        def __str__(self) -> str:
+            return f'JoinPlan: {self.method}, 内表 {"左" if self.inner == 0 else "右"}，估计 {self.estimatedRows:.0f} 行，代价 {self.cost:.1f}'
+
+    def __init__(self, catalogMgr, indexMgr, bufferMgr):
+        self.catalogMgr = catalogMgr
+        self.indexMgr = indexMgr
+        self.bufferMgr = bufferMgr
+        self.tables = {}  # 表名 -> TableStats。第一次查询这个表时才统计
+
+    def analyze(self, tableName):  # 扫描一遍表，重新统计所有字段
+        columns = self.catalogMgr.tables[tableName].columns
+        step = max(1, math.ceil(self.bufferMgr.getRecordNum(tableName) / Planner.sampleSize))  # 每隔step行抽一行统计不同值
+        minValues = [None] * len(columns)
+        maxValues = [None] * len(columns)
+        samples = [set() for _ in columns]
+        sampleNum = 0
+        rowNum = 0
+        for i, record in enumerate(self.bufferMgr.scanRecords(tableName)):
+            rowNum += 1
+            for j, value in enumerate(record):
+                if minValues[j] is None or value < minValues[j]:
+                    minValues[j] = value
+                if maxValues[j] is None or value > maxValues[j]:
+                    maxValues[j] = value
+            if i % step == 0:
+                sampleNum += 1
+                for j, value in enumerate(record):
+                    samples[j].add(value)
+
+        columnStats = {}
+        for j, column in enumerate(columns):
+            if column.isUnique:
+                distinctNum = rowNum
+            elif len(samples[j]) == sampleNum:  # 抽样中没有重复，当作每行都不同
+                distinctNum = rowNum
+            elif len(samples[j]) * 10 < sampleNum:  # 重复很多，不同值大概都已经抽到了
+                distinctNum = len(samples[j])
+            else:
+                distinctNum = len(samples[j]) * rowNum / sampleNum
+            columnStats[column.columnName] = Planner.ColumnStats(minValues[j], maxValues[j], distinctNum)
+        self.tables[tableName] = Planner.TableStats(rowNum, columnStats)
+        return self.tables[tableName]
+
+    def analyzeIndex(self, tableName, columnName, rowNum):
+        # 不扫描表，从索引得到一个字段的统计信息：B+树最左、最右的key是最小值、最大值，只读两条路径上的结点；
+        # 唯一索引的不同值个数就是行数，非唯一索引从随机抽取的几个叶子（或桶）估计。字段上没有索引时返回None
+        tree = self.indexMgr.tables[tableName].get(columnName)
+        hashIndex = self.indexMgr.hashTables[tableName].get(columnName)
+        if tree is None and hashIndex is None:
+            return None
+        index = tree if tree is not None else hashIndex
+        distinctNum = rowNum if index.isUnique else self.estimateDistinct(index, rowNum)
+        if tree is None:  # 哈希索引不知道最小值、最大值
+            return Planner.ColumnStats(None, None, distinctNum)
+        minValue = self.indexMgr.getExtremeKey(tableName, columnName)
+        maxValue = self.indexMgr.getExtremeKey(tableName, columnName, isMax=True)
+        return Planner.ColumnStats(minValue, maxValue, distinctNum)
+
+    def estimateDistinct(self, index, rowNum):
+        # 随机抽 leafSampleNum 个B+树的叶子（从根随机往下走）或哈希索引的桶（随机取目录项），
+        # 按抽到的 key数 / 地址数 的比例估计不同值的个数
+        rng = random.Random(rowNum)  # 同样的表得到同样的估计，计划是确定的
+        keyNum = addrNum = 0
+        for _ in range(Planner.leafSampleNum):
+            if isinstance(index, HashIndex):
+                postings = index.getBucket(rng.randrange(len(index.directory))).values
+                isOnly = len(index.directory) == 1
+            else:
+                node = index.root
+                while not node.isLeaf():
+                    node = node.getChild(rng.randrange(len(node.children)))
+                postings = node.children
+                isOnly = node is index.root
+            keyNum += len(postings)
+            addrNum += sum(len(posting) for posting in postings)
+            if isOnly:  # 只有一个叶子（桶），已经是准确的
+                break
+        if addrNum == 0:
+            return 0
+        return rowNum * keyNum / addrNum
+
+    def getStats(self, tableName):  # 行数来自BufferMgr，是准确的；字段的统计信息由 getColumnStats 按需得到
+        stats = self.tables.get(tableName)
+        if stats is None or stats.modifyNum > stats.rowNum * Planner.analyzeRatio + 100:
+            stats = self.tables[tableName] = Planner.TableStats(0, {})
+        stats.rowNum = self.bufferMgr.getRowNum(tableName)
+        return stats
+
+    def getColumnStats(self, tableName, columnName, canScan=True):
+        # 先从索引得到；字段上没有索引时，canScan才扫描全表统计，否则返回None（用默认的选择率）
+        # 例如唯一索引上的等值查找，不应为了估计代价先把表扫描一遍
+        stats = self.getStats(tableName)
+        columnStats = stats.columns.get(columnName)
+        if columnStats is None:
+            columnStats = self.analyzeIndex(tableName, columnName, stats.rowNum)
+            if columnStats is not None:
+                stats.columns[columnName] = columnStats
+            elif canScan:
+                columnStats = self.analyze(tableName).columns[columnName]
+        return columnStats
+
+    def recordInsert(self, tableName, values):  # 插入后更新已有的统计信息，不需要重新扫描
+        stats = self.tables.get(tableName)
+        if stats is None:
+            return
+        stats.modifyNum += 1
+        for column, value in zip(self.catalogMgr.tables[tableName].columns, values):
+            columnStats = stats.columns.get(column.columnName)
+            if columnStats is None:
+                continue
+            if isinstance(value, bytes):
+                value = value.decode('utf-8')
+            if columnStats.distinctNum == 0:  # 统计时表是空的
+                columnStats.minValue = columnStats.maxValue = value
+                columnStats.distinctNum = 1
+                continue
+            if columnStats.minValue is not None and value < columnStats.minValue:
+                columnStats.minValue = value
+            if columnStats.maxValue is not None and value > columnStats.maxValue:
+                columnStats.maxValue = value
+            if column.isUnique:
+                columnStats.distinctNum += 1
+
+    def recordDelete(self, tableName, deleteNum):
+        stats = self.tables.get(tableName)
+        if stats is None:
+            return
+        stats.modifyNum += deleteNum
+
+    def dropTable(self, tableName):
+        self.tables.pop(tableName, None)
+
+    def resetStats(self, tableName):  # 表的内容大量变化后（例如批量导入），下次查询前重新统计
+        self.tables.pop(tableName, None)
+
+    def estimateSelectivity(self, columnStats, where):
+        # 满足条件的行占多少比例。columnStats为None（没有统计信息）时用默认的选择率
+        operator = where['operator']
+        rVal = where['rVal']
+        if columnStats is None:
+            return 1 - Planner.defaultSelectivity if operator in ('<>', '!=') else Planner.defaultSelectivity
+        if columnStats.distinctNum == 0:  # 空表
+            return 0.0
+        distinctNum = max(1.0, columnStats.distinctNum)
+        hasRange = columnStats.minValue is not None  # 哈希索引得到的统计信息没有最小值、最大值
+
+        if operator in ('=', '=='):
+            if hasRange and (rVal < columnStats.minValue or rVal > columnStats.maxValue):
+                return 0.0
+            return 1 / distinctNum
+        if operator in ('<>', '!='):
+            return 1 - 1 / distinctNum
+
+        if not isinstance(rVal, (int, float)) or not isinstance(columnStats.minValue, (int, float)):
+            return Planner.defaultSelectivity
+        low, high = columnStats.minValue, columnStats.maxValue
+        if high == low:
+            fraction = 1.0 if rVal >= low else 0.0  # 所有值都相等：rVal 以下的比例
+        else:
+            fraction = min(1.0, max(0.0, (rVal - low) / (high - low)))
+        if operator in ('<', '<='):
+            return fraction
+        return 1 - fraction
+
+    @staticmethod
+    def checkComparable(value, rVal):
+        if isinstance(value, str):
+            return isinstance(rVal, str)
+        return isinstance(rVal, (int, float))
+
+    def checkWheres(self, tableName, wheres):
+        # 条件的值要能和字段比较：char字段只能和字符串比较，int和float字段只能和数比较
+        # 否则索引查找时bisect会在 array('i') / array('d') 上和字符串比较，全表扫描的范围条件也会出错
+        columns = self.catalogMgr.tables[tableName].columns
+        columnHash = self.catalogMgr.getColumnHash(tableName)
+        for where in wheres:
+            column = columns[columnHash[where['lVal']]]
+            if not self.checkComparable('' if column.type == 'char' else 0, where['rVal']):
+                raise QueryException(f"字段 {where['lVal']} 是 {column.type} 类型，不能和 {where['rVal']!r} 比较")
+
+    def estimatePageFetches(self, rows, pageNum):
+        # 按地址排好序后读记录，每页只读一次。rows行随机分布在pageNum页中，平均会碰到几页
+        if pageNum <= 0 or rows <= 0:
+            return 0.0
+        return pageNum * (1 - (1 - 1 / pageNum) ** rows)
+
+    def plan(self, tableName, wheres):
+        self.checkWheres(tableName, wheres)  # 先检查类型，类型不对的条件不能拿去估计选择率、用索引查找
+        if not wheres:  # 没有条件只能全表扫描，不需要为此重新统计，以免第一行结果要等一次完整的analyze
+            rowNum = self.bufferMgr.getRowNum(tableName)  # BufferMgr维护的行数是准确的
+            seqCost = self.bufferMgr.getPageNum(tableName) * Planner.seqPageCost + rowNum * Planner.cpuTupleCost
+            return Planner.Plan('seqScan', [], [], rowNum, seqCost)
+        rowNum = self.getStats(tableName).rowNum
+        pageNum = self.bufferMgr.getPageNum(tableName)
+        indexWheres = [where for where in wheres if self.indexMgr.checkIndexUsable(tableName, where)]
+        # 没有索引可用时反正要全表扫描，才为没有索引的字段扫描统计；否则这些字段用默认的选择率
+        selectivities = [
+            self.estimateSelectivity(self.getColumnStats(tableName, where['lVal'], not indexWheres), where) for where in wheres
+        ]
+
+        seqCost = pageNum * Planner.seqPageCost + rowNum * Planner.cpuTupleCost
+        best = Planner.Plan('seqScan', [], list(wheres), rowNum, seqCost)
+        for selectivity in selectivities:
+            best.estimatedRows *= selectivity
+
+        candidates = []  # 能用索引的条件，按选择率从小到大
+        for where, whereSelectivity in zip(wheres, selectivities):
+            if any(where is indexWhere for indexWhere in indexWheres):
+                candidates.append((whereSelectivity, len(candidates), where))
+        candidates.sort()
+
+        indexCost = 0.0
+        selectivity = 1.0
+        for i, (whereSelectivity, _, where) in enumerate(candidates):  # 依次多用一个索引，取交集
+            indexCost += math.log2(rowNum + 2) * Planner.cpuIndexTupleCost + Planner.randomPageCost \
+                + rowNum * whereSelectivity * Planner.cpuIndexTupleCost
+            selectivity *= whereSelectivity
+            rows = rowNum * selectivity
+            fetchCost = self.estimatePageFetches(rows, pageNum) * Planner.randomPageCost + rows * Planner.cpuTupleCost
+            cost = indexCost + fetchCost
+            if cost < best.cost:
+                indexWheres = [candidate[2] for candidate in candidates[ : i + 1]]
+                residualWheres = [where for where in wheres if all(where is not indexWhere for indexWhere in indexWheres)]
+                method = 'indexScan' if i == 0 else 'indexIntersect'
+                best = Planner.Plan(method, indexWheres, residualWheres, best.estimatedRows, cost)
+        return best
+
+    def planOrder(self, tableName, wheres, orderKey, rowLimit=None):
+        # ORDER BY：比较“按plan()选的路径取出记录再排序”和“沿orderKey上的B+树按顺序读记录”的代价
+        # rowLimit：最多需要几行（LIMIT + OFFSET），None表示全部。有LIMIT时排序只需维护一个rowLimit大小的堆，按索引读时读够就停
+        best = self.plan(tableName, wheres)
+        rowNum = best.estimatedRows if not wheres else self.getStats(tableName).rowNum
+        sortRows = best.estimatedRows if rowLimit is None else min(best.estimatedRows, rowLimit)
+        best.cost += best.estimatedRows * math.log2(sortRows + 2) * Planner.cpuOperatorCost
+        if orderKey not in self.indexMgr.getKeysWithIndex(tableName, 'btree'):
+            return best
+
+        isChar = self.catalogMgr.tables[tableName].columns[self.catalogMgr.getColumnHash(tableName)[orderKey]].type == 'char'
+        boundWheres = [  # orderKey上的这些条件决定从哪个叶子开始、走到哪里停下
+            where for where in wheres
+            if where['lVal'] == orderKey and where['operator'] in ('=', '==', '<', '<=', '>', '>=')
+            and isinstance(where['rVal'], str) == isChar
+        ]
+        residualWheres = [where for where in wheres if all(where is not boundWhere for boundWhere in boundWheres)]
+        rangeSelectivity = residualSelectivity = 1.0
+        for where in boundWheres:
+            rangeSelectivity *= self.estimateSelectivity(self.getColumnStats(tableName, where['lVal'], False), where)
+        for where in residualWheres:
+            residualSelectivity *= self.estimateSelectivity(self.getColumnStats(tableName, where['lVal'], False), where)
+        rangeRows = rowNum * rangeSelectivity
+        rows = rangeRows if rowLimit is None else min(rangeRows, rowLimit / max(residualSelectivity, 1e-6))
+
+        batchSize = self.bufferMgr.orderBatchSize  # 每批地址按地址顺序读，一批中每页只读一次
+        pageFetches = math.ceil(rows / batchSize) * self.estimatePageFetches(min(rows, batchSize), self.bufferMgr.getPageNum(tableName))
+        cost = math.log2(rowNum + 2) * Planner.cpuIndexTupleCost + Planner.randomPageCost \
+            + rows * (Planner.cpuIndexTupleCost + Planner.cpuTupleCost) + pageFetches * Planner.randomPageCost
+        if cost < best.cost:
+            return Planner.Plan('indexOrder', boundWheres, residualWheres, rangeRows * residualSelectivity, cost)
+        return best
+
+    def planJoin(self, tableNames, wheres, keyNames, rowLimit=None):
+        # 等值连接 tableNames[0].keyNames[0] = tableNames[1].keyNames[1]，wheres是两个表各自的条件
+        # rowLimit：最多需要几行（LIMIT + OFFSET），None表示全部。外表边读边连接，有LIMIT时只需读外表的一部分
+        plans = [self.plan(tableName, tableWheres) for tableName, tableWheres in zip(tableNames, wheres)]
+        stats = [self.getStats(tableName) for tableName in tableNames]
+        rows = [plan.estimatedRows for plan in plans]
+        distinctNums = [max(1.0, self.getColumnStats(tableName, keyName).distinctNum) for tableName, keyName in zip(tableNames, keyNames)]
+        joinRows = rows[0] * rows[1] / max(distinctNums)  # 假设不同值较少的一侧的值都能在另一侧找到
+        fraction = 1.0 if rowLimit is None or joinRows <= rowLimit else rowLimit / joinRows  # 外表需要读的比例
+
+        best = None
+        for inner in (0, 1):  # 哈希连接：内表要全部读完才能建好哈希表
+            outer = 1 - inner
+            cost = plans[inner].cost + plans[outer].cost * fraction \
+                + (rows[inner] + (rows[outer] + joinRows) * fraction) * Planner.cpuTupleCost
+            if rows[inner] > Joiner.buildSize:  # 放不下时两侧都要写一遍、读一遍临时文件
+                for side in (0, 1):
+                    pageNum = self.bufferMgr.getPageNum(tableNames[side]) * rows[side] / max(1, stats[side].rowNum)
+                    cost += 2 * pageNum * Planner.seqPageCost
+            if best is None or cost < best.cost:
+                best = Planner.JoinPlan('hashJoin', inner, plans, joinRows, cost)
+
+        for inner in (0, 1):  # 索引嵌套循环连接：内表的连接字段上有索引时，外表的每条记录在索引中查找
+            outer = 1 - inner
+            tableName, keyName = tableNames[inner], keyNames[inner]
+            if keyName not in self.indexMgr.getKeysWithIndex(tableName):
+                continue
+            lookups = rows[outer] * fraction
+            matches = lookups * stats[inner].rowNum / distinctNums[inner]  # 索引查到的记录，还要再判断内表的条件
+            pageFetches = math.ceil(matches / Joiner.maxBatchSize) \
+                * self.estimatePageFetches(min(matches, Joiner.maxBatchSize), self.bufferMgr.getPageNum(tableName))
+            cost = plans[outer].cost * fraction + lookups * math.log2(stats[inner].rowNum + 2) * Planner.cpuIndexTupleCost \
+                + matches * (Planner.cpuIndexTupleCost + Planner.cpuTupleCost) + pageFetches * Planner.randomPageCost
+            if cost < best.cost:
+                best = Planner.JoinPlan('indexNestedLoop', inner, plans, joinRows, cost)
+        return best
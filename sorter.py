@@ -0,0 +1,61 @@
+import heapq
+import pickle
+import tempfile
+from itertools import islice
+
+'''
+ORDER BY 的排序：字段上没有B+树索引（或者按索引的顺序读更慢）时使用
+有LIMIT时只维护一个大小为 LIMIT + OFFSET 的堆（top-N）；否则用外部归并排序：
+每读入 runSize 行就在内存中排好序写入临时文件（一个run），最后对所有run做多路归并，内存中最多同时有 runSize 行
+'''
+
+
+class Sorter:
+    runSize = 100000  # 内存中最多放几行。全部结果不超过这么多时直接在内存中排序，不写临时文件
+    blockSize = 1000  # 写临时文件时每次pickle几行，归并时每个run每次读回这么多行
+
+    def __init__(self, keyIndex, reverse=False):
+        self.key = lambda record: record[keyIndex]
+        self.reverse = reverse
+
+    def sort(self, records, rowLimit=None):
+        # 返回排好序的记录的迭代器。key相同的记录保持原来的先后顺序
+        # rowLimit：最多需要前几行，None表示全部
+        if rowLimit is not None and rowLimit <= Sorter.runSize:  # top-N
+            if self.reverse:
+                yield from heapq.nlargest(rowLimit, records, key=self.key)
+            else:
+                yield from heapq.nsmallest(rowLimit, records, key=self.key)
+            return
+
+        runs = []
+        try:
+            records = iter(records)
+            while True:
+                run = list(islice(records, Sorter.runSize))
+                if not run:
+                    break
+                run.sort(key=self.key, reverse=self.reverse)
+                if not runs and len(run) < Sorter.runSize:  # 全部放得下，不需要写临时文件
+                    yield from run
+                    return
+                runs.append(self.spill(run))
+            yield from heapq.merge(*map(self.readRun, runs), key=self.key, reverse=self.reverse)
+        finally:
+            for file in runs:
+                file.close()  # 临时文件关闭后自动删除
+
+    def spill(self, run):  # 把一个排好序的run写入临时文件
+        file = tempfile.TemporaryFile()
+        for i in range(0, len(run), Sorter.blockSize):
+            pickle.dump(run[i : i + Sorter.blockSize], file, pickle.HIGHEST_PROTOCOL)
+        file.seek(0)
+        return file
+
+    def readRun(self, file):  # 逐块读回一个run
+        while True:
+            try:
+                block = pickle.load(file)
+            except EOFError:
+                return
+            yield from block
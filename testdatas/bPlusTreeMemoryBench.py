@@ -0,0 +1,101 @@
+import os
+import sys
+import math
+import random
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from bPlusTree import BPlusTree
+
+'''
+比较B+树结点在两种内存布局下，每一百万个key占用的内存：
+旧布局：结点是普通对象（带 __dict__），key存在list里，叶子的每个value是一个 [addr] 列表
+新布局：结点用 __slots__，int/float的key存在 array 里，叶子的value是 array('q')
+两种布局用相同的阶数和填充率批量构建，树的形状完全相同
+'''
+
+
+class LegacyNode:  # 旧布局的结点，只保留占内存的属性
+    def __init__(self, order, parent, keys, children):
+        self.order = order
+        self.parent = parent
+        self.keys = keys
+        self.children = children
+
+
+class LegacyLeafNode(LegacyNode):
+    def __init__(self, order, parent, keys, children):
+        super().__init__(order, parent, keys, children)
+        self.prevLeaf = None
+        self.nextLeaf = None
+
+
+def legacyBulkLoad(items, order, fillFactor=BPlusTree.fillFactor):  # 和 BPlusTree.bulkLoad 分组方式相同
+    capacity = order - 1
+    target = max(math.ceil(order / 2), min(capacity, round(capacity * fillFactor)))
+    level = []
+    prevLeaf = None
+    start = 0
+    for size in BPlusTree.groupSizes(len(items), target, capacity):
+        group = items[start : start + size]
+        start += size
+        leaf = LegacyLeafNode(order, None, [key for key, _ in group], [[value] for _, value in group])
+        leaf.prevLeaf = prevLeaf
+        if prevLeaf is not None:
+            prevLeaf.nextLeaf = leaf
+        prevLeaf = leaf
+        level.append((leaf, leaf.keys[0]))
+
+    while len(level) > 1:
+        upperLevel = []
+        start = 0
+        for size in BPlusTree.groupSizes(len(level), target + 1, capacity + 1):
+            group = level[start : start + size]
+            start += size
+            node = LegacyNode(order, None, [lowKey for _, lowKey in group[1:]], [child for child, _ in group])
+            for child, _ in group:
+                child.parent = node
+            upperLevel.append((node, group[0][1]))
+        level = upperLevel
+    return level[0][0]
+
+
+def makeItems(typeName, testSize, seed=0):  # 生成按key排好序的 [(key, addr), ...]
+    rand = random.Random(seed)
+    addrs = rand.sample(range(1, testSize * 4), testSize)
+    if typeName == 'int':
+        keys = rand.sample(range(-2 ** 31, 2 ** 31 - 1), testSize)
+    elif typeName == 'float':
+        keys = [rand.uniform(0, 1e6) for _ in range(testSize)]
+    else:
+        keys = [f'k{i:010d}' for i in rand.sample(range(testSize * 10), testSize)]
+    return sorted(zip(keys, addrs))
+
+
+def measure(build, typeName, testSize):
+    # 返回构建出的树占用的字节数。items在追踪期间生成、构建后释放，
+    # 这样旧布局中被树引用的key和addr对象会计入，而新布局中已拷进array的则不会
+    tracemalloc.start()
+    items = makeItems(typeName, testSize)
+    tree = build(items)
+    del items
+    used = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del tree
+    return used
+
+
+if __name__ == '__main__':
+    testSize = 1000000
+    order = 128
+    keyTypes = {'int': 'i', 'float': 'd', 'char': None}
+
+    for typeName, keyType in keyTypes.items():
+        legacyBytes = measure(lambda items: legacyBulkLoad(items, order), typeName, testSize)
+        compactBytes = measure(lambda items: BPlusTree.bulkLoad(items, order=order, keyType=keyType), typeName, testSize)
+        perMillion = 1000000 / testSize
+        print(f'{typeName} 类型的key，阶数 {order}，每一百万个key：')
+        print(f'  旧布局 {legacyBytes * perMillion / 2 ** 20:.1f} MB，'
+              f'新布局 {compactBytes * perMillion / 2 ** 20:.1f} MB，'
+              f'节省 {(legacyBytes - compactBytes) * perMillion / 2 ** 20:.1f} MB '
+              f'({(1 - compactBytes / legacyBytes) * 100:.0f}%)')
@@ -0,0 +1,65 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))  # 模块都在仓库根目录下
+
+from api import Api
+
+
+@pytest.fixture
+def dbPath(tmp_path):
+    return str(tmp_path)
+
+
+@pytest.fixture
+def openApi(dbPath):  # 打开（或重新打开）dbPath下的数据库。测试结束时关闭还没有关闭的
+    apis = []
+
+    def openApi():
+        api = Api(dbPath)
+        apis.append(api)
+        return api
+
+    yield openApi
+    for api in apis:
+        if not api.logMgr.isClosed:
+            api.close()
+
+
+@pytest.fixture
+def api(openApi):
+    return openApi()
+
+
+def column(name, type='int', charLen=0, isUnique=False):  # createTable() 用的字段定义
+    return {'name': name, 'type': type, 'charLen': charLen, 'isUnique': isUnique}
+
+
+def selectAll(api, tableName, wheres=()):
+    return api.openCursor(tableName, ['*'], list(wheres)).fetchall()
+
+
+def scanAddrs(api, tableName, keyName):  # 全表扫描：字段的值 -> 有这个值的记录地址（排好序）
+    columnHash = api.catalogMgr.getColumnHash(tableName)
+    addrs = {}
+    for addr, record in api.bufferMgr.iterRecords(tableName, columnHash, [], [], None):
+        addrs.setdefault(record[columnHash[keyName]], []).append(addr)
+    return {value: sorted(valueAddrs) for value, valueAddrs in addrs.items()}
+
+
+def checkIndexAgainstScan(api, tableName, keyName, missingKeys=()):
+    # 索引中查到的地址必须和全表扫描一致：B+树按每个key查，也要整棵树走一遍（没有多余的地址）；哈希索引按每个key查
+    # missingKeys：表中已经没有的值，索引中也不能再查到
+    expected = scanAddrs(api, tableName, keyName)
+    tree = api.indexMgr.tables[tableName].get(keyName)
+    hashIndex = api.indexMgr.hashTables[tableName].get(keyName)
+    assert tree is not None or hashIndex is not None
+    for value, addrs in list(expected.items()) + [(value, []) for value in missingKeys]:
+        if tree is not None:
+            assert sorted(tree.iterRange(low=value, high=value)) == addrs, value
+        if hashIndex is not None:
+            assert sorted(hashIndex.findAddrs(value)) == addrs, value
+    if tree is not None:
+        assert sorted(tree.iterRange()) == sorted(addr for addrs in expected.values() for addr in addrs)
@@ -0,0 +1,139 @@
+import random
+
+import pytest
+
+from bufferMgr import roundFloat
+from conftest import column, selectAll
+from exception import QueryException
+
+
+def createTable(api):
+    api.createTable('t', [column('id', isUnique=True), column('g'), column('gpa', 'float'), column('name', 'char', 6)], 'id')
+    api.createIndex('gidx', 't', 'g')
+    api.createIndex('gpaidx', 't', 'gpa')
+
+
+def aggregate(api, attributes, wheres=()):
+    return api.openCursor('t', attributes, list(wheres)).fetchall()
+
+
+def testIndexOnlyAggregatesAfterDeletes(openApi, capsys):
+    # 没有where时count(*)来自行数计数器，min/max来自B+树，都不读记录文件。删除后不能留下已删除的值
+    api = openApi()
+    createTable(api)
+    api.insertMany('t', [[i, i % 7, 0.6 + i * 0.5, f'n{i}'] for i in range(2000)])
+    api.insert('t', [5000, -3, 2000.1, 'x'])
+    api.delete('t', [{'lVal': 'gpa', 'operator': '<', 'rVal': 1.2}])  # 删掉gpa最小的两行
+    api.delete('t', [{'lVal': 'id', 'operator': '=', 'rVal': 5000}])  # 以及id、gpa最大，g最小的一行
+    api.insert('t', [7000, 3, 0.9, 'y'])  # 复用空洞
+
+    attributes = ['count(*)', 'min(gpa)', 'max(gpa)', 'min(id)', 'max(id)', 'min(g)', 'count(g)']
+    expected = [[1999, roundFloat(0.9), roundFloat(0.6 + 1999 * 0.5), 2, 7000, 0, 1999]]
+    anyRow = [{'lVal': 'id', 'operator': '>', 'rVal': -1}]  # 有where时全表扫描后聚合
+    for reopen in (False, True):  # 重新打开后行数计数器和索引也一致
+        if reopen:
+            api.close()
+            api = openApi()
+        capsys.readouterr()
+        assert aggregate(api, attributes) == expected
+        assert '不读取记录文件' in capsys.readouterr().out
+        assert aggregate(api, attributes, anyRow) == expected
+        assert len(selectAll(api, 't')) == 1999
+
+
+def testCountFollowsInsertsAndDeletes(api):
+    createTable(api)
+    assert aggregate(api, ['count(*)', 'min(gpa)', 'max(id)']) == [[0, None, None]]
+    api.insertMany('t', [[i, i % 3, i / 4, 'a'] for i in range(100)])
+    api.insert('t', [100, 0, 0.0, 'b'])
+    api.delete('t', [{'lVal': 'g', 'operator': '=', 'rVal': 1}])
+    assert aggregate(api, ['count(*)']) == [[101 - 33]]
+    api.delete('t', [])
+    assert aggregate(api, ['count(*)', 'min(gpa)', 'max(id)']) == [[0, None, None]]
+
+
+@pytest.fixture
+def groupTable(api):
+    # gpa是1/8的倍数，4字节float能精确表示，求和也没有舍入误差
+    createTable(api)
+    rng = random.Random(24)
+    rows = [[i, rng.randrange(6), rng.randrange(40) / 8, f'n{rng.randrange(4)}'] for i in range(3000)]
+    api.insertMany('t', rows)
+    api.delete('t', [{'lVal': 'g', 'operator': '=', 'rVal': 2}, {'lVal': 'name', 'operator': '=', 'rVal': 'n1'}])
+    return api, [row for row in rows if not (row[1] == 2 and row[3] == 'n1')]
+
+
+def groupModel(rows, groupIndices, items):
+    # 按分组计算 items 中每个 (函数名, 下标)：一个分组对应一行
+    groups = {}
+    for row in rows:
+        groups.setdefault(tuple(row[i] for i in groupIndices), []).append(row)
+    if not groups and not groupIndices:
+        groups[()] = []
+    result = []
+    for key, groupRows in groups.items():
+        resultRow = list(key)
+        for func, index in items:
+            values = [row[index] for row in groupRows]
+            if func == 'count':
+                resultRow.append(len(values))
+            elif not values:
+                resultRow.append(None)
+            else:
+                resultRow.append({'sum': sum, 'avg': lambda values: sum(values) / len(values), 'min': min, 'max': max}[func](values))
+        result.append(resultRow)
+    return sorted(result)
+
+
+groupWheres = [
+    ([], lambda row: True),
+    ([{'lVal': 'gpa', 'operator': '>=', 'rVal': 2.5}], lambda row: row[2] >= 2.5),
+    ([{'lVal': 'id', 'operator': '<', 'rVal': 100}], lambda row: row[0] < 100),
+    ([{'lVal': 'g', 'operator': '=', 'rVal': 4}, {'lVal': 'name', 'operator': '<>', 'rVal': 'n0'}],
+     lambda row: row[1] == 4 and row[3] != 'n0'),
+    ([{'lVal': 'id', 'operator': '<', 'rVal': 0}], lambda row: False),
+]
+
+
+@pytest.mark.parametrize('groupBy', [[], ['g'], ['name', 'g']])
+@pytest.mark.parametrize('wheres, predicate', groupWheres)
+def testGroupByMatchesModel(groupTable, groupBy, wheres, predicate):
+    api, rows = groupTable
+    columnIndices = {'id': 0, 'g': 1, 'gpa': 2, 'name': 3}
+    items = [('count', 0), ('sum', 2), ('avg', 2), ('min', 2), ('max', 2), ('min', 3), ('max', 0), ('sum', 1), ('count', 1)]
+    attributes = groupBy + ['count(*)', 'sum(gpa)', 'avg(gpa)', 'min(gpa)', 'max(gpa)', 'min(name)', 'max(id)', 'sum(g)', 'count(g)']
+    cursor = api.openCursor('t', attributes, wheres, groupBy=groupBy or None)
+    assert cursor.description == attributes
+    expected = groupModel([row for row in rows if predicate(row)], [columnIndices[key] for key in groupBy], items)
+    assert sorted(cursor.fetchall()) == expected
+
+
+def testOrderAndLimitOnAggregates(groupTable):
+    # 可以按输出的任意一列排序，包括聚合函数；列名不区分大小写和空格
+    api, rows = groupTable
+    counts = {}
+    for row in rows:
+        counts[row[1]] = counts.get(row[1], 0) + 1
+    expected = sorted(([g, count] for g, count in counts.items()), key=lambda row: row[1], reverse=True)
+    cursor = api.openCursor('t', ['g', 'COUNT( * )'], [], limit=3, offset=1, orderBy=('count(*)', 'desc'), groupBy=['g'])
+    assert cursor.description == ['g', 'count(*)']
+    assert [row[1] for row in cursor.fetchall()] == [row[1] for row in expected[1:4]]
+    assert api.openCursor('t', ['g', 'count(*)'], [], orderBy=('g', 'asc'), groupBy=['g']).fetchall() == sorted(expected)
+    assert api.openCursor('t', ['max(gpa)', 'count(*)'], [], limit=0).fetchall() == []
+
+
+@pytest.mark.parametrize('attributes, groupBy, orderBy', [
+    (['g', 'count(*)'], None, None),  # g不在group by中
+    (['name', 'count(*)'], ['g'], None),
+    (['sum(name)'], None, None),
+    (['avg(name)'], ['g'], None),
+    (['sum(*)'], None, None),
+    (['max(nosuch)'], None, None),
+    (['count(*)'], ['nosuch'], None),
+    (['g', 'count(*)'], ['g'], ('sum(gpa)', 'asc')),  # 只能按select中的列排序
+    (['g', 'count(*)'], ['g'], ('g', 'up')),
+])
+def testInvalidAggregateIsRejected(groupTable, attributes, groupBy, orderBy):
+    api, _ = groupTable
+    with pytest.raises(QueryException):
+        api.openCursor('t', attributes, [], orderBy=orderBy, groupBy=groupBy)
@@ -0,0 +1,258 @@
+import csv
+
+import pytest
+
+from api import Api
+from bufferMgr import roundFloat
+from conftest import column, selectAll, checkIndexAgainstScan
+from exception import QueryException
+from indexMgr import IndexMgr
+
+
+def writeCsv(path, lines):
+    with open(path, 'w', encoding='utf-8') as file:
+        file.write(''.join(line + '\n' for line in lines))
+    return str(path)
+
+
+@pytest.mark.parametrize('using', [None, 'btree', 'hash'])
+def testLoadChecksUniquenessOfRoundedFloats(api, tmp_path, using):
+    # float字段存为4字节float。CSV中的值要舍入后再检查唯一性：舍入后和表中已有的值、或和文件中前面的值相同，都违反唯一性
+    api.createTable('t', [column('id', isUnique=True), column('code', 'float', isUnique=True)], 'id')
+    if using is not None:
+        api.createIndex('codeidx', 't', 'code', using=using)
+    api.insert('t', [1, 0.1])
+
+    for i, lines in enumerate([['2,0.1000000001'], ['3,0.30000001', '4,0.3']]):
+        with pytest.raises(QueryException, match='唯一性'):
+            api.loadData('t', writeCsv(tmp_path / f'bad{i}.csv', lines))
+    assert selectAll(api, 't') == [[1, roundFloat(0.1)]]
+
+    api.loadData('t', writeCsv(tmp_path / 'good.csv', ['5,0.30000001', '6,0.2']))
+    assert sorted(selectAll(api, 't')) == [[1, roundFloat(0.1)], [5, roundFloat(0.3)], [6, roundFloat(0.2)]]
+    assert selectAll(api, 't', [{'lVal': 'code', 'operator': '=', 'rVal': 0.3}]) == [[5, roundFloat(0.3)]]
+
+
+def createTable(api, tableName='t'):
+    api.createTable(tableName, [column('id', isUnique=True), column('g'), column('score', 'float'),
+                                column('name', 'char', 6, isUnique=True)], 'id')
+    api.createIndex(f'{tableName}gidx', tableName, 'g')
+    api.createIndex(f'{tableName}scoreidx', tableName, 'score')
+    api.createIndex(f'{tableName}namehidx', tableName, 'name', using='hash')
+
+
+def makeRow(i):
+    return [i, i % 7, i / 4, f'n{i}']
+
+
+def checkIndices(api, tableName='t'):
+    for keyName in ('id', 'g', 'score', 'name'):
+        checkIndexAgainstScan(api, tableName, keyName)
+
+
+@pytest.mark.parametrize('loadNum, rebuild', [(20, False), (500, True)])
+def testLoadMaintainsIndices(openApi, tmp_path, monkeypatch, loadNum, rebuild):
+    # 导入的行数少时逐个插入索引，多时扫描全表后重建索引。两种方式得到的索引都和全表扫描一致
+    monkeypatch.setattr(Api, 'loadChunkSize', 7)  # 分成很多块解析、写入
+    rebuilt = []
+    rebuildIndex = IndexMgr.rebuildIndex
+    monkeypatch.setattr(IndexMgr, 'rebuildIndex',
+                        lambda self, tableName, keyName, *args: rebuilt.append(keyName) or rebuildIndex(self, tableName, keyName, *args))
+    api = openApi()
+    createTable(api)
+    api.insertMany('t', [makeRow(i) for i in range(200)])
+    api.delete('t', [{'lVal': 'g', 'operator': '=', 'rVal': 3}])  # 留下空洞，导入时复用
+    rows = [makeRow(i) for i in range(200) if i % 7 != 3]
+
+    fileName = writeCsv(tmp_path / 'rows.csv', [f'{i},{i % 7},{i / 4},n{i}' for i in range(1000, 1000 + loadNum)])
+    api.loadData('t', fileName)
+    rows += [makeRow(i) for i in range(1000, 1000 + loadNum)]
+    assert sorted(rebuilt) == (['g', 'id', 'name', 'score'] if rebuild else [])
+    assert sorted(selectAll(api, 't')) == rows
+    checkIndices(api)
+    api.close()
+
+    api = openApi()
+    assert sorted(selectAll(api, 't')) == rows
+    checkIndices(api)
+    assert selectAll(api, 't', [{'lVal': 'name', 'operator': '=', 'rVal': 'n1003'}]) == [makeRow(1003)]
+    assert api.openCursor('t', ['count(*)'], []).fetchall() == [[len(rows)]]
+
+
+def testCopyThenLoadRoundTrips(api, tmp_path):
+    # 导出的CSV能原样导回：char中的逗号、引号由csv模块转义
+    createTable(api)
+    rows = [makeRow(i) for i in range(300)] + [[300, 1, -2.5, 'a,b'], [301, 2, 0.1, 'q"x'], [302, 3, 1e6, '']]
+    api.insertMany('t', rows)
+    fileName = str(tmp_path / 'copy.csv')
+    api.copyTable('t', fileName)
+    with open(fileName, newline='', encoding='utf-8') as file:
+        assert len(list(csv.reader(file))) == len(rows)
+
+    createTable(api, 'u')
+    api.loadData('u', fileName)
+    assert sorted(selectAll(api, 'u')) == sorted(selectAll(api, 't'))
+    checkIndices(api, 'u')
+    with pytest.raises(QueryException, match='唯一性'):  # 再导入一次，每一行都和表中已有的行重复
+        api.loadData('u', fileName)
+    assert len(selectAll(api, 'u')) == len(rows)
+
+
+@pytest.mark.parametrize('badLine, message', [
+    ('9,2,1.5', '3 列'),
+    ('9,x,1.5,n9', '数据类型'),
+    ('9,2,1.5,toolong', '最大长度'),
+    ('2,2,1.5,n9', '唯一性'),  # 和文件中前一块里的行重复
+    ('9,2,1.5,n2', '唯一性'),
+    ('9,2,1.5,old-5', '唯一性'),  # 和表中已有的行重复
+    ('-5,2,1.5,n9', '唯一性'),
+])
+def testLoadStopsAtInvalidLine(api, tmp_path, monkeypatch, badLine, message):
+    # 遇到不合法的行时停止：之前的块已经导入，出错的块整块不导入，索引仍和表一致
+    monkeypatch.setattr(Api, 'loadChunkSize', 4)
+    createTable(api)
+    oldRows = [[i, 0, 0.0, f'old{i}'] for i in range(-20, 0, 5)]
+    api.insertMany('t', oldRows)
+    lines = [f'{i},{i % 7},{i / 4},n{i}' for i in range(1, 9)] + [badLine, '10,3,2.5,n10']
+    with pytest.raises(QueryException, match=message):
+        api.loadData('t', writeCsv(tmp_path / 'bad.csv', lines))
+    assert sorted(selectAll(api, 't')) == oldRows + [makeRow(i) for i in range(1, 9)]
+    checkIndices(api)
+
+
+def pinnedPages(api):
+    return [key for key, frame in api.bufferMgr.pool.frames.items() if frame.pinCount > 0]
+
+
+def testCursorFetches(api):
+    # fetchone / fetchmany / fetchall 和迭代可以交替使用，依次取出结果中的行；取完后返回 None / []
+    createTable(api)
+    api.insertMany('t', [makeRow(i) for i in range(250)])
+    cursor = api.openCursor('t', ['name', 'id'], [])
+    assert cursor.description == ['name', 'id']
+    rows = [cursor.fetchone()]
+    rows += cursor.fetchmany(10)
+    rows += cursor.fetchmany()  # 默认取 arraysize 行
+    rows.append(next(cursor))
+    assert cursor.rowcount == len(rows) == 1 + 10 + cursor.arraysize + 1
+    rows += cursor.fetchall()
+    assert rows == [[f'n{i}', i] for i in range(250)]
+    assert cursor.rowcount == 250
+    assert cursor.fetchone() is None and cursor.fetchmany(5) == [] and cursor.fetchall() == [] and list(cursor) == []
+    assert cursor.rowcount == 250
+
+    assert api.openCursor('t', ['*'], []).description == ['id', 'g', 'score', 'name']
+    assert [row[0] for row in api.openCursor('t', ['id'], [{'lVal': 'g', 'operator': '=', 'rVal': 3}])] == \
+        [i for i in range(250) if i % 7 == 3]
+
+
+@pytest.mark.parametrize('scanEngine', ['numpy', 'python'])
+@pytest.mark.parametrize('wheres', [[], [{'lVal': 'g', 'operator': '=', 'rVal': 3}]])
+@pytest.mark.parametrize('limit', [None, 50])
+def testCursorCloseReleasesPages(api, monkeypatch, scanEngine, wheres, limit):
+    # 读到一半的游标钉住了正在读的页。close() 之后这些页可以被换出，游标不再返回行
+    from bufferMgr import BufferMgr
+    monkeypatch.setattr(BufferMgr, 'scanEngine', scanEngine)
+    createTable(api)
+    api.insertMany('t', [makeRow(i) for i in range(3000)])
+    cursor = api.openCursor('t', ['*'], wheres, limit=limit)
+    assert pinnedPages(api) == []  # 打开游标时还没有开始读
+    assert cursor.fetchone() is not None
+    assert pinnedPages(api) != []
+    cursor.close()
+    assert pinnedPages(api) == []
+    assert cursor.fetchone() is None and cursor.fetchall() == []
+
+    cursor = api.openCursor('t', ['*'], wheres, limit=limit)
+    cursor.fetchall()  # 读完的游标也不再钉住页
+    assert pinnedPages(api) == []
+
+
+def testSelectPrintsEveryRow(api, capsys):
+    createTable(api)
+    api.insertMany('t', [makeRow(i) for i in range(30)])
+    capsys.readouterr()
+    api.select('t', ['id', 'name'], [{'lVal': 'id', 'operator': '<', 'rVal': 12}])
+    out = capsys.readouterr().out
+    assert '查询到 12 条记录' in out
+    assert all(f'n{i} ' in out for i in range(12)) and 'n12 ' not in out
+    assert pinnedPages(api) == []
+
+
+@pytest.fixture
+def limitTable(api):
+    # v上没有索引。删除一部分行留下空洞，再插入的行复用空洞，地址顺序和id的顺序不同
+    api.createTable('t', [column('id', isUnique=True), column('g'), column('v'), column('name', 'char', 6)], 'id')
+    api.createIndex('gidx', 't', 'g')
+    api.createIndex('namehidx', 't', 'name', using='hash')
+    api.insertMany('t', [[i, i % 7, (i * 37) % 1000, f'n{i % 50}'] for i in range(3000)])
+    api.delete('t', [{'lVal': 'v', 'operator': '<', 'rVal': 300}])
+    api.insertMany('t', [[i, i % 7, (i * 37) % 1000, f'n{i % 50}'] for i in range(3000, 3400)])
+    return api
+
+
+limitWheres = [
+    [],
+    [{'lVal': 'v', 'operator': '<', 'rVal': 600}],
+    [{'lVal': 'g', 'operator': '=', 'rVal': 3}],
+    [{'lVal': 'id', 'operator': '>=', 'rVal': 2500}],
+    [{'lVal': 'name', 'operator': '=', 'rVal': 'n7'}],
+    [{'lVal': 'g', 'operator': '=', 'rVal': 3}, {'lVal': 'v', 'operator': '>', 'rVal': 500}],
+]
+
+
+@pytest.mark.parametrize('wheres', limitWheres)
+def testLimitOffsetPagesThroughResult(limitTable, wheres):
+    # 用同一个查询翻页：各页互不重复，接起来正好是全部结果，顺序与页的大小无关
+    expected = sorted(selectAll(limitTable, 't', wheres))
+    for pageSize in (7, 37, 300):
+        rows = []
+        for offset in range(0, len(expected) + pageSize, pageSize):
+            page = limitTable.openCursor('t', ['*'], wheres, limit=pageSize, offset=offset).fetchall()
+            assert len(page) == min(pageSize, max(0, len(expected) - offset))
+            rows += page
+        assert sorted(rows) == expected
+        assert rows == limitTable.openCursor('t', ['*'], wheres, limit=len(expected) + 1).fetchall()
+    assert limitTable.openCursor('t', ['*'], wheres, limit=0).fetchall() == []
+    assert limitTable.openCursor('t', ['id'], wheres, offset=len(expected) - 1).fetchall() == \
+        [[row[0]] for row in rows[-1:]]
+
+
+def testLimitStopsReadingEarly(limitTable, monkeypatch):
+    # 行够了就不再向下层要记录：全表扫描不再读后面的块，索引查到的地址只读第一批
+    from bufferMgr import BufferMgr
+    monkeypatch.setattr(BufferMgr, 'readAheadSize', 1)  # 每次只预读一页
+    chunks = []
+    scanChunks = BufferMgr.Buffer.scanChunks
+    monkeypatch.setattr(BufferMgr.Buffer, 'scanChunks', lambda self: (chunks.append(chunk) or chunk for chunk in scanChunks(self)))
+    fetched = []
+    fetchRecords = BufferMgr.Buffer.fetchRecords
+
+    def countingFetchRecords(self, addrs):
+        addrs = list(addrs)
+        fetched.extend(addrs)
+        return fetchRecords(self, addrs)
+    monkeypatch.setattr(BufferMgr.Buffer, 'fetchRecords', countingFetchRecords)
+
+    limitTable.planner.getColumnStats('t', 'v')  # v上没有索引，统计信息要扫描一遍表，先收集好
+    chunks.clear()
+    assert len(limitTable.openCursor('t', ['*'], [{'lVal': 'v', 'operator': '>', 'rVal': 900}], limit=5, offset=2).fetchall()) == 5
+    assert 0 < len(chunks) <= 2
+    from planner import Planner
+    monkeypatch.setattr(Planner, 'randomPageCost', 0.01)  # g = 3 有约350行，让优化器走索引
+    assert limitTable.planner.plan('t', [{'lVal': 'g', 'operator': '=', 'rVal': 3}]).method == 'indexScan'
+    assert len(limitTable.openCursor('t', ['*'], [{'lVal': 'g', 'operator': '=', 'rVal': 3}], limit=5).fetchall()) == 5
+    assert 0 < len(fetched) <= BufferMgr.limitBatchSize < len(selectAll(limitTable, 't', [{'lVal': 'g', 'operator': '=', 'rVal': 3}]))
+
+    chunks.clear()
+    fetched.clear()
+    assert len(limitTable.openCursor('t', ['*'], [{'lVal': 'v', 'operator': '>', 'rVal': 900}]).fetchall()) > 5
+    assert len(chunks) == limitTable.bufferMgr.getPageNum('t')
+    limitTable.openCursor('t', ['*'], [{'lVal': 'g', 'operator': '=', 'rVal': 3}]).fetchall()
+    assert len(fetched) == len(selectAll(limitTable, 't', [{'lVal': 'g', 'operator': '=', 'rVal': 3}]))
+
+
+@pytest.mark.parametrize('limit, offset', [(-1, 0), (1.5, 0), ('3', 0), (None, -1), (3, None), (3, 2.0)])
+def testInvalidLimitIsRejected(limitTable, limit, offset):
+    with pytest.raises(QueryException):
+        limitTable.openCursor('t', ['*'], [], limit=limit, offset=offset)
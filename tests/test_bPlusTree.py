@@ -0,0 +1,145 @@
+import math
+import random
+from array import array
+
+import pytest
+
+from bPlusTree import BPlusTree, LeafNode
+
+
+def checkTree(tree):
+    # 检查B+树的结构：key有序且落在父结点的分隔范围内，结点的key数不上溢也不下溢，
+    # 父子指针一致，所有叶子在同一层，叶子链表按顺序串起了全部叶子。返回从左到右的全部 (key, 地址)
+    leaves = []
+
+    def checkNode(node, low, high, depth):
+        keys = list(node.keys)
+        assert keys == sorted(set(keys)), keys
+        assert all((low is None or low <= key) and (high is None or key < high) for key in keys)
+        assert len(keys) < tree.order
+        if not node.isRoot():
+            assert len(keys) >= math.ceil(tree.order / 2) - 1
+        if tree.keyType is not None:
+            assert isinstance(node.keys, array) and node.keys.typecode == tree.keyType
+        if node.isLeaf():
+            assert len(node.children) == len(keys)
+            leaves.append((node, depth))
+            return
+        assert len(keys) >= 1 and len(node.children) == len(keys) + 1
+        bounds = [low] + keys + [high]
+        for i, child in enumerate(node.children):
+            assert child.parent is node
+            checkNode(child, bounds[i], bounds[i + 1], depth + 1)
+
+    assert tree.root.isRoot()
+    checkNode(tree.root, None, None, 0)
+    assert len({depth for _, depth in leaves}) == 1
+
+    leaf = tree.root.getLeftmostLeaf()
+    assert leaf.prevLeaf is None
+    for i, (expectedLeaf, _) in enumerate(leaves):
+        assert leaf is expectedLeaf
+        if i > 0:
+            assert leaf.prevLeaf is leaves[i - 1][0]
+        leaf = leaf.nextLeaf
+    assert leaf is None
+
+    items = []
+    for leaf, _ in leaves:
+        for key, value in zip(leaf.keys, leaf.children):
+            items.extend((key, addr) for addr in ([value] if tree.isUnique else value))
+    return items
+
+
+def makeKey(i, keyType):
+    return i if keyType == 'i' else f'k{i:05d}'
+
+
+def checkAgainstModel(tree, model):
+    # model: key -> 排好序的地址list
+    expected = [(key, addr) for key in sorted(model) for addr in model[key]]
+    assert checkTree(tree) == expected
+    assert list(tree.iterRange()) == [addr for _, addr in expected]
+    assert list(tree.iterRange(reverse=True)) == [addr for _, addr in reversed(expected)]
+
+
+@pytest.mark.parametrize('order', [3, 4, 5, 8, 33])
+@pytest.mark.parametrize('n', [0, 1, 2, 7, 100, 600])
+@pytest.mark.parametrize('keyType', ['i', None])
+@pytest.mark.parametrize('isUnique', [True, False])
+@pytest.mark.parametrize('fillFactor', [None, 0.1, 1.0])
+def testBulkLoadMatchesIncrementalInsert(order, n, keyType, isUnique, fillFactor):
+    rng = random.Random(n * order)
+    model = {}
+    for i in rng.sample(range(n * 3), n):
+        addrs = rng.sample(range(10000), 1 if isUnique else rng.randint(1, 3))
+        model[makeKey(i, keyType)] = sorted(addrs)
+
+    incremental = BPlusTree(order=order, keyType=keyType, isUnique=isUnique)
+    keys = list(model)
+    rng.shuffle(keys)
+    for key in keys:
+        for addr in model[key]:
+            incremental.insert(key, addr)
+    items = [(key, model[key][0] if isUnique else array('q', model[key])) for key in sorted(model)]
+    loaded = BPlusTree.bulkLoad(items, order=order, fillFactor=fillFactor, keyType=keyType, isUnique=isUnique)
+
+    checkAgainstModel(incremental, model)
+    checkAgainstModel(loaded, model)
+    for i in range(-1, n * 3 + 1, max(5, n // 10)):  # 两棵树上的范围查找和点查找结果相同
+        low, high = makeKey(i, keyType), makeKey(i + 20, keyType)
+        for tree in (incremental, loaded):
+            assert list(tree.iterRange(low=low, high=high, includeLow=False)) == \
+                [addr for key in sorted(model) if low < key <= high for addr in model[key]]
+        assert incremental.find(low)[0] == loaded.find(low)[0] == (low in model)
+
+    for key in sorted(model)[::2]:  # 批量构建出来的树之后还能正常地插入和删除
+        assert loaded.delete(key, model[key][0] if not isUnique else None)
+        if isUnique or len(model[key]) == 1:
+            del model[key]
+        else:
+            model[key].pop(0)
+    for i in range(n * 3, n * 3 + n // 2):
+        loaded.insert(makeKey(i, keyType), i)
+        model[makeKey(i, keyType)] = [i]
+    checkAgainstModel(loaded, model)
+
+
+@pytest.mark.parametrize('order', [3, 4, 5, 6, 16])
+@pytest.mark.parametrize('keyType', ['i', None])
+@pytest.mark.parametrize('isUnique', [True, False])
+@pytest.mark.parametrize('seed', range(3))
+def testRandomInsertDeleteKeepsInvariants(order, keyType, isUnique, seed):
+    rng = random.Random(seed)
+    tree = BPlusTree(order=order, keyType=keyType, isUnique=isUnique)
+    model = {}
+    nextAddr = 0
+    for step in range(1500):
+        i = rng.randrange(300)
+        key = makeKey(i, keyType)
+        if rng.random() < 0.55:  # 插入。唯一索引中已有的key不会再插入
+            if isUnique and key in model:
+                continue
+            tree.insert(key, nextAddr)
+            model.setdefault(key, []).append(nextAddr)
+            nextAddr += 1
+        elif isUnique:
+            assert tree.delete(key) == (key in model)
+            model.pop(key, None)
+        else:  # 非唯一索引按地址删除，地址删光了key才消失
+            addrs = model.get(key, [])
+            addr = rng.choice(addrs) if addrs and rng.random() < 0.9 else nextAddr
+            assert tree.delete(key, addr) == (addr in addrs)
+            if addr in addrs:
+                addrs.remove(addr)
+                if not addrs:
+                    del model[key]
+        if step % 25 == 0:
+            checkAgainstModel(tree, model)
+    checkAgainstModel(tree, model)
+
+    for key in list(model):  # 全部删光后是一棵空树
+        for addr in model.pop(key):
+            assert tree.delete(key, None if isUnique else addr)
+    checkAgainstModel(tree, model)
+    assert isinstance(tree.root, LeafNode) and tree.root.isEmpty()
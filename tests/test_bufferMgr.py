@@ -0,0 +1,74 @@
+import pytest
+
+from conftest import column, selectAll
+from exception import BufferException
+
+
+def testPaddedRecordsKeepTheirSlots(api, openApi):
+    # recordSize 至少是5（空洞链表的结点），char(2) 的表每条记录要补齐到5个Byte
+    api.createTable('s', [column('c', 'char', 2, True)], 'c')
+    assert api.bufferMgr.buffers['s'].recordSize == 5
+    for value in ['ab', 'cd', 'ef']:
+        api.insert('s', [value])
+    frame = api.bufferMgr.pool.fetchPage(api.bufferMgr.buffers['s'], 0)
+    assert len(frame.data) == api.bufferMgr.buffers['s'].pageBytes
+
+    api.delete('s', [{'lVal': 'c', 'operator': '=', 'rVal': 'ab'}])
+    api.insert('s', ['gh'])  # 插入到空洞里
+    assert sorted(selectAll(api, 's')) == [['cd'], ['ef'], ['gh']]
+
+    api.close()
+    assert sorted(selectAll(openApi(), 's')) == [['cd'], ['ef'], ['gh']]
+
+
+def testSetRecordRejectsWrongSize(api):
+    api.createTable('s', [column('c', 'char', 2, True)], 'c')
+    buffer = api.bufferMgr.buffers['s']
+    with pytest.raises(BufferException):
+        buffer.setRecord(1, b'\x00ab')
+
+
+def testInsertRecordRaisesOnOverflow(api):
+    api.createTable('t', [column('id', 'int', 0, True)], 'id')
+    columns = api.catalogMgr.tables['t'].columns
+    with pytest.raises(BufferException):
+        api.bufferMgr.insertRecord('t', [2 ** 40], columns, [])
+
+
+def testNumpyScanMatchesPythonScan(api, monkeypatch):
+    # numpy引擎按整列比较原始字节或转换后的数，结果必须和逐行判断一致：
+    # char字段忽略末尾补齐的\x00（逐行判断时rstrip），float字段按4字节float解码后比较，int字段和float值比较
+    pytest.importorskip('numpy')
+    from bufferMgr import BufferMgr
+    api.createTable('t', [column('id', isUnique=True), column('n'), column('score', 'float'),
+                          column('name', 'char', 6)], 'id')
+    names = ['', 'a', 'a ', 'ab', 'abcdef', 'b', 'é', 'éé', 'zz']
+    scores = [0.1, -0.0, 2.5, -3.75, 1e30, float('inf'), float('-inf'), 1 / 3]
+    api.insertMany('t', [[i, (i * 7919) % 101 - 50 + (i % 3 - 1) * 2 ** 30, scores[i % len(scores)] * (i % 5 - 2.5),
+                          names[i % len(names)]] for i in range(500)])
+
+    conditions = [('name', value) for value in ['', 'a', 'a ', 'ab', 'abc', 'é', 'éé', 'zzz']] \
+        + [('score', value) for value in [0, 0.1, 0.1 * -1.5, 2.5, -3.75, 1 / 3 * -2.5, 1e30 * 1.5, float('inf'), 7]] \
+        + [('n', value) for value in [0, -50, 2 ** 30, 2 ** 31 - 1, -2 ** 31, 3.5, -0.5, 2 ** 70]]
+    queries = [[{'lVal': lVal, 'operator': operator, 'rVal': rVal}]
+               for lVal, rVal in conditions for operator in ['=', '<>', '<', '<=', '>', '>=']]
+    queries += [[{'lVal': 'name', 'operator': '>=', 'rVal': 'a'}, {'lVal': 'score', 'operator': '<', 'rVal': 2.5},
+                 {'lVal': 'n', 'operator': '<>', 'rVal': 0}]]
+    buffer = api.bufferMgr.buffers['t']
+    columnHash = api.catalogMgr.getColumnHash('t')
+    for wheres in queries:
+        if wheres[0]['rVal'] != 2 ** 70:  # 超出int64的值不能向量化，退回逐行判断
+            assert buffer.compileMask(columnHash, wheres) is not None
+        monkeypatch.setattr(BufferMgr, 'scanEngine', 'numpy')
+        vectorRows = selectAll(api, 't', wheres)
+        monkeypatch.setattr(BufferMgr, 'scanEngine', 'python')
+        assert vectorRows == selectAll(api, 't', wheres), wheres
+
+
+def testPageNumCountsWholeRecords(api):
+    # 记录不跨页存储：每页末尾放不下一条记录的空间不算，页数按每页的记录数计算
+    api.createTable('t', [column('id', isUnique=True), column('name', 'char', 2044)], 'id')
+    buffer = api.bufferMgr.buffers['t']
+    assert buffer.recordsPerPage == 1  # 每条记录2049 Byte，一页只放得下一条
+    api.insertMany('t', [[i, f'n{i}'] for i in range(10)])
+    assert api.bufferMgr.getPageNum('t') == buffer.recordNum == 11  # 第0条记录是表头
@@ -0,0 +1,127 @@
+import json
+import os
+import random
+
+import pytest
+
+from bufferMgr import roundFloat
+from conftest import column, selectAll, scanAddrs, checkIndexAgainstScan
+
+
+def createTable(api):
+    api.createTable('t', [column('id', isUnique=True), column('g'), column('score', 'float'),
+                          column('name', 'char', 6)], 'id')
+    api.createIndex('gidx', 't', 'g')
+    api.createIndex('scoreidx', 't', 'score')
+    api.createIndex('namehidx', 't', 'name', using='hash')
+    api.createIndex('ghidx', 't', 'g', using='hash')  # 同一个字段上同时有B+树和哈希索引
+
+
+def makeRow(i):
+    return [i, i % 7, (i % 11) / 4, f'n{i % 13}']
+
+
+def testIndicesMatchScanAfterReopen(openApi):
+    api = openApi()
+    createTable(api)
+    rng = random.Random(14)
+    ids = set()
+    nextId = 0
+    for _ in range(30):  # 插入和删除交替进行，删除留下的空洞会被之后的插入复用
+        if rng.random() < 0.6 or not ids:
+            rows = [makeRow(i) for i in range(nextId, nextId + rng.randint(1, 40))]
+            nextId += len(rows)
+            if len(rows) == 1:
+                api.insert('t', rows[0])
+            else:
+                api.insertMany('t', rows)
+            ids.update(row[0] for row in rows)
+        else:
+            g = rng.randrange(7)
+            api.delete('t', [{'lVal': 'g', 'operator': '=', 'rVal': g}])
+            ids = {i for i in ids if i % 7 != g}
+    api.close()
+
+    api = openApi()
+    assert sorted(selectAll(api, 't')) == sorted(makeRow(i) for i in ids)
+    for keyName in ('id', 'g', 'score', 'name'):
+        checkIndexAgainstScan(api, 't', keyName, missingKeys=[nextId] if keyName == 'id' else ())
+    assert set(api.indexMgr.hashTables['t']) == {'name', 'g'}
+    for g in range(7):  # 走索引的查询和全表扫描的结果一致
+        wheres = [{'lVal': 'g', 'operator': '=', 'rVal': g}]
+        assert sorted(selectAll(api, 't', wheres)) == sorted(makeRow(i) for i in ids if i % 7 == g)
+
+
+def legacyTree(items, leafSize=3):
+    # 按旧版本 indexFile.json 的格式构造一棵B+树：叶子的children是 [addr]，内部结点的key是右边子树的最小key，不记录order
+    nodes = [{'keys': [key for key, _ in items[i:i + leafSize]],
+              'children': [[addr] for _, addr in items[i:i + leafSize]],
+              'isLeaf': True} for i in range(0, len(items), leafSize)]
+    while len(nodes) > 1:
+        parents = []
+        for i in range(0, len(nodes), leafSize):
+            children = nodes[i:i + leafSize]
+            parents.append({'keys': [firstKey(child) for child in children[1:]], 'children': children, 'isLeaf': False})
+        nodes = parents
+    return nodes[0]
+
+
+def firstKey(nodeDict):
+    while not nodeDict['isLeaf']:
+        nodeDict = nodeDict['children'][0]
+    return nodeDict['keys'][0]
+
+
+def testLegacyIndexFileIsMigrated(openApi, dbPath):
+    api = openApi()
+    api.createTable('t', [column('id', isUnique=True), column('name', 'char', 6)], 'id')
+    api.insertMany('t', [[i, f'n{i}'] for i in range(50)])
+    api.delete('t', [{'lVal': 'id', 'operator': '<', 'rVal': 10}])
+    items = sorted((key, addrs[0]) for key, addrs in scanAddrs(api, 't', 'id').items())
+    api.close()
+
+    # 换成旧版本的索引文件：没有 .idx 文件，所有的树存放在 indexFile.json 中
+    indexPath = os.path.join(dbPath, 'dbfiles/indices')
+    os.remove(os.path.join(indexPath, 't.id.idx'))
+    legacyFile = os.path.join(indexPath, 'indexFile.json')
+    with open(legacyFile, 'w') as file:
+        json.dump({'t': {'id': legacyTree(items)}}, file)
+
+    api = openApi()
+    checkIndexAgainstScan(api, 't', 'id', missingKeys=range(10))
+    api.insert('t', [100, 'new'])
+    assert selectAll(api, 't', [{'lVal': 'id', 'operator': '=', 'rVal': 100}]) == [[100, 'new']]
+    api.close()
+    assert not os.path.exists(legacyFile)
+    assert os.path.exists(os.path.join(indexPath, 't.id.idx'))
+
+    api = openApi()  # 之后从转换出来的 .idx 文件读入
+    checkIndexAgainstScan(api, 't', 'id', missingKeys=range(10))
+    assert sorted(selectAll(api, 't')) == [[i, f'n{i}'] for i in range(10, 50)] + [[100, 'new']]
+
+
+@pytest.mark.parametrize('using', ['btree', 'hash'])
+def testFloatKeysAreDeletedAndReused(api, monkeypatch, using):
+    # float字段在记录文件中存为4字节float，删除时用读回的值在索引中查找。索引的key必须是同样舍入过的值，
+    # 否则删除找不到key，留下的地址在空洞被复用后指向无关的记录
+    from planner import Planner
+    api.createTable('t', [column('id', isUnique=True), column('gpa', 'float'), column('code', 'float', isUnique=True)], 'id')
+    api.createIndex('gpaidx', 't', 'gpa', using=using)
+    api.createIndex('codeidx', 't', 'code', using=using)
+    api.insertMany('t', [[i, i * 0.01, i * 0.1] for i in range(3000)])
+    api.insert('t', [3000, 0.3, 300.1])
+    gpaWhere = [{'lVal': 'gpa', 'operator': '=', 'rVal': 0.1}]
+    assert [row[0] for row in selectAll(api, 't', gpaWhere)] == [10]
+
+    api.delete('t', gpaWhere)
+    api.delete('t', [{'lVal': 'code', 'operator': '=', 'rVal': 0.2}])
+    api.insert('t', [5000, 42.5, 0.2])  # 复用删除留下的空洞；code = 0.2 的记录已经删了，不违反唯一性
+    api.insert('t', [5001, 42.5, 1e6])
+    assert selectAll(api, 't', gpaWhere) == []
+    assert [row[0] for row in selectAll(api, 't', [{'lVal': 'code', 'operator': '=', 'rVal': 0.2}])] == [5000]
+    checkIndexAgainstScan(api, 't', 'gpa', missingKeys=[roundFloat(0.1)])
+    checkIndexAgainstScan(api, 't', 'code')
+
+    monkeypatch.setattr(Planner, 'randomPageCost', 1e9)  # 不用索引，全表扫描的结果和索引查找一致
+    assert sorted(row[0] for row in selectAll(api, 't', [{'lVal': 'gpa', 'operator': '=', 'rVal': 0.3}])) == [30, 3000]
+    assert selectAll(api, 't', gpaWhere) == []
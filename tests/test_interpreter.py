@@ -0,0 +1,111 @@
+import pytest
+
+from conftest import selectAll
+from exception import QueryException, SqlSyntaxError
+from interpreter import Interpreter, SqlParser
+
+
+def openInterpreter(dbPath, monkeypatch):
+    monkeypatch.chdir(dbPath)  # Interpreter 在当前工作目录下打开数据库
+    return Interpreter()
+
+
+def testFailedInsertDoesNotStopShell(dbPath, monkeypatch, capsys):
+    interpreter = openInterpreter(dbPath, monkeypatch)
+    try:
+        interpreter.onecmd('create table t (id int, name char(8) unique, primary key (id));')
+        interpreter.onecmd("insert into t values (1, 'a');")
+        interpreter.onecmd("insert into t values (2, 'b'), (1, 'c');")  # 与表中的主键重复
+        interpreter.onecmd("insert into t values (3, 'd'), (3, 'e');")  # 批内重复
+        interpreter.onecmd("insert into t values (4, 'a');")  # 与表中的unique字段重复
+        interpreter.onecmd("insert into t values (5, 'f');")
+        assert '唯一性' in capsys.readouterr().out
+        assert sorted(selectAll(interpreter.api, 't')) == [[1, 'a'], [5, 'f']]
+    finally:
+        interpreter.api.close()
+
+
+def testFailedDeleteDoesNotStopShell(dbPath, monkeypatch, capsys):
+    interpreter = openInterpreter(dbPath, monkeypatch)
+    try:
+        interpreter.onecmd('create table t (id int, name char(8), primary key (id));')
+        interpreter.onecmd("insert into t values (1, 'a'), (2, 'b');")
+        capsys.readouterr()
+        interpreter.onecmd("delete from t where id = 'x';")  # 类型不符
+        interpreter.onecmd("delete from nosuchtable where id = 1;")
+        interpreter.onecmd('delete from t where id = 2;')
+        out = capsys.readouterr().out
+        assert '类型' in out and 'nosuchtable' in out
+        assert selectAll(interpreter.api, 't') == [[1, 'a']]
+    finally:
+        interpreter.api.close()
+
+
+def testIndexOrderMustFitNodeHeader(dbPath, monkeypatch, capsys):
+    # 结点的key数在索引文件中存为2字节无符号整数，过大的阶数在建索引时就拒绝，而不是提交时出错
+    interpreter = openInterpreter(dbPath, monkeypatch)
+    try:
+        interpreter.onecmd('create table t (id int, g int, primary key (id));')
+        interpreter.onecmd('insert into t values (1, 10), (2, 20);')
+        capsys.readouterr()
+        interpreter.onecmd('create index gidx on t (g) with (order = 70000);')
+        assert '65535' in capsys.readouterr().out
+        assert not interpreter.api.catalogMgr.checkExistIndex('gidx')
+        with pytest.raises(QueryException):
+            interpreter.api.createIndex('gidx', 't', 'g', order=70000)
+        assert not interpreter.api.catalogMgr.checkExistIndex('gidx')
+
+        interpreter.onecmd('create index gidx on t (g) with (order = 65535);')
+        interpreter.onecmd('insert into t values (3, 30);')
+    finally:
+        interpreter.api.close()
+
+    interpreter = openInterpreter(dbPath, monkeypatch)
+    try:
+        assert interpreter.api.indexMgr.tables['t']['g'].order == 65535
+        assert selectAll(interpreter.api, 't', [{'lVal': 'g', 'operator': '>', 'rVal': 15}]) == [[2, 20], [3, 30]]
+    finally:
+        interpreter.api.close()
+
+
+def testLoadAndCopyStatements(dbPath, monkeypatch, capsys):
+    # 相对路径相对于当前工作目录。文件不存在、行不合法时打印错误，shell继续运行
+    interpreter = openInterpreter(dbPath, monkeypatch)
+    try:
+        interpreter.onecmd('create table t (id int, name char(8), primary key (id));')
+        interpreter.onecmd("insert into t values (1, 'a'), (2, 'b');")
+        interpreter.onecmd("copy t to 'out.csv';")
+        interpreter.onecmd('create table u (id int, name char(8), primary key (id));')
+        interpreter.onecmd("load data from 'out.csv' into u;")
+        capsys.readouterr()
+        interpreter.onecmd("load data from 'missing.csv' into u;")
+        interpreter.onecmd("load data from 'out.csv' into u;")  # 主键重复
+        interpreter.onecmd("load 'out.csv' into u;")
+        out = capsys.readouterr().out
+        assert 'missing.csv' in out and '唯一性' in out and 'load data from' in out
+        assert sorted(selectAll(interpreter.api, 'u')) == [[1, 'a'], [2, 'b']]
+    finally:
+        interpreter.api.close()
+
+
+@pytest.mark.parametrize('sql, limit, offset', [
+    ('* from t;', None, 0),
+    ('* from t limit 5;', 5, 0),
+    ('* from t where id > 3 limit 0 offset 20;', 0, 20),
+    ("* from t where name = 'limit 1' order by id desc limit 10 offset 2;", 10, 2),
+])
+def testLimitClauseIsParsed(sql, limit, offset):
+    parsed = SqlParser.select(sql)
+    assert parsed[3:5] == (limit, offset)
+
+
+@pytest.mark.parametrize('sql', ['* from t limit -1;', '* from t limit 5 offset x;', '* from t limit 1.5;', '* from t offset 3;'])
+def testInvalidLimitClauseIsRejected(sql):
+    with pytest.raises(SqlSyntaxError):
+        SqlParser.select(sql)
+
+
+def testAggregateClausesAreParsed():
+    parsed = SqlParser.select('g, count(*), avg(gpa) from t where id > 3 group by g order by count(*) desc limit 2;')
+    assert parsed[0] == 't' and parsed[1] == ['g', 'count(*)', 'avg(gpa)']
+    assert parsed[3:7] == (2, 0, ('count(*)', 'desc'), ['g'])
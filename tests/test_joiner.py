@@ -0,0 +1,143 @@
+import random
+
+import pytest
+
+from conftest import column
+from exception import QueryException
+from joiner import Joiner
+from planner import Planner
+
+
+def testIndexNestedLoopJoinOnFloatKey(api, capsys):
+    # float字段上的索引也能用于连接：索引中的key和记录中读出的值都是舍入过的4字节float
+    api.createTable('a', [column('id', isUnique=True), column('x', 'float')], 'id')
+    api.createTable('b', [column('id', isUnique=True), column('y', 'float')], 'id')
+    api.createIndex('yidx', 'b', 'y')
+    api.insertMany('a', [[i, i * 0.1] for i in range(0, 60, 6)])
+    api.insertMany('b', [[i, i * 0.1] for i in range(20000)])
+    capsys.readouterr()
+
+    rows = api.openCursor('a', ['a.id', 'b.id'], [], join=('b', 'x', 'y')).fetchall()
+    assert '索引嵌套循环连接' in capsys.readouterr().out
+    assert sorted(rows) == [[i, i] for i in range(0, 60, 6)]
+
+
+def joinModel(leftRecords, rightRecords, leftKey, rightKey):
+    return sorted(left + right for left in leftRecords for right in rightRecords if left[leftKey] == right[rightKey])
+
+
+@pytest.fixture
+def partitions(monkeypatch):  # 内表超过5行就分区，每层分3个区，记录分了几次区
+    monkeypatch.setattr(Joiner, 'buildSize', 5)
+    monkeypatch.setattr(Joiner, 'partitionNum', 3)
+    monkeypatch.setattr(Joiner, 'blockSize', 2)
+    depths = []
+    partition = Joiner.partition
+    monkeypatch.setattr(Joiner, 'partition', lambda self, records, keyIndex, depth: depths.append(depth) or partition(self, records, keyIndex, depth))
+    return depths
+
+
+@pytest.mark.parametrize('leftNum, rightNum, keyNum', [(0, 10, 3), (4, 5, 3), (40, 60, 7), (50, 50, 1), (200, 30, 100)])
+@pytest.mark.parametrize('inner', [0, 1])
+def testHashJoinMatchesModel(partitions, leftNum, rightNum, keyNum, inner):
+    # 内表放不下时分区后逐个分区连接；所有key都相同时再分也分不开，到maxDepth层为止，结果仍然正确
+    rng = random.Random(leftNum + rightNum)
+    leftRecords = [[i, rng.randrange(keyNum)] for i in range(leftNum)]
+    rightRecords = [[rng.randrange(keyNum), -i] for i in range(rightNum)]
+    rows = Joiner(1, 0).hashJoin(iter(leftRecords), iter(rightRecords), inner)
+    assert sorted(rows) == joinModel(leftRecords, rightRecords, 1, 0)
+    buildNum = (leftNum, rightNum)[inner]
+    assert (partitions != []) == (buildNum > Joiner.buildSize)
+    assert max(partitions, default=0) < Joiner.maxDepth
+
+
+@pytest.mark.parametrize('inner', [0, 1])
+def testIndexNestedLoopJoinBatchesLookups(monkeypatch, inner):
+    # 外表的记录攒成一批一起查找，批的大小从firstBatchSize加倍到maxBatchSize，结果按外表的顺序返回
+    monkeypatch.setattr(Joiner, 'firstBatchSize', 2)
+    monkeypatch.setattr(Joiner, 'maxBatchSize', 8)
+    innerRecords = [[i % 9, i] for i in range(40)]
+    outerRecords = [[-i, i % 13] for i in range(50)]
+    batches = []
+
+    def lookup(keys):
+        batches.append(len(keys))
+        return [[record for record in innerRecords if record[0] == key] for key in keys]
+
+    joiner = Joiner(0, 1) if inner == 0 else Joiner(1, 0)
+    rows = list(joiner.indexNestedLoopJoin(iter(outerRecords), lookup, inner))
+    if inner == 0:
+        assert sorted(rows) == joinModel(innerRecords, outerRecords, 0, 1)
+        assert [row[2:] for row in rows] == [outer for outer in outerRecords for inner in innerRecords if inner[0] == outer[1]]
+    else:
+        assert sorted(rows) == joinModel(outerRecords, innerRecords, 1, 0)
+    assert batches == [2, 4, 8, 8, 8, 8, 8, 4]
+
+
+@pytest.fixture
+def joinTables(api):
+    # a.x和b.y上有B+树索引，b.yc上有哈希索引，两边都可以作内表
+    api.createTable('a', [column('id', isUnique=True), column('x'), column('xf', 'float'), column('xc', 'char', 4)], 'id')
+    api.createTable('b', [column('id', isUnique=True), column('y'), column('yf', 'float'), column('yc', 'char', 4)], 'id')
+    api.createIndex('xidx', 'a', 'x')
+    api.createIndex('yidx', 'b', 'y')
+    api.createIndex('yfidx', 'b', 'yf')
+    api.createIndex('ycidx', 'b', 'yc', using='hash')
+    aRows = [[i, i % 50, (i % 40) / 4, f'k{i % 30}'] for i in range(400)]
+    bRows = [[i, i % 70, (i % 45) / 4, f'k{i % 35}'] for i in range(600)]
+    api.insertMany('a', aRows)
+    api.insertMany('b', bRows)
+    api.delete('b', [{'lVal': 'id', 'operator': '<', 'rVal': 20}])
+    return api, aRows, bRows[20:]
+
+
+joinWheres = [
+    ([], lambda row: True),
+    ([{'lVal': 'a.id', 'operator': '<', 'rVal': 100}], lambda row: row[0] < 100),
+    ([{'lVal': 'xf', 'operator': '>=', 'rVal': 5}, {'lVal': 'b.id', 'operator': '>', 'rVal': 300}],
+     lambda row: row[2] >= 5 and row[4] > 300),
+]
+
+
+@pytest.mark.parametrize('method', ['hashJoin', 'grace', 'indexNestedLoop'])
+@pytest.mark.parametrize('on', [('x', 'y'), ('b.yf', 'a.xf'), ('a.xc', 'b.yc')])
+@pytest.mark.parametrize('wheres, predicate', joinWheres)
+def testJoinMatchesModel(joinTables, partitions, monkeypatch, capsys, method, on, wheres, predicate):
+    # 哈希连接、分区的哈希连接和索引嵌套循环连接的结果都和嵌套循环的模型一致
+    api, aRows, bRows = joinTables
+    if method == 'indexNestedLoop':  # 顺序读页很贵时不全表扫描内表，随机读页很贵时不在索引中查找
+        monkeypatch.setattr(Planner, 'seqPageCost', 1e9)
+    else:
+        monkeypatch.setattr(Planner, 'randomPageCost', 1e9)
+        if method == 'hashJoin':
+            monkeypatch.setattr(Joiner, 'buildSize', 100000)
+    keyIndex = {'x': 1, 'xf': 2, 'xc': 3, 'y': 1, 'yf': 2, 'yc': 3}
+    leftKey, rightKey = sorted((name.split('.')[-1] for name in on), key=lambda name: name[0])
+    expected = [row for row in joinModel(aRows, bRows, keyIndex[leftKey], keyIndex[rightKey]) if predicate(row)]
+    capsys.readouterr()
+
+    rows = api.openCursor('a', ['*'], wheres, join=('b',) + on).fetchall()
+    out = capsys.readouterr().out
+    assert ('索引嵌套循环连接' in out) == (method == 'indexNestedLoop')
+    assert (partitions != []) == (method == 'grace')
+    assert sorted(rows) == expected
+
+    cursor = api.openCursor('a', ['b.id', 'a.id'], wheres, limit=7, offset=3, orderBy=('b.id', 'desc'), join=('b',) + on)
+    assert cursor.description == ['b.id', 'a.id']
+    assert [row[0] for row in cursor.fetchall()] == sorted((row[4] for row in expected), reverse=True)[3:10]
+
+
+@pytest.mark.parametrize('tableName, attributes, join', [
+    ('a', ['*'], ('a', 'x', 'x')),  # 表和它自己连接
+    ('a', ['*'], ('b', 'xc', 'y')),  # 类型不同
+    ('a', ['*'], ('b', 'x', 'a.id')),  # 两个字段都属于a
+    ('a', ['id'], ('b', 'x', 'y')),  # id在两个表中都有
+    ('a', ['c.id'], ('b', 'x', 'y')),
+    ('a', ['count(*)'], ('b', 'x', 'y')),
+    ('a', ['*'], ('nosuch', 'x', 'y')),
+    ('a', ['*'], ('b', 'x', 'nosuch')),
+])
+def testInvalidJoinIsRejected(joinTables, tableName, attributes, join):
+    api, _, _ = joinTables
+    with pytest.raises(QueryException):
+        api.openCursor(tableName, attributes, [], join=join)
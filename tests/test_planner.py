@@ -0,0 +1,80 @@
+import operator as op
+
+import pytest
+
+from conftest import column, selectAll
+from exception import QueryException
+
+
+@pytest.fixture
+def table(api):
+    api.createTable('t', [column('id', isUnique=True), column('g'), column('score', 'float'),
+                          column('name', 'char', 4)], 'id')
+    api.createIndex('gidx', 't', 'g')
+    api.createIndex('namehidx', 't', 'name', using='hash')
+    api.insertMany('t', [[i, i % 5, i / 2, f'n{i}'] for i in range(300)])
+    return api
+
+
+@pytest.mark.parametrize('lVal, rVal', [('g', '2'), ('id', 'x'), ('score', 'x'), ('name', 3), ('id', None)])
+@pytest.mark.parametrize('operator', ['=', '<', '>=', '<>'])
+def testWrongTypeLiteralIsRejected(table, lVal, rVal, operator):
+    # 类型不对的值不能让优化器选中索引，再在 array('i') / array('d') 上bisect出TypeError
+    wheres = [{'lVal': lVal, 'operator': operator, 'rVal': rVal}]
+    with pytest.raises(QueryException):
+        table.openCursor('t', ['*'], wheres)
+    with pytest.raises(QueryException):
+        table.openCursor('t', ['count(*)'], wheres)
+    with pytest.raises(QueryException):
+        table.openCursor('t', ['*'], wheres, orderBy=('g', 'asc'))
+    with pytest.raises(QueryException):
+        table.delete('t', wheres)
+    assert len(selectAll(table, 't')) == 300
+
+
+def testNumericLiteralsOnIndexedColumns(table):
+    # int字段和float值、float字段和int值可以比较，走索引的结果和全表扫描一致
+    for lVal, rVal in [('g', 2.0), ('g', 2.5), ('id', 7.0), ('score', 3)]:
+        for operator in ['=', '<', '>=']:
+            wheres = [{'lVal': lVal, 'operator': operator, 'rVal': rVal}]
+            compare = {'=': op.eq, '<': op.lt, '>=': op.ge}[operator]
+            index = {'id': 0, 'g': 1, 'score': 2}[lVal]
+            expected = [[i, i % 5, i / 2, f'n{i}'] for i in range(300) if compare([i, i % 5, i / 2][index], rVal)]
+            assert sorted(selectAll(table, 't', wheres)) == expected, (lVal, operator, rVal)
+
+
+def testIndexedLookupsDoNotScanForStats(openApi, monkeypatch):
+    # 第一次查询一个表时，有索引的字段的统计信息来自索引，不为估计代价扫描全表
+    from bufferMgr import BufferMgr
+    api = openApi()
+    api.createTable('t', [column('id', isUnique=True), column('g'), column('score', 'float'),
+                          column('name', 'char', 6)], 'id')
+    api.createIndex('gidx', 't', 'g')
+    api.createIndex('namehidx', 't', 'name', using='hash')
+    rows = [[i, i % 1000, i / 4, f'n{i % 500}'] for i in range(20000)]
+    api.insertMany('t', rows)
+    api.close()
+
+    api = openApi()
+    scans = []
+    scanRecords = BufferMgr.scanRecords
+    monkeypatch.setattr(BufferMgr, 'scanRecords', lambda self, tableName: scans.append(tableName) or scanRecords(self, tableName))
+    checks = [
+        ([{'lVal': 'id', 'operator': '=', 'rVal': 5}], 'indexScan', lambda row: row[0] == 5),
+        ([{'lVal': 'g', 'operator': '=', 'rVal': 3}], 'indexScan', lambda row: row[1] == 3),
+        ([{'lVal': 'name', 'operator': '=', 'rVal': 'n7'}], 'indexScan', lambda row: row[3] == 'n7'),
+        ([{'lVal': 'id', 'operator': '<', 'rVal': 50}, {'lVal': 'score', 'operator': '>', 'rVal': 3}], 'indexScan',
+         lambda row: row[0] < 50 and row[2] > 3),
+        ([{'lVal': 'g', 'operator': '>=', 'rVal': 0}], 'seqScan', lambda row: True),
+    ]
+    for wheres, method, predicate in checks:
+        assert api.planner.plan('t', wheres).method == method, wheres
+        assert sorted(selectAll(api, 't', wheres)) == [row for row in rows if predicate(row)]
+    assert scans == []
+    assert 800 < api.planner.getColumnStats('t', 'g').distinctNum < 1200
+    assert 400 < api.planner.getColumnStats('t', 'name').distinctNum < 600
+
+    # 只有没有索引的字段上的条件时本来就要全表扫描，这时才扫描统计
+    assert api.planner.plan('t', [{'lVal': 'score', 'operator': '>', 'rVal': 4000}]).method == 'seqScan'
+    assert scans == ['t']
+    assert api.planner.getColumnStats('t', 'score').maxValue == 19999 / 4
@@ -0,0 +1,130 @@
+import os
+import subprocess
+import sys
+import textwrap
+
+import pytest
+
+from conftest import column, selectAll, checkIndexAgainstScan
+from logMgr import LogMgr
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def runAndCrash(dbPath, body):
+    # 在子进程中打开数据库，执行body（其中的api是打开的Api），然后不保存、直接os._exit，模拟崩溃
+    script = f'import os, sys\nsys.path.insert(0, {ROOT!r})\nfrom api import Api\napi = Api({dbPath!r})\n' \
+        + textwrap.dedent(body) + '\nos._exit(0)\n'
+    subprocess.run([sys.executable, '-c', script], check=True, stdout=subprocess.DEVNULL)
+
+
+def createTable(api):
+    api.createTable('t', [column('id', isUnique=True), column('g'), column('name', 'char', 8)], 'id')
+    api.createIndex('gidx', 't', 'g')
+    api.createIndex('namehidx', 't', 'name', using='hash')
+
+
+def expectedRows(ids):
+    return sorted([i, i % 5, f'n{i}'] for i in ids)
+
+
+def testCommittedChangesSurviveCrash(openApi, dbPath, capsys):
+    api = openApi()
+    createTable(api)
+    api.close()
+
+    runAndCrash(dbPath, '''
+        api.insertMany('t', [[i, i % 5, f'n{i}'] for i in range(200)])
+        for i in range(200, 210):
+            api.insert('t', [i, i % 5, f'n{i}'])
+        api.delete('t', [{'lVal': 'g', 'operator': '=', 'rVal': 3}])
+        api.insert('t', [3, 3, 'n3'])  # 插入到刚删掉的空洞里
+        api.commit()
+    ''')
+    capsys.readouterr()
+    api = openApi()
+    assert '重放了 0 条' not in capsys.readouterr().out
+
+    ids = [i for i in range(210) if i % 5 != 3] + [3]
+    assert sorted(selectAll(api, 't')) == expectedRows(ids)
+    assert api.openCursor('t', ['count(*)'], []).fetchall() == [[len(ids)]]
+    checkIndexAgainstScan(api, 't', 'id', missingKeys=[8, 13])
+    checkIndexAgainstScan(api, 't', 'g')
+    checkIndexAgainstScan(api, 't', 'name', missingKeys=['n8', 'n13'])
+    assert os.path.getsize(api.logMgr.logFile) == api.logMgr.validSize  # 恢复之后做了检查点
+
+
+@pytest.mark.parametrize('damage', ['torn', 'badCrc'])
+def testDamagedTailRecordIsIgnored(openApi, dbPath, damage):
+    api = openApi()
+    createTable(api)
+    api.close()
+
+    runAndCrash(dbPath, '''
+        for i in range(20):
+            api.insert('t', [i, i % 5, f'n{i}'])
+        api.commit()
+    ''')
+    logFile = os.path.join(dbPath, 'dbfiles/logs/redo.log')
+    with open(logFile, 'rb+') as file:
+        size = os.path.getsize(logFile)
+        if damage == 'torn':  # 最后一条日志只写了一半
+            file.truncate(size - 7)
+        else:  # 最后一条日志的内容和校验和对不上
+            file.seek(size - 1)
+            last = file.read(1)
+            file.seek(size - 1)
+            file.write(bytes([last[0] ^ 0xff]))
+
+    api = openApi()
+    assert sorted(selectAll(api, 't')) == expectedRows(range(19))
+    checkIndexAgainstScan(api, 't', 'id', missingKeys=[19])
+    checkIndexAgainstScan(api, 't', 'name', missingKeys=['n19'])
+    api.insert('t', [19, 4, 'n19'])  # 丢掉的那条可以重新插入
+    assert api.openCursor('t', ['count(*)'], []).fetchall() == [[20]]
+
+
+def testCheckpointTruncatesLog(openApi, dbPath, capsys):
+    api = openApi()
+    createTable(api)
+    for i in range(50):
+        api.insert('t', [i, i % 5, f'n{i}'])
+    assert os.path.getsize(api.logMgr.logFile) > 0
+    api.checkpoint()
+    checkpointSize = LogMgr.headerStruct.size + LogMgr.recordStruct.size  # 只剩一条检查点日志
+    assert os.path.getsize(api.logMgr.logFile) == checkpointSize
+    assert list(api.logMgr.readRecords()) == []
+    api.close()
+
+    runAndCrash(dbPath, '''
+        api.insert('t', [100, 0, 'n100'])
+        api.checkpoint()
+        api.insert('t', [101, 1, 'n101'])
+        api.commit()
+    ''')
+    capsys.readouterr()
+    api = openApi()
+    assert '重放了 1 条' in capsys.readouterr().out  # 检查点之前的修改不再重放
+    assert sorted(selectAll(api, 't')) == expectedRows(list(range(50)) + [100, 101])
+    checkIndexAgainstScan(api, 't', 'id')
+
+
+def testCrashInsideCheckpointKeepsRowCount(openApi, dbPath):
+    # 检查点已经写完数据文件和 rowNums.json、还没有清空日志时崩溃：重放的日志不能再计入行数，空洞链表也不能乱
+    api = openApi()
+    createTable(api)
+    api.close()
+
+    runAndCrash(dbPath, '''
+        api.insertMany('t', [[i, i % 5, f'n{i}'] for i in range(100)])
+        api.delete('t', [{'lVal': 'g', 'operator': '<', 'rVal': 2}])
+        api.logMgr.truncate = lambda: os._exit(0)
+        api.checkpoint()
+    ''')
+    api = openApi()
+    ids = [i for i in range(100) if i % 5 >= 2]
+    assert api.openCursor('t', ['count(*)'], []).fetchall() == [[len(ids)]]
+    assert sorted(selectAll(api, 't')) == expectedRows(ids)
+    api.insertMany('t', [[i, i % 5, f'n{i}'] for i in range(100, 140)])  # 填进空洞，不能覆盖已有的记录
+    assert sorted(selectAll(api, 't')) == expectedRows(ids + list(range(100, 140)))
+    checkIndexAgainstScan(api, 't', 'g')
@@ -0,0 +1,102 @@
+import random
+
+import pytest
+
+from conftest import column
+from exception import QueryException
+from planner import Planner
+from sorter import Sorter
+
+
+@pytest.fixture
+def spills(monkeypatch):  # 每个run只放7行，记录写了几个临时文件
+    monkeypatch.setattr(Sorter, 'runSize', 7)
+    monkeypatch.setattr(Sorter, 'blockSize', 3)
+    files = []
+    spill = Sorter.spill
+    monkeypatch.setattr(Sorter, 'spill', lambda self, run: files.append(spill(self, run)) or files[-1])
+    return files
+
+
+@pytest.mark.parametrize('n', [0, 1, 6, 7, 8, 50, 301])
+@pytest.mark.parametrize('reverse', [False, True])
+@pytest.mark.parametrize('rowLimit', [None, 3, 20])
+def testSortMatchesStableSort(spills, n, reverse, rowLimit):
+    # 外部归并排序和top-N堆的结果都和Python的稳定排序相同：key相同的记录保持原来的先后顺序
+    rng = random.Random(n)
+    records = [[rng.randrange(10), i] for i in range(n)]
+    expected = sorted(records, key=lambda record: record[0], reverse=reverse)[:rowLimit]
+    assert list(Sorter(0, reverse).sort(iter(records), rowLimit))[:rowLimit] == expected
+    if (rowLimit is None or rowLimit > Sorter.runSize) and n >= Sorter.runSize:
+        assert len(spills) == -(-n // Sorter.runSize)
+        assert all(file.closed for file in spills)
+    else:  # 全部放得下，或者LIMIT不超过runSize时用堆，不写临时文件
+        assert spills == []
+
+
+def testClosingSortEarlyRemovesRuns(spills):
+    rows = Sorter(0).sort([[i % 13, i] for i in range(100)])
+    assert next(rows) == [0, 0]
+    assert len(spills) == 15 and not any(file.closed for file in spills)
+    rows.close()
+    assert all(file.closed for file in spills)
+
+
+@pytest.fixture
+def orderTable(api):
+    api.createTable('t', [column('id', isUnique=True), column('g'), column('score', 'float'),
+                          column('name', 'char', 6)], 'id')
+    for keyName in ('g', 'score', 'name'):
+        api.createIndex(f'{keyName}idx', 't', keyName)
+    rng = random.Random(23)
+    ids = rng.sample(range(5000), 2000)
+    api.insertMany('t', [[i, i % 37, rng.randrange(400) / 8, f'n{rng.randrange(999)}'] for i in ids])
+    api.delete('t', [{'lVal': 'g', 'operator': '=', 'rVal': 5}])
+    return api
+
+
+orderWheres = [
+    [],
+    [{'lVal': 'g', 'operator': '>=', 'rVal': 30}],
+    [{'lVal': 'g', 'operator': '<', 'rVal': 10}, {'lVal': 'id', 'operator': '>', 'rVal': 2500}],
+    [{'lVal': 'name', 'operator': '>', 'rVal': 'n5'}],
+]
+
+
+@pytest.mark.parametrize('method', ['indexOrder', 'sort'])
+@pytest.mark.parametrize('orderKey', ['id', 'g', 'score', 'name'])
+@pytest.mark.parametrize('order', ['asc', 'desc'])
+@pytest.mark.parametrize('wheres', orderWheres)
+def testOrderByMatchesModel(orderTable, spills, monkeypatch, method, orderKey, order, wheres):
+    # 沿B+树按顺序读，和读出来后做外部归并排序，结果都按orderKey排好序，且正好是满足条件的全部记录
+    if method == 'indexOrder':  # 排序很贵时沿索引读，随机读页很贵时读出来再排序
+        monkeypatch.setattr(Planner, 'cpuOperatorCost', 1e9)
+    else:
+        monkeypatch.setattr(Planner, 'randomPageCost', 1e9)
+    columnIndex = ['id', 'g', 'score', 'name'].index(orderKey)
+    assert (orderTable.planner.planOrder('t', wheres, orderKey).method == 'indexOrder') == (method == 'indexOrder')
+    expected = sorted(orderTable.openCursor('t', ['*'], wheres).fetchall())
+
+    rows = orderTable.openCursor('t', ['*'], wheres, orderBy=(orderKey, order)).fetchall()
+    assert sorted(rows) == expected
+    keys = [row[columnIndex] for row in rows]
+    assert keys == sorted(keys, reverse=order == 'desc')
+    assert (spills != []) == (method == 'sort' and len(rows) >= Sorter.runSize)
+
+    for limit, offset in [(5, 0), (10, 17), (1000, 3)]:  # 有LIMIT时取出的行在排序键上和完整排序的结果一致
+        page = orderTable.openCursor('t', ['*'], wheres, limit=limit, offset=offset, orderBy=(orderKey, order)).fetchall()
+        assert [row[columnIndex] for row in page] == keys[offset : offset + limit]
+
+
+def testOrderByLimitReadsOnlyFromIndex(orderTable, capsys):
+    # order by 有索引的字段 limit 10 沿B+树只读10条记录，不做全表扫描
+    capsys.readouterr()
+    rows = orderTable.openCursor('t', ['id'], [], limit=10, orderBy=('id', 'desc')).fetchall()
+    assert '全表扫描' not in capsys.readouterr().out
+    assert rows == [[row[0]] for row in sorted(orderTable.openCursor('t', ['id'], []).fetchall(), reverse=True)[:10]]
+
+
+@pytest.mark.parametrize('orderBy', [('nosuch', 'asc'), ('id', 'up')])
+def testInvalidOrderByIsRejected(orderTable, orderBy):
+    with pytest.raises(QueryException):
+        orderTable.openCursor('t', ['*'], [], orderBy=orderBy)